@@ -1,39 +1,87 @@
 # app/app.py
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-import re
-from .database import Base, engine
-from .data import models  # ensure models are imported so tables register
-from .routers import users, tasks
+from .database import check_replicas, engine, shard_session, shards
+from .data.schema import create_schema
+from .routers import users, tasks, metrics, admin
 from .core.errors import AppError
 import json
 from app.core.settings import get_settings
 from app.middleware.error_handler import ErrorHandlingMiddleware
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.profiling import ProfilingMiddleware
+from app.middleware.paths import CollapseSlashesMiddleware
+from app.middleware.request_id import REQUEST_ID_HEADER, RequestIdMiddleware
+from .core.logging import setup_logging
+from .authentication import password_hasher
+from .business import tasks as tasks_service
 
-# Setup logging (if available)
-try:
-    from .core.logging import setup_logging
-except ModuleNotFoundError:
-    pass
-else:
-    setup_logging()
+settings = get_settings()
+setup_logging(fmt=settings.log_format, queue_size=settings.log_queue_size, sample_rates=settings.log_sample_rates)
+logger = logging.getLogger(__name__)
 
 
-settings = get_settings()
-app = FastAPI(title="Task Management API")
-app.add_middleware(ErrorHandlingMiddleware)
+async def _compact_tombstones_periodically(interval: float) -> None:
+    """input: seconds between runs
+       output: None (runs until cancelled)
+       keep the delta-sync tombstone table bounded"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for index in range(len(shards)):
+                with shard_session(index) as db:
+                    await tasks_service.compact_tombstones(db)
+        except Exception:
+            logger.exception("Tombstone compaction failed")
+
+async def _check_replicas_periodically(interval: float) -> None:
+    """input: seconds between checks
+       output: None (runs until cancelled)
+       take failed read replicas out of rotation and bring recovered ones back"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await check_replicas()
+        except Exception:
+            logger.exception("Replica health check failed")
 
 
-@app.middleware("http")
-async def collapse_slashes(request: Request, call_next):
-  """input: Request with path like /register or //register
-     output: Request with normalized path like /register
-     middleware to ensure no double slashes in paths"""
-  path = request.scope.get("path", "")
-  if "//" in path:
-    request.scope["path"] = re.sub(r"/{2,}", "/", path)
-  return await call_next(request)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """input: FastAPI app
+       output: None (context manager around the app's lifetime)
+       start background resources on startup and release them on shutdown"""
+    password_hasher.start()
+    await tasks_service.task_events.start()
+    background = []
+    if settings.tasks_tombstone_compact_interval_seconds > 0:
+        background.append(asyncio.create_task(
+            _compact_tombstones_periodically(settings.tasks_tombstone_compact_interval_seconds)))
+    if settings.database_replica_urls:
+        await check_replicas()
+        background.append(asyncio.create_task(
+            _check_replicas_periodically(settings.db_replica_health_interval_seconds)))
+    yield
+    for task in background:
+        task.cancel()
+    await tasks_service.task_events.stop()
+    password_hasher.shutdown()
+
+
+app = FastAPI(title="Task Management API", lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(ErrorHandlingMiddleware)
+# outside the error handler, so requests are recorded with the status the client gets
+app.add_middleware(MetricsMiddleware, server_timing=settings.server_timing, query_budget=settings.db_query_budget)
+if settings.profile_sample_rate > 0 or settings.profile_slow_ms > 0:
+    app.add_middleware(ProfilingMiddleware, profiler=admin.profiler,
+                       sample_rate=settings.profile_sample_rate, slow_ms=settings.profile_slow_ms,
+                       skip_paths=settings.profile_skip_paths)
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(CollapseSlashesMiddleware)
 
 
 # CORS (prep for a local frontend)
@@ -43,14 +91,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[tasks.NEXT_CURSOR_HEADER, "ETag", REQUEST_ID_HEADER],
 )
 
 # Create DB tables
-Base.metadata.create_all(bind=engine)
+create_schema(engine, shards.engines)
 
 #Routers
 app.include_router(users.router)   
 app.include_router(tasks.router)   
+app.include_router(metrics.router)
+app.include_router(admin.router)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -1,14 +1,20 @@
 import os
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from .database import get_db
+from sqlalchemy import event, inspect
+from .database import DbSession, get_session, primary_read_db, read_db
 from .data import models
+from .data.repositories import directory as directory_repo, users as users_repo
+from .core import metrics
 from .core.settings import get_settings
+from .core.passwords import PasswordHasher, pwd_context
+from .core.cache import TTLCache
+from .core.errors import AdminRequiredError
 
 #This module handles user authentication, including password hashing, JWT token creation, and user retrieval from the database.
 settings = get_settings()
@@ -17,9 +23,31 @@ SECRET_KEY = settings.secret_key
 ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(workers=settings.password_hash_workers,
+                                 max_pending=settings.password_hash_max_pending)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# v1 tokens carry only "sub" (username); v2 adds "uid" (user id) and "iat", so no directory lookup is needed
+TOKEN_VERSION = 2
+
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by the routes: detached from any session, safe to cache."""
+    id: int
+    username: str
+
+
+# token -> Principal; entries never outlive the token's own expiry
+user_cache: "TTLCache[str, Principal]" = TTLCache(maxsize=settings.auth_cache_size,
+                                                  ttl=settings.auth_cache_ttl_seconds)
+metrics.Callback("auth_cache_lookups_total", "Token lookups in the auth cache by result.", ("result",), kind="counter",
+                 read=lambda: {("hit",): user_cache.hits, ("miss",): user_cache.misses})
+metrics.Callback("auth_cache_evictions_total", "Auth cache entries evicted to stay within AUTH_CACHE_SIZE.",
+                 kind="counter", read=lambda: {(): user_cache.evictions})
+metrics.Callback("auth_cache_entries", "Tokens in the auth cache.", kind="gauge",
+                 read=lambda: {(): user_cache.stats()["size"]})
+
 
 def hash_password(password: str) -> str:
     """input: plain text password
@@ -33,24 +61,78 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
        securely verify user passwords"""
     return pwd_context.verify(plain_password, hashed_password)
 
+async def hash_password_async(password: str) -> str:
+    """input: plain text password
+       output: hashed password
+       hash_password on the password worker pool; raises ServiceUnavailableError when saturated"""
+    return await password_hasher.hash(password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """input: plain text password, hashed password
+       output: boolean indicating if the password matches
+       verify_password on the password worker pool; raises ServiceUnavailableError when saturated"""
+    return await password_hasher.verify(plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """input: data dictionary, optional expiration delta
        output: JWT token as a string
        create a JWT token for user authentication"""
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.now(timezone.utc)
+    expire = now + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire, "iat": now, "ver": TOKEN_VERSION})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.User:
-    """input: database session, JWT token
-       output: User object if token is valid, raises HTTPException if not
-       retrieves the current user based on the provided JWT token"""
-    credentials_exception = HTTPException(
+def create_user_token(user: models.User) -> str:
+    """input: User object
+       output: JWT token as a string
+       create a current-version token carrying both the username (sub) and the numeric user id (uid)"""
+    return create_access_token({"sub": user.username, "uid": user.id})
+
+def invalidate_user_cache(*, user_id: Optional[int] = None, username: Optional[str] = None) -> int:
+    """input: user_id and/or username
+       output: number of cached tokens dropped
+       Call whenever a user is deleted or its credentials change, so cached tokens stop authenticating.
+       Only this process's cache is cleared: other workers keep serving the tokens they cached for up to
+       AUTH_CACHE_TTL_SECONDS, then check them against users.tokens_valid_after again."""
+    return user_cache.discard_where(lambda p: p.id == user_id or p.username == username)
+
+@event.listens_for(models.User, "after_delete")
+def _user_deleted(mapper, connection, target: models.User) -> None:
+    invalidate_user_cache(user_id=target.id, username=target.username)
+
+@event.listens_for(models.User, "before_update")
+def _revoke_tokens(mapper, connection, target: models.User) -> None:
+    # written with the change itself, so every worker sees the revocation once its cached entry expires.
+    # iat has whole seconds: a token issued in the same second (a new login right after) stays valid
+    state = inspect(target)
+    if state.attrs.password_hash.history.has_changes() or state.attrs.username.history.has_changes():
+        target.tokens_valid_after = int(time.time())
+
+@event.listens_for(models.User, "after_update")
+def _user_updated(mapper, connection, target: models.User) -> None:
+    state = inspect(target)
+    if state.attrs.password_hash.history.has_changes() or state.attrs.username.history.has_changes():
+        invalidate_user_cache(user_id=target.id)
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def get_current_user(db: DbSession = Depends(get_session), token: str = Depends(oauth2_scheme)) -> Principal:
+    """input: database session, JWT token
+       output: Principal (id, username) if token is valid, raises HTTPException if not
+       retrieves the current user based on the provided JWT token: from user_cache when possible,
+       otherwise from the token claims (v2) or the directory (legacy v1 tokens), after checking on the
+       user's primary that the user exists and the token was issued after its tokens_valid_after"""
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+
+    credentials_exception = _credentials_exception()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -59,7 +141,31 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
     except JWTError:
         raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
+    uid = payload.get("uid") if payload.get("ver", 1) >= 2 else None
+    if uid is not None:
+        principal = Principal(id=int(uid), username=username)
+    else:
+        user_id = await read_db(db, directory_repo.find_user_id, username)
+        if user_id is None:
+            raise credentials_exception
+        principal = Principal(id=user_id, username=username)
+    # once per token and AUTH_CACHE_TTL_SECONDS: the entry is cached below
+    valid_after = await primary_read_db(db, users_repo.get_tokens_valid_after, user_id=principal.id)
+    if valid_after is None or payload.get("iat", 0) < valid_after:
         raise credentials_exception
-    return user
\ No newline at end of file
+    user_cache.set(token, principal, ttl=payload["exp"] - time.time())
+    return principal
+
+async def get_current_user_id(db: DbSession = Depends(get_session), token: str = Depends(oauth2_scheme)) -> int:
+    """input: database session, JWT token
+       output: id of the authenticated user
+       dependency for routes that only need the owner id: never loads a User object"""
+    return (await get_current_user(db, token)).id
+
+async def get_admin_user(principal: Principal = Depends(get_current_user)) -> Principal:
+    """input: the authenticated user
+       output: the same Principal if the user is listed in ADMIN_USERNAMES, raises AdminRequiredError if not
+       dependency for /admin endpoints"""
+    if principal.username not in settings.admin_usernames:
+        raise AdminRequiredError()
+    return principal
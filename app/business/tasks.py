@@ -1,47 +1,275 @@
+import csv
 import logging
-from sqlalchemy.orm import Session
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import Row
+from starlette.concurrency import run_in_threadpool
+from ..database import DbSession, read_db, run_db, stream_rows
+from .. import schemas
+from ..core.errors import AppError, BatchTooLargeError, ImportFormatError
+from ..core.events import RESYNC_EVENT, Event, Subscription, create_broker
+from ..core.ingest import iter_records
+from ..core.serialization import task_rows_to_csv, task_rows_to_ndjson
+from ..core.settings import get_settings
 from ..data import models
 from ..data.repositories import tasks as tasks_crud
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
-def add_task(db: Session, *, current_user: models.User, description: str) -> models.Task:
-    """input: description of the task to be added
-        output: the created task object 
+# task change events, started/stopped by the app lifespan
+task_events = create_broker(settings.events_broker, queue_size=settings.events_queue_size,
+                            sqlite_path=settings.events_sqlite_path,
+                            poll_interval=settings.events_poll_interval_seconds)
+
+def _task_dict(task) -> Dict[str, Any]:
+    if isinstance(task, dict):
+        return {k: task[k] for k in ("id", "user_id", "description", "completed")}
+    return {"id": task.id, "user_id": task.user_id, "description": task.description, "completed": task.completed}
+
+async def _publish(user_id: int, *events: Event) -> None:
+    """input: user id, events
+       output: None
+       Push changes to the user's listeners; called after commit, never fails the write"""
+    try:
+        await task_events.publish_many(user_id, list(events))
+    except Exception:
+        logger.exception("Publishing task event failed for user %s", user_id)
+
+def subscribe(user_id: int) -> Subscription:
+    """input: user id
+       output: Subscription receiving the user's task change events"""
+    return task_events.subscribe(user_id)
+
+def unsubscribe(sub: Subscription) -> None:
+    task_events.unsubscribe(sub)
+
+async def get_version(db: DbSession, *, user_id: int) -> int:
+    """input: user id
+       output: current version of the user's task list
+       Cheap lookup used to answer conditional GETs before loading any task"""
+    return await read_db(db, tasks_crud.get_version, user_id=user_id)
+
+async def get_stats(db: DbSession, *, user_id: int) -> Dict[str, int]:
+    """input: user id
+       output: {"total", "completed", "open"} task counts
+       Task counts of the given user, from the counters kept up to date by every write"""
+    total, completed = await read_db(db, tasks_crud.get_stats, user_id=user_id)
+    return {"total": total, "completed": completed, "open": total - completed}
+
+async def add_task(db: DbSession, *, user_id: int, description: str) -> models.Task:
+    """input: user id, description of the task to be added
+        output: the created task object
         Create and persist a new task for the given user"""
-    task = tasks_crud.create_task(db, user_id=current_user.id, description=description)
-    logger.info("Task created successfully for user %s: %s", current_user.username, task.description)
+    task = await run_db(db, tasks_crud.create_task, user_id=user_id, description=description)
+    logger.info("Task %d created for user %s", task.id, user_id)
+    await _publish(user_id, {"type": "upsert", "revision": task.revision, "task": _task_dict(task)})
     return task
 
-def list_tasks(db: Session, *, current_user: models.User):
-    """input: current user
-       output: list of tasks for the user
-       List all tasks for the given user"""
-    list_task = tasks_crud.list_for_user(db, user_id=current_user.id) 
-    logger.info("Listed tasks for user %s: %d tasks found", current_user.username, len(list_task))  
-    return list_task
+async def list_tasks(db: DbSession, *, user_id: int, limit: int, after: Optional[int] = None,
+                     completed: Optional[bool] = None, order: str = "asc") -> Tuple[List[Row], Optional[int]]:
+    """input: user id, page size, optional cursor, completed filter and order
+       output: (page of (id, user_id, description, completed) rows, cursor of the next page or None)
+       List one page of tasks for the given user"""
+    # fetch one extra row to learn whether another page exists
+    list_task = await read_db(db, tasks_crud.list_rows_for_user, user_id=user_id, limit=limit + 1, after=after,
+                              completed=completed, order=order)
+    next_cursor = None
+    if len(list_task) > limit:
+        list_task = list_task[:limit]
+        next_cursor = list_task[-1].id
+    logger.info("Listed tasks for user %s: %d tasks found", user_id, len(list_task))
+    return list_task, next_cursor
 
-def update_task(db: Session, *, current_user: models.User, task_id: int, description=None, completed=None) -> models.Task:
-    """input: current user, task_id, optional description and completed status
+async def update_task(db: DbSession, *, user_id: int, task_id: int, description=None, completed=None) -> models.Task:
+    """input: user id, task_id, optional description and completed status
        output: the updated task object
        Update an existing task for the given user"""
-    task = tasks_crud.update_task(db, user_id=current_user.id, task_id=task_id, description=description, completed=completed)
-    logger.info("Task updated successfully for user %s: %s", current_user.username, task.description)
+    task = await run_db(db, tasks_crud.update_task, user_id=user_id, task_id=task_id,
+                        description=description, completed=completed)
+    logger.info("Task %d updated for user %s", task.id, user_id)
+    await _publish(user_id, {"type": "upsert", "revision": task.revision, "task": _task_dict(task)})
     return task
 
-def delete_task(db: Session, *, current_user: models.User, task_id: int) -> None:
-    """input: current user, task_id
+async def delete_task(db: DbSession, *, user_id: int, task_id: int) -> None:
+    """input: user id, task_id
        output: None
        Delete a task for the given user"""
-    tasks_crud.delete_task(db, user_id=current_user.id, task_id=task_id)
-    logger.info("Task deleted successfully for user %s: Task ID %d", current_user.username, task_id)
+    revision = await run_db(db, tasks_crud.delete_task, user_id=user_id, task_id=task_id)
+    logger.info("Task deleted successfully for user %s: Task ID %d", user_id, task_id)
+    await _publish(user_id, {"type": "delete", "revision": revision, "id": task_id})
     return None
 
-def get_task(db: Session, *, current_user: models.User, task_id: int) -> models.Task:
-    """input: current user, task_id
+# words of a search query; everything else (operators, quotes, punctuation) is dropped
+_SEARCH_TERM = re.compile(r"\w+")
+_SEARCH_MAX_TERMS = 8
+
+async def search_tasks(db: DbSession, *, user_id: int, q: str, limit: int, offset: int = 0) -> Tuple[List[Row], Optional[int]]:
+    """input: user id, free-text query, page size, offset
+       output: (page of (id, user_id, description, completed) rows best match first, offset of the next page or None)
+       Full-text search in the given user's tasks; every word must match (as a prefix)"""
+    terms = _SEARCH_TERM.findall(q)[:_SEARCH_MAX_TERMS]
+    if not terms:
+        return [], None
+    rows = await read_db(db, tasks_crud.search, user_id=user_id, terms=terms, limit=limit + 1, offset=offset)
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    logger.info("Searched tasks for user %s: %d terms, %d results", user_id, len(terms), len(rows))
+    return rows, next_offset
+
+async def get_task(db: DbSession, *, user_id: int, task_id: int) -> models.Task:
+    """input: user id, task_id
        output: the task object
        Retrieve a specific task for the given user"""
-    task = tasks_crud.get_owned(db, user_id=current_user.id, task_id=task_id)
-    logger.info("Retrieved task for user %s: %s", current_user.username, task.description)
+    task = await read_db(db, tasks_crud.get_owned, user_id=user_id, task_id=task_id)
+    logger.info("Retrieved task %d for user %s", task.id, user_id)
     return task
 
+async def list_changes(db: DbSession, *, user_id: int, since: int, after: Optional[int] = None,
+                       limit: int) -> Tuple[int, List[Row], List[Row], Optional[Tuple[int, int]]]:
+    """input: user id, sync point (version from a previous call, 0 for a full sync), page cursor, max changes
+       output: (current version, changed task rows, deleted (task_id, revision) rows, next page cursor or None)
+       Task changes for the given user since a version, one page at a time"""
+    version, upserts, deletes, next_page = await read_db(db, tasks_crud.list_changes, user_id=user_id, since=since,
+                                                         after=after, limit=limit)
+    logger.info("Changes for user %s since %d: %d upserts, %d deletes", user_id, since, len(upserts), len(deletes))
+    return version, upserts, deletes, next_page
+
+async def compact_tombstones(db: DbSession) -> int:
+    """input: None
+       output: number of tombstones removed
+       Drop delete tombstones older than the configured retention"""
+    before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=settings.tasks_tombstone_retention_hours)
+    removed = await run_db(db, tasks_crud.compact_tombstones, before=before)
+    if removed:
+        logger.info("Compacted %d task tombstones older than %s", removed, before.isoformat())
+    return removed
+
+async def export_tasks(*, user_id: int, fmt: str = "ndjson", gzip: bool = False) -> AsyncIterator[bytes]:
+    """input: user id, format ("ndjson" | "csv"), whether to gzip the output
+       output: async iterator of encoded chunks
+       Stream all tasks of the given user chunk by chunk; memory does not grow with the task count"""
+    compressor = zlib.compressobj(wbits=31) if gzip else None  # wbits=31: gzip container
+    count = 0
+    first = True
+    async for rows in stream_rows(tasks_crud.export_select(user_id=user_id), chunk_size=settings.tasks_export_chunk_size,
+                                  user_id=user_id):
+        data = task_rows_to_csv(rows, header=first) if fmt == "csv" else task_rows_to_ndjson(rows)
+        first = False
+        count += len(rows)
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if fmt == "csv" and first:
+        # no tasks: still a valid CSV file
+        data = task_rows_to_csv((), header=True)
+        yield compressor.compress(data) if compressor is not None else data
+    if compressor is not None:
+        yield compressor.flush()
+    logger.info("Exported %d tasks for user %s as %s%s", count, user_id, fmt, ".gz" if gzip else "")
+
+def _validation_message(e: ValidationError) -> str:
+    err = e.errors()[0]
+    loc = ".".join(str(x) for x in err.get("loc", ()))
+    return f"{loc}: {err['msg']}" if loc else err["msg"]
+
+def _validate_rows(records: List[bytes], *, fmt: str, header: Optional[List[str]],
+                   first_row: int) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """input: raw records, format, CSV header, number of the first record
+       output: (descriptions of the valid rows, (row number, message) of the invalid ones)
+       Validate uploaded rows against TaskCreate"""
+    valid: List[str] = []
+    errors: List[Tuple[int, str]] = []
+    if fmt == "csv":
+        rows = csv.reader(r.decode("utf-8", "replace") for r in records)
+        items = ((dict(zip(header, row)), None) for row in rows)
+    else:
+        items = ((None, r) for r in records)
+    for row, (obj, raw) in enumerate(items, start=first_row):
+        try:
+            task = schemas.TaskCreate.model_validate(obj) if raw is None else schemas.TaskCreate.model_validate_json(raw)
+        except ValidationError as e:
+            errors.append((row, _validation_message(e)))
+            continue
+        valid.append(task.description)
+    return valid, errors
+
+async def import_tasks(db: DbSession, *, user_id: int, body: AsyncIterator[bytes], fmt: str = "ndjson",
+                       gzip: bool = False) -> Dict[str, Any]:
+    """input: user id, the upload as an async iterator of chunks, format ("ndjson" | "csv"), gzip flag
+       output: {"imported", "failed", "errors": [{"row", "message"}]}
+       Bulk create tasks from a streamed file: rows are validated as they arrive and inserted
+       TASKS_IMPORT_CHUNK_SIZE at a time, one transaction per chunk. Invalid rows are skipped and reported;
+       chunks committed before a failure stay imported, and the error's details carry imported and failed"""
+    chunk_size = settings.tasks_import_chunk_size
+    pending: List[str] = []
+    errors: List[Dict[str, Any]] = []
+    imported = failed = 0
+    header: Optional[List[str]] = None
+    row = 1
+
+    async def flush(descriptions: List[str]) -> None:
+        nonlocal imported
+        await run_db(db, tasks_crud.insert_many, user_id=user_id, descriptions=descriptions)
+        imported += len(descriptions)
+        logger.info("Import for user %s: %d tasks imported so far", user_id, imported)
+
+    def with_progress(error: AppError) -> AppError:
+        # without the count a client retrying the whole file would import the committed chunks twice
+        error.details = {**(error.details or {}), "imported": imported, "failed": failed}
+        return error
+
+    try:
+        async for records in iter_records(body, csv=fmt == "csv", gzip=gzip,
+                                          max_record=settings.tasks_import_max_record_bytes,
+                                          max_bytes=settings.tasks_import_max_bytes):
+            if fmt == "csv" and header is None:
+                header = next(csv.reader([records[0].decode("utf-8-sig", "replace")]))
+                if "description" not in header:
+                    raise ImportFormatError("CSV header must contain a 'description' column")
+                records = records[1:]
+            valid, bad = await run_in_threadpool(_validate_rows, records, fmt=fmt, header=header, first_row=row)
+            row += len(records)
+            failed += len(bad)
+            room = settings.tasks_import_max_errors - len(errors)
+            errors.extend({"row": r, "message": m} for r, m in bad[:max(room, 0)])
+            pending.extend(valid)
+            while len(pending) >= chunk_size:
+                await flush(pending[:chunk_size])
+                pending = pending[chunk_size:]
+        if pending:
+            await flush(pending)
+    except zlib.error:
+        raise with_progress(ImportFormatError("Body is not valid gzip"))
+    except AppError as e:
+        raise with_progress(e)
+    finally:
+        if imported:
+            # listeners catch up through GET /tasks/changes instead of receiving one event per row
+            await _publish(user_id, RESYNC_EVENT)
+    logger.info("Import for user %s done: %d imported, %d failed", user_id, imported, failed)
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+async def batch_tasks(db: DbSession, *, user_id: int, operations: List[Dict[str, Any]]) -> List[Tuple[Optional[Dict[str, Any]], Optional[AppError]]]:
+    """input: user id, list of create/update/delete operation dicts
+       output: one (task dict or None, error or None) pair per operation
+       Apply many task operations for the given user in a single transaction"""
+    if len(operations) > settings.tasks_batch_max:
+        raise BatchTooLargeError(len(operations), settings.tasks_batch_max)
+    results = await run_db(db, tasks_crud.apply_batch, user_id=user_id, operations=operations)
+    failed = sum(1 for _, err in results if err is not None)
+    logger.info("Batch applied for user %s: %d operations, %d failed", user_id, len(results), failed)
+    events = [
+        {"type": "delete", "revision": task["revision"], "id": task["id"]} if op["op"] == "delete"
+        else {"type": "upsert", "revision": task["revision"], "task": _task_dict(task)}
+        for op, (task, err) in zip(operations, results) if err is None
+    ]
+    if events:
+        await _publish(user_id, *events)
+    return results
@@ -1,41 +1,62 @@
 import logging
 from typing import Optional
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from ..database import DbSession, primary_read_db, run_db
 from ..core.errors import InvalidPasswordError, UserNotFoundError, UsernameTakenError, InvalidCredentialsError
-from ..authentication import hash_password, verify_password
-from ..data.repositories import users as users_repo
+from ..core.settings import get_settings
+from ..authentication import hash_password_async, verify_password_async
+from ..data.repositories import directory as directory_repo, users as users_repo
 from ..data import models
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
-def register_user(db: Session, *, username: str, password: str) -> models.User:
+async def _find_user(db: DbSession, username: str) -> Optional[models.User]:
+    """input: username
+       output: the user object or None
+       Resolve the username in the directory, then load the user from its shard (primary, also while it is moving)"""
+    user_id = await primary_read_db(db, directory_repo.find_user_id, username)
+    if user_id is None:
+        return None
+    try:
+        return await primary_read_db(db, users_repo.get_by_id, user_id=user_id)
+    except UserNotFoundError:
+        # claimed by a registration that is still running, or that died before creating the user
+        return None
+
+async def register_user(db: DbSession, *, username: str, password: str) -> models.User:
     """input: username and password
        output: the created user object
        Register a new user with the given username and password"""
-    existing = users_repo.find_by_username(db, username)
+    existing = await _find_user(db, username)
     if existing:
-        if verify_password(password, existing.password_hash):
+        if await verify_password_async(password, existing.password_hash):
             logger.info("User %s already exists, returning existing user", username)
             return existing
         logger.warning("Username %s already taken with a different password", username)
         raise UsernameTakenError(username)
 
-    pwd_hash = hash_password(password)
-    user = users_repo.create_user(db, username=username, password_hash=pwd_hash)
+    pwd_hash = await hash_password_async(password)
+    user_id = await run_db(db, directory_repo.reserve_username, username,
+                           grace_seconds=settings.username_reservation_grace_seconds)
+    try:
+        user = await run_db(db, users_repo.create_user, user_id=user_id, username=username, password_hash=pwd_hash)
+    except Exception:
+        await run_db(db, directory_repo.release_username, user_id)
+        raise
     logger.info("User %s registered successfully", username)
     return user
 
-def authenticate_user(db: Session, *, username: str, password: str) -> Optional[models.User]:
+async def authenticate_user(db: DbSession, *, username: str, password: str) -> Optional[models.User]:
     """input: username and password
        output: the authenticated user object or None
        Authenticate a user with the given username and password"""
-    user = users_repo.find_by_username(db, username)
+    user = await _find_user(db, username)
     if not user:
         logger.warning("User %s doesn't exist", username)
         raise UserNotFoundError(username)
     
-    if not verify_password(password, user.password_hash):
+    if not await verify_password_async(password, user.password_hash):
         logger.warning("Authentication failed for user %s", username)
         raise InvalidPasswordError()  
     logger.info("User %s authenticated successfully", username)
@@ -41,6 +41,13 @@ class InvalidPasswordError(AppError):
            Raise when the provided password is incorrect during authentication"""
         super().__init__("INVALID_PASSWORD", "Password is incorrect", 401)
 
+class AdminRequiredError(AppError):
+    def __init__(self):
+        """input: None
+           output: AdminRequiredError with message and HTTP status 403
+           Raise when a non-admin user calls an admin endpoint"""
+        super().__init__("ADMIN_REQUIRED", "This endpoint is for administrators only", 403)
+
 # Tasks
 class TaskNotFoundError(AppError):
     def __init__(self, task_id: int):
@@ -56,6 +63,50 @@ class TaskForbiddenError(AppError):
            Raise when trying to access a task that does not belong to the current user"""
         super().__init__("TASK_FORBIDDEN", "You are not allowed to access this task", 403)
 
+class BatchTooLargeError(AppError):
+    def __init__(self, size: int, limit: int):
+        """input: size (int), limit (int)
+           output: BatchTooLargeError with message and HTTP status 413
+           Raise when a batch request holds more operations than allowed"""
+        super().__init__("BATCH_TOO_LARGE", f"Batch of {size} operations exceeds the limit of {limit}", 413)
+
+class ImportFormatError(AppError):
+    def __init__(self, msg: str):
+        """input: msg (str)
+           output: ImportFormatError with message and HTTP status 400
+           Raise when an uploaded import file cannot be read at all (as opposed to single bad rows)"""
+        super().__init__("INVALID_IMPORT", msg, 400)
+
+class ChangesExpiredError(AppError):
+    def __init__(self, since: int):
+        """input: since (int)
+           output: ChangesExpiredError with message and HTTP status 410
+           Raise when the changes after a sync point are no longer available and the client must reload"""
+        super().__init__("CHANGES_EXPIRED", f"Changes since version {since} are no longer available; reload the task list", 410)
+
+class UserMovingError(AppError):
+    def __init__(self):
+        """input: None
+           output: UserMovingError with message and HTTP status 503
+           Raise when a user's data is being moved to another shard and cannot be written for a moment"""
+        super().__init__("USER_MOVING", "Your data is being moved; retry in a few seconds", 503)
+
+# Admin
+class ProfileNotFoundError(AppError):
+    def __init__(self, profile_id: int):
+        """input: profile_id (int)
+           output: ProfileNotFoundError with message and HTTP status 404
+           Raise when a request profile was never kept or has been pushed out of the buffer"""
+        super().__init__("PROFILE_NOT_FOUND", f"Profile {profile_id} not found", 404)
+
+# Capacity
+class ServiceUnavailableError(AppError):
+    def __init__(self, msg: str = "Service temporarily unavailable"):
+        """input: msg (str)
+           output: ServiceUnavailableError with message and HTTP status 503
+           Raise when a bounded resource is saturated and the request is shed"""
+        super().__init__("SERVICE_UNAVAILABLE", msg, 503)
+
 # DB
 class DatabaseError(AppError):
     def __init__(self, msg: str = "Database error"):
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+import orjson
+from starlette.concurrency import run_in_threadpool
+
+# Purpose: per-user pub/sub of task change events, pushed to clients instead of polling.
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+
+# sent in place of the dropped events when a subscriber falls behind
+RESYNC_EVENT: Event = {"type": "resync"}
+
+
+class Subscription:
+    """One listener: a bounded queue of events for one user.
+
+    A consumer that falls behind does not slow down publishers or grow memory: when its queue
+    is full, the pending events are dropped and replaced by a single resync event, after which
+    the client catches up through GET /tasks/changes."""
+
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.resyncs = 0
+
+    def offer(self, event: Event) -> None:
+        """input: event
+           output: None
+           Enqueue without blocking; on overflow keep only a resync marker."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize() + 1
+            self.resyncs += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+    async def get(self) -> Event:
+        return await self.queue.get()
+
+
+class Broker(ABC):
+    """Broker interface: publish events for a user, subscribe to a user's events."""
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, user_id: int, event: Event) -> None:
+        ...
+
+    async def publish_many(self, user_id: int, events: List[Event]) -> None:
+        for event in events:
+            await self.publish(user_id, event)
+
+    @abstractmethod
+    def subscribe(self, user_id: int) -> Subscription:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, sub: Subscription) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InProcessBroker(Broker):
+    """Fan-out to the subscribers of this process, keyed by user id."""
+
+    def __init__(self, *, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subs: Dict[int, Set[Subscription]] = {}
+        self.published = 0
+
+    def subscribe(self, user_id: int) -> Subscription:
+        sub = Subscription(user_id, self.queue_size)
+        self._subs.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.user_id]
+
+    def deliver(self, user_id: int, event: Event) -> None:
+        """input: user id, event
+           output: None
+           Hand the event to every local subscriber of the user (never blocks)."""
+        for sub in self._subs.get(user_id, ()):
+            sub.offer(event)
+
+    def resync_all(self) -> None:
+        """input: None
+           output: None
+           Events of unknown users were lost: every local subscriber catches up through GET /tasks/changes."""
+        for subs in self._subs.values():
+            for sub in subs:
+                sub.offer(RESYNC_EVENT)
+
+    async def publish(self, user_id: int, event: Event) -> None:
+        self.published += 1
+        self.deliver(user_id, event)
+
+    async def publish_many(self, user_id: int, events: List[Event]) -> None:
+        self.published += len(events)
+        for event in events:
+            self.deliver(user_id, event)
+
+    def stats(self) -> Dict[str, Any]:
+        """input: None
+           output: dict with subscriber counts and events published"""
+        subs = [s for group in self._subs.values() for s in group]
+        return {
+            "broker": type(self).__name__,
+            "users": len(self._subs),
+            "subscribers": len(subs),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subs),
+            "resyncs": sum(s.resyncs for s in subs),
+        }
+
+
+# rows read from the events file per query; a poll reads until it is caught up
+_POLL_BATCH = 1000
+
+
+class SqliteFileBroker(InProcessBroker):
+    """Shares events between the workers of one host through a SQLite file.
+
+    publish() delivers locally at once and appends the event to the file; every worker polls the
+    file once per interval (not once per client) and delivers the rows written by other workers.
+    Rows are pruned after `retention` seconds by any worker; one that had not read them yet (stalled
+    for that long) sends a resync event to all of its subscribers instead of silently skipping them.
+    A local stand-in for a real message broker (Redis, NATS, Postgres LISTEN/NOTIFY)."""
+
+    def __init__(self, path: str, *, queue_size: int = 100, poll_interval: float = 0.2, retention: float = 60.0):
+        super().__init__(queue_size=queue_size)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_id = 0
+        self._poller: Optional[asyncio.Task] = None
+        # one connection shared by the threadpool threads
+        self._lock = threading.Lock()
+
+    def _open(self) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, user_id INTEGER NOT NULL, "
+            "payload BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        # highest id pruned so far, one row: a reader whose cursor is below it has missed events
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_events_pruned (id INTEGER PRIMARY KEY CHECK (id = 0), upto INTEGER NOT NULL)"
+        )
+        conn.execute("INSERT OR IGNORE INTO task_events_pruned (id, upto) VALUES (0, 0)")
+        self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM task_events").fetchone()[0]
+        self._conn = conn
+
+    async def start(self) -> None:
+        await run_in_threadpool(self._open)
+        self._poller = asyncio.create_task(self._poll_forever())
+
+    async def stop(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _append(self, user_id: int, payloads: List[bytes]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO task_events (origin, user_id, payload, created) VALUES (?, ?, ?, ?)",
+                [(self.origin, user_id, payload, now) for payload in payloads],
+            )
+
+    def _read_new(self) -> Tuple[bool, list]:
+        """input: None
+           output: (whether rows after the cursor were pruned unread, the next _POLL_BATCH rows at most)"""
+        with self._lock:
+            # one read transaction: the prune mark and the rows come from the same snapshot
+            self._conn.execute("BEGIN")
+            try:
+                pruned = self._conn.execute("SELECT upto FROM task_events_pruned WHERE id = 0").fetchone()[0]
+                missed = pruned > self._last_id
+                rows = self._conn.execute(
+                    "SELECT id, origin, user_id, payload FROM task_events WHERE id > ? ORDER BY id LIMIT ?",
+                    (max(self._last_id, pruned), _POLL_BATCH),
+                ).fetchall()
+            finally:
+                self._conn.execute("COMMIT")
+        if missed:
+            self._last_id = pruned
+        if rows:
+            self._last_id = rows[-1][0]
+        return missed, rows
+
+    def _prune(self) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                upto = self._conn.execute(
+                    "SELECT MAX(id) FROM task_events WHERE created < ?", (time.time() - self.retention,)
+                ).fetchone()[0]
+                if upto is not None:
+                    self._conn.execute("DELETE FROM task_events WHERE id <= ?", (upto,))
+                    self._conn.execute("UPDATE task_events_pruned SET upto = MAX(upto, ?) WHERE id = 0", (upto,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def publish(self, user_id: int, event: Event) -> None:
+        await self.publish_many(user_id, [event])
+
+    async def publish_many(self, user_id: int, events: List[Event]) -> None:
+        await super().publish_many(user_id, events)
+        if self._conn is not None:
+            await run_in_threadpool(self._append, user_id, [orjson.dumps(e) for e in events])
+
+    async def _poll(self) -> None:
+        """input: None
+           output: None
+           Deliver every row written by other workers since the last poll, _POLL_BATCH at a time."""
+        while True:
+            missed, rows = await run_in_threadpool(self._read_new)
+            if missed:
+                logger.warning("Event broker fell behind the pruned events; subscribers resync")
+                self.resync_all()
+            for _, origin, user_id, payload in rows:
+                if origin != self.origin:
+                    self.deliver(user_id, orjson.loads(payload))
+            if len(rows) < _POLL_BATCH:
+                return
+
+    async def _poll_forever(self) -> None:
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._poll()
+                if time.monotonic() - last_prune > self.retention:
+                    await run_in_threadpool(self._prune)
+                    last_prune = time.monotonic()
+            except Exception:
+                logger.exception("Event broker poll failed")
+
+
+def create_broker(kind: str, *, queue_size: int, sqlite_path: str, poll_interval: float) -> Broker:
+    """input: broker kind ("memory" | "sqlite"), per-subscriber queue size, sqlite file and poll interval
+       output: Broker
+       Picks the broker implementation from the settings."""
+    if kind == "sqlite":
+        return SqliteFileBroker(sqlite_path, queue_size=queue_size, poll_interval=poll_interval)
+    return InProcessBroker(queue_size=queue_size)
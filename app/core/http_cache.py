@@ -0,0 +1,40 @@
+from typing import Optional
+from starlette.responses import Response
+
+# Purpose: helpers for weak ETags and conditional GETs (If-None-Match -> 304).
+
+# clients must revalidate every time, and shared caches must not store per-user lists
+CACHE_CONTROL = "private, no-cache"
+
+def weak_etag(*parts: object) -> str:
+    """input: values identifying the representation (user id, version, query, ...)
+       output: weak ETag string, e.g. W/"7-42-limit=2"
+       Builds a weak ETag from the given parts."""
+    return 'W/"' + "-".join(str(p).replace('"', "") for p in parts) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """input: If-None-Match header value (or None), current ETag
+       output: True if the client's cached copy is current
+       Weak comparison, as required for If-None-Match (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def cache_headers(etag: str) -> dict:
+    """input: ETag
+       output: headers to attach to a cacheable per-user response"""
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Authorization"}
+
+def not_modified(etag: str) -> Response:
+    """input: ETag
+       output: empty 304 response carrying the validators"""
+    return Response(status_code=304, headers=cache_headers(etag))
@@ -0,0 +1,79 @@
+import zlib
+from typing import AsyncIterator, Iterator, List, Optional
+from .errors import ImportFormatError
+
+# Purpose: incremental splitting of streamed uploads (NDJSON / CSV, optionally gzip) into records.
+
+# most bytes inflated per zlib call: a small gzip body may expand to gigabytes
+_INFLATE_STEP = 64 * 1024
+
+async def iter_records(chunks: AsyncIterator[bytes], *, csv: bool = False, gzip: bool = False,
+                       max_record: int, max_bytes: int) -> AsyncIterator[List[bytes]]:
+    """input: the request body as an async iterator of chunks, whether records are CSV, whether the body is gzip,
+              max size of one record and of the whole (decompressed) body in bytes
+       output: async iterator of lists of complete records (bytes, without the trailing newline)
+       Only the unfinished tail of the last chunk is buffered, so memory does not grow with the upload.
+       For CSV a record ends at a newline outside double quotes (quoted fields may span lines).
+       Raises:
+         - ImportFormatError when a record (e.g. a line without end, an unclosed CSV quote) or the body is too large,
+           or when a gzip body ends before its trailer"""
+    inflater = zlib.decompressobj(wbits=31) if gzip else None
+    tail = b""
+
+    def split(data: bytes, final: bool) -> List[bytes]:
+        nonlocal tail
+        data = tail + data
+        records: List[bytes] = []
+        if not csv:
+            lines = data.split(b"\n")
+            tail = b"" if final else lines.pop()
+            records = lines
+        else:
+            # the buffered tail always starts a record, so quote parity restarts there
+            start = pos = 0
+            in_quotes = False
+            while True:
+                nl = data.find(b"\n", pos)
+                if nl < 0:
+                    break
+                if data.count(b'"', pos, nl) % 2:
+                    in_quotes = not in_quotes
+                if not in_quotes:
+                    records.append(data[start:nl])
+                    start = nl + 1
+                pos = nl + 1
+            tail = data[start:]
+            if final and tail:
+                records.append(tail)
+                tail = b""
+        if len(tail) > max_record or (records and max(map(len, records)) > max_record):
+            raise ImportFormatError(f"A record is longer than {max_record} bytes")
+        return [r[:-1] if r.endswith(b"\r") else r for r in records if r.strip()]
+
+    def decoded(chunk: bytes, final: bool) -> List[bytes]:
+        nonlocal total
+        total += len(chunk)
+        if total > max_bytes:
+            raise ImportFormatError(f"Body is larger than {max_bytes} bytes")
+        return split(chunk, final)
+
+    def inflate(chunk: bytes) -> Iterator[bytes]:
+        # one step at a time; the input left over by a step waits in unconsumed_tail
+        yield inflater.decompress(chunk, _INFLATE_STEP)
+        while inflater.unconsumed_tail:
+            yield inflater.decompress(inflater.unconsumed_tail, _INFLATE_STEP)
+
+    total = 0
+    async for chunk in chunks:
+        for part in (inflate(chunk) if inflater is not None else (chunk,)):
+            if part:
+                records = decoded(part, final=False)
+                if records:
+                    yield records
+    last: Optional[bytes] = inflater.flush() if inflater is not None else b""
+    if inflater is not None and not inflater.eof:
+        # the upload stopped before the gzip trailer: the last record may be cut short
+        raise ImportFormatError("Body is not valid gzip")
+    records = decoded(last, final=True)
+    if records:
+        yield records
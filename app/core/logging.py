@@ -1,26 +1,148 @@
+import atexit
 import logging
-import logging.config
-
-def setup_logging():
-    """Configure the logging for the application."""
-    logging.config.dictConfig({
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "default": {"format": "%(asctime)s %(levelname)s %(name)s: %(message)s"},
-        },
-        "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "default",
-                "level": "INFO",
-            },
-        },
-        "loggers": {
-            "":               {"handlers": ["console"], "level": "WARNING"},
-            "uvicorn":        {"level": "WARNING", "propagate": False},
-            "uvicorn.error":  {"level": "WARNING", "propagate": False},
-            "uvicorn.access": {"level": "WARNING", "propagate": False},
-            "app":            {"handlers": ["console"], "level": "INFO", "propagate": False},
-        },
-    })
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+import orjson
+from . import metrics
+
+# Purpose: log records are queued by the request path and written to stderr by one listener thread.
+# The queue is bounded: when the writer falls behind, records are dropped and counted instead of
+# blocking requests. High-volume INFO loggers can be sampled (LOG_SAMPLE_RATES).
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s]: %(message)s"
+
+# id of the request being handled (set by RequestIdMiddleware), copied into every record it logs
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+dropped_records = metrics.Counter("log_records_dropped_total", "Log records dropped because the log queue was full.")
+sampled_out_records = metrics.Counter("log_records_sampled_out_total", "INFO records skipped by LOG_SAMPLE_RATES.",
+                                      ("logger",))
+
+# attributes every LogRecord has; anything else on a record came from extra={...}
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps each record with the current request id (runs in the thread that logs, before queueing)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a share of the INFO-and-below records of the listed loggers; warnings and errors always pass.
+
+    rates: logger name (or parent name, e.g. "app.business") -> share of records kept (0..1)"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, Optional[str]] = {}
+
+    def _rule(self, name: str) -> Optional[str]:
+        # most specific configured name that is the logger or one of its parents
+        rule = self._resolved.get(name, "")
+        if rule == "":
+            candidates = [k for k in self.rates if name == k or name.startswith(k + ".")]
+            rule = self._resolved[name] = max(candidates, key=len) if candidates else None
+        return rule
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rule = self._rule(record.name)
+        if rule is None or random.random() < self.rates[rule]:
+            return True
+        sampled_out_records.inc(rule)
+        return False
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full, and leaves formatting to the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only what must happen now: merge the arguments (they may change later) and render the traceback
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc()
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # on a full queue, wait for the writer to make room rather than fail to stop
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message, request_id, extra fields, exception."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+_listener: Optional[QueueListener] = None
+
+
+def _stop_listener() -> None:
+    """Write out what is still queued and stop the listener thread (also run at exit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
+
+def setup_logging(*, fmt: str = "json", queue_size: int = 10000, sample_rates: Optional[Dict[str, float]] = None) -> None:
+    """input: output format ("json" or "text"), max queued records, per-logger INFO sampling rates
+       output: None
+       Configure the logging for the application: app loggers at INFO, everything else at WARNING,
+       all of it through one bounded queue written to stderr by a background thread."""
+    global _listener
+    _stop_listener()
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    handler = BoundedQueueHandler(queue.Queue(queue_size))
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+    handler.addFilter(RequestIdFilter())
+    _listener = _Listener(handler.queue, output)
+    _listener.start()
+
+    levels = {"": logging.WARNING, "uvicorn": logging.WARNING, "uvicorn.error": logging.WARNING,
+              "uvicorn.access": logging.WARNING, "app": logging.INFO}
+    for name, level in levels.items():
+        logger = logging.getLogger(name)
+        logger.handlers = [handler]
+        logger.setLevel(level)
+        if name:
+            logger.propagate = False
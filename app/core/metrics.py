@@ -0,0 +1,208 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Purpose: in-process metrics rendered in the Prometheus text format (GET /metrics).
+# Standard library only: passwords.py (imported by spawned hash workers) records here too.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class _Metric:
+    """One metric family: a name, help text, label names and one value per label-value tuple."""
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(k, self._snapshot(v)) for k, v in self._values.items()]
+        for key, value in sorted(items):
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _snapshot(self, value):
+        return value
+
+    def _samples(self, key: Tuple[str, ...], value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Bucket counts are kept per bucket and made cumulative when rendered."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), *, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # per-bucket counts (+Inf last), sum
+                series = self._values[labels] = [[0] * (len(self.bounds) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def _snapshot(self, value):
+        return list(value[0]), value[1]
+
+    def _samples(self, key: Tuple[str, ...], value) -> List[str]:
+        counts, total = value
+        lines, running = [], 0
+        for bound, count in zip((*self.bounds, float("inf")), counts):
+            running += count
+            le = f'le="{_format_number(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+        lines.append(f"{self.name}_count{labels} {running}")
+        return lines
+
+
+class Callback(_Metric):
+    """Values read from `read()` (label-value tuple -> value) each time the metric is rendered,
+    for state something else already keeps (e.g. a cache's own counters)."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), *, kind: str,
+                 read: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self._read = read
+
+    def render(self) -> List[str]:
+        values = self._read()
+        with self._lock:
+            self._values = dict(values)
+        return super().render()
+
+
+def render() -> str:
+    """input: None
+       output: every registered metric in the Prometheus text exposition format (version 0.0.4)"""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter("http_requests_total", "HTTP requests by route template and status.",
+                        ("method", "route", "status"))
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency by route template and status.",
+                                  ("method", "route", "status"))
+http_in_progress = Gauge("http_requests_in_progress", "HTTP requests being handled.", ("method",))
+request_db_queries = Histogram("http_request_db_queries", "Database queries run per HTTP request.",
+                               ("route",), buckets=COUNT_BUCKETS)
+request_db_time = Histogram("http_request_db_seconds", "Database time spent per HTTP request.", ("route",))
+db_queries = Counter("db_queries_total", "Database statements executed.")
+db_query_duration = Histogram("db_query_duration_seconds", "Database statement latency.")
+password_hash_duration = Histogram("password_hash_duration_seconds", "bcrypt time per hash or verify.", ("op",),
+                                   buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0))
+password_hash_queue_wait = Histogram("password_hash_queue_wait_seconds",
+                                     "Time a password job waited for a free hash worker.", ("op",))
+password_hash_pending = Gauge("password_hash_pending", "Password jobs queued or running (see PASSWORD_HASH_MAX_PENDING).")
+password_hash_rejected = Counter("password_hash_rejected_total",
+                                 "Password jobs refused with 503 because PASSWORD_HASH_MAX_PENDING were pending.", ("op",))
+
+
+class QueryUsage:
+    """Statements run for the current request; shared with threadpool calls, which copy the context.
+    fingerprints (fingerprint -> count) is only kept when asked for, i.e. when a query budget is set."""
+    __slots__ = ("count", "seconds", "fingerprints")
+
+    def __init__(self, *, fingerprints: bool = False):
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints: Optional[Dict[str, int]] = {} if fingerprints else None
+
+
+request_db_usage: ContextVar[Optional[QueryUsage]] = ContextVar("request_db_usage", default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """input: SQL statement
+       output: the statement with literals replaced by ? and IN lists collapsed, so repeats of one query match"""
+    text = _LITERALS.sub("?", _SPACES.sub(" ", statement).strip())
+    return _LISTS.sub("(?, ...)", text)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - context._metrics_started
+    db_queries.inc()
+    db_query_duration.observe(elapsed)
+    usage = request_db_usage.get()
+    if usage is not None:
+        usage.count += 1
+        usage.seconds += elapsed
+        if usage.fingerprints is not None:
+            key = fingerprint(statement)
+            usage.fingerprints[key] = usage.fingerprints.get(key, 0) + 1
+
+
+def instrument_engine(sync_engine) -> None:
+    """input: a (sync) Engine, e.g. engine or async_engine.sync_engine
+       output: None
+       Count and time every statement the engine runs (globally and for the current request)."""
+    from sqlalchemy import event
+
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,87 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+from passlib.context import CryptContext
+from . import metrics
+from .errors import ServiceUnavailableError
+
+# Purpose: bcrypt work runs here, in worker processes, so it never holds the event loop or the request threadpool.
+# Spawned workers import this module on their own, so keep its imports light (no settings/database).
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _timed(fn: Callable[..., Any], *args: Any) -> Tuple[Any, float, float]:
+    """input: function and its arguments (runs inside a worker)
+       output: (result, wall-clock start time, duration in seconds)
+       Runs fn and reports when it started and how long it took."""
+    started = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, started, time.perf_counter() - t0
+
+def _hash(password: str) -> Tuple[str, float, float]:
+    return _timed(pwd_context.hash, password)
+
+def _verify(password: str, hashed: str) -> Tuple[bool, float, float]:
+    return _timed(pwd_context.verify, password, hashed)
+
+
+class PasswordHasher:
+    """Bounded pool for bcrypt hashing/verification with an awaitable API.
+
+    At most `max_pending` jobs may be queued or running; beyond that callers get
+    ServiceUnavailableError (503) instead of piling up behind a login storm.
+    workers=0 runs the jobs in the default thread executor instead of processes."""
+
+    def __init__(self, *, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+
+    def start(self) -> None:
+        """input: None
+           output: None
+           Create the worker pool (spawned, so workers do not inherit server threads)."""
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self) -> None:
+        """input: None
+           output: None
+           Stop the worker pool; a later call re-creates it on demand."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def hash(self, password: str) -> str:
+        """input: plain text password
+           output: bcrypt hash"""
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        """input: plain text password, bcrypt hash
+           output: True if they match"""
+        return await self._run(_verify, password, hashed)
+
+    async def _run(self, fn: Callable[..., Tuple[Any, float, float]], *args: Any) -> Any:
+        op = "hash" if fn is _hash else "verify"
+        if self._pending >= self.max_pending:
+            metrics.password_hash_rejected.inc(op)
+            raise ServiceUnavailableError("Too many concurrent password operations. Try again later.")
+        self.start()
+        self._pending += 1
+        metrics.password_hash_pending.inc()
+        submitted = time.time()
+        try:
+            result, started, duration = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+            metrics.password_hash_pending.dec()
+        metrics.password_hash_duration.observe(duration, op)
+        metrics.password_hash_queue_wait.observe(max(0.0, started - submitted), op)
+        return result
@@ -0,0 +1,189 @@
+import asyncio
+import itertools
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar, Token
+from types import CodeType, FrameType
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Purpose: wall-clock stack sampling of individual requests, kept as collapsed stacks (flame graph input).
+# One background thread samples every `interval` seconds while a profiled request is running:
+#   - if the request's task is the one running on the event loop, its real stack (CPU on the loop thread)
+#   - otherwise the chain of coroutines it is suspended in, followed by the stack of the worker thread
+#     running its sync DB call (attach_thread) or by "(waiting)" (bcrypt workers, the connection pool,
+#     other requests holding the loop...)
+
+WAITING = "(waiting)"
+
+Stack = Tuple[str, ...]
+
+
+# code object -> "module:qualname", built once per function
+_labels: Dict[CodeType, str] = {}
+
+
+def _label(frame: FrameType) -> str:
+    code = frame.f_code
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+    return label
+
+
+def _thread_stack(frame: Optional[FrameType], root_code) -> Stack:
+    """input: innermost frame of a thread, code object of the frame to start from
+       output: frame labels from that frame (e.g. the task's outermost coroutine) down to the innermost frame;
+       the frames below it (event loop, worker thread loop) are dropped"""
+    frames: List[FrameType] = []
+    while frame is not None:
+        frames.append(frame)
+        if frame.f_code is root_code:
+            break
+        frame = frame.f_back
+    return tuple(_label(f) for f in reversed(frames))
+
+
+def _await_stack(coro: Any) -> Stack:
+    """input: a task's coroutine
+       output: frame labels of the coroutines it is awaiting, outermost first, plus WAITING"""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        labels.append(_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    labels.append(WAITING)
+    return tuple(labels)
+
+
+class _Active:
+    __slots__ = ("task", "root_code", "samples", "threads", "token")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.root_code = getattr(task.get_coro(), "cr_code", None)
+        self.samples: "Counter[Stack]" = Counter()
+        # worker threads running a call for this request: thread id -> code of the frame that attached it
+        self.threads: Dict[int, CodeType] = {}
+        self.token: Optional[Token] = None
+
+
+# the request being profiled, seen by the threadpool calls it makes (they run in a copy of its context)
+_current: ContextVar[Optional[Tuple["Profiler", _Active]]] = ContextVar("profiled_request", default=None)
+
+
+def attach_thread() -> Optional[Tuple["Profiler", _Active]]:
+    """input: None (call on a worker thread, at the start of work done for a request)
+       output: token for detach_thread, None when the request is not profiled
+       While attached, samples of the request show this thread's stack from the caller's frame down."""
+    current = _current.get()
+    if current is not None:
+        profiler, active = current
+        with profiler._lock:
+            active.threads[threading.get_ident()] = sys._getframe(1).f_code
+    return current
+
+
+def detach_thread(current: Optional[Tuple["Profiler", _Active]]) -> None:
+    """input: token from attach_thread
+       output: None"""
+    if current is not None:
+        profiler, active = current
+        with profiler._lock:
+            active.threads.pop(threading.get_ident(), None)
+
+
+class Profiler:
+    """Samples the stacks of the requests being profiled and keeps the last `keep` profiles.
+
+    Thread-safe; the sampling thread is started on first use and sleeps while no request is profiled."""
+
+    def __init__(self, *, interval: float, keep: int):
+        self.interval = interval
+        self.profiles: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self._active: Dict[int, _Active] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._busy = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self) -> int:
+        """input: None (call from the request's task, on the event loop)
+           output: handle for end()
+           Start sampling the current task (and the worker threads it attaches, see attach_thread)."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._loop, self._loop_thread = asyncio.get_running_loop(), threading.get_ident()
+                    self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                    self._thread.start()
+        handle = next(self._ids)
+        active = _Active(asyncio.current_task())
+        active.token = _current.set((self, active))
+        with self._lock:
+            self._active[handle] = active
+            self._busy.set()
+        return handle
+
+    def end(self, handle: int, *, keep: bool, **info: Any) -> None:
+        """input: handle from begin(), whether to store the profile, request details stored with it
+           output: None
+           Stop sampling; a kept profile with at least one sample goes into the ring buffer."""
+        with self._lock:
+            active = self._active.pop(handle)
+            _current.reset(active.token)
+            if not self._active:
+                self._busy.clear()
+            if keep and active.samples:
+                self.profiles.append({
+                    "id": handle, **info, "interval_ms": self.interval * 1e3,
+                    "samples": sum(active.samples.values()), "stacks": active.samples,
+                })
+
+    def get(self, profile_id: int) -> Optional[Dict[str, Any]]:
+        """input: profile id
+           output: the stored profile, or None if it was never kept or already pushed out"""
+        with self._lock:
+            return next((p for p in self.profiles if p["id"] == profile_id), None)
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        """input: None
+           output: stored profiles without their stacks, newest first"""
+        with self._lock:
+            return [{k: v for k, v in p.items() if k != "stacks"} for p in reversed(self.profiles)]
+
+    @staticmethod
+    def collapsed(profile: Dict[str, Any]) -> str:
+        """input: a stored profile
+           output: one "frame;frame;...;frame count" line per distinct stack (flamegraph.pl / speedscope input)"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in profile["stacks"].most_common())
+
+    def _run(self) -> None:
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval)
+            self._sample()
+
+    def _sample(self) -> None:
+        # under the lock, so end() never stores a profile that is still being added to
+        with self._lock:
+            if not self._active:
+                return
+            running = asyncio.current_task(self._loop)
+            frames = sys._current_frames()
+            loop_frame = frames.get(self._loop_thread)
+            for a in self._active.values():
+                if a.task is running:
+                    stack = _thread_stack(loop_frame, a.root_code)
+                else:
+                    stack = _await_stack(a.task.get_coro())
+                    attached = next(iter(a.threads.items()), None)
+                    frame = frames.get(attached[0]) if attached is not None else None
+                    if frame is not None:
+                        stack = stack[:-1] + _thread_stack(frame, attached[1])
+                a.samples[stack] += 1
@@ -0,0 +1,53 @@
+import csv
+import io
+from typing import Iterable, Optional, Sequence, Tuple
+import orjson
+
+# Purpose: fast JSON encoding for hot list endpoints, skipping per-row pydantic models.
+
+def task_rows_to_json(rows: Iterable[Sequence]) -> bytes:
+    """input: rows of (id, user_id, description, completed)
+       output: JSON array of TaskOut objects as bytes
+       Encodes task rows straight to bytes with orjson."""
+    return orjson.dumps([
+        {"id": r[0], "user_id": r[1], "description": r[2], "completed": bool(r[3])} for r in rows
+    ])
+
+def task_changes_to_json(version: int, upserts: Iterable[Sequence], deletes: Iterable[Sequence],
+                         next_page: Optional[Tuple[int, int]] = None) -> bytes:
+    """input: current version, rows of (id, user_id, description, completed, revision), rows of (task_id, revision),
+              (since, after) of the next page or None
+       output: {"version": ..., "changes": [...], "has_more": ...} as bytes, changes ordered by revision then id,
+               plus next_since / next_after when there are more changes
+       A task id can appear as both a delete and a later upsert (SQLite may reuse ids), so order matters."""
+    changes = [
+        ((r[4], r[0]), {"op": "upsert", "revision": r[4],
+                        "task": {"id": r[0], "user_id": r[1], "description": r[2], "completed": bool(r[3])}})
+        for r in upserts
+    ]
+    changes.extend(((d[1], d[0]), {"op": "delete", "revision": d[1], "id": d[0]}) for d in deletes)
+    changes.sort(key=lambda c: c[0])
+    body = {"version": version, "changes": [c for _, c in changes], "has_more": next_page is not None}
+    if next_page is not None:
+        body["next_since"], body["next_after"] = next_page
+    return orjson.dumps(body)
+
+CSV_HEADER = ("id", "user_id", "description", "completed")
+
+def task_rows_to_ndjson(rows: Iterable[Sequence]) -> bytes:
+    """input: rows of (id, user_id, description, completed)
+       output: one JSON object per line, as bytes"""
+    return b"".join(
+        orjson.dumps({"id": r[0], "user_id": r[1], "description": r[2], "completed": bool(r[3])}) + b"\n"
+        for r in rows
+    )
+
+def task_rows_to_csv(rows: Iterable[Sequence], *, header: bool = False) -> bytes:
+    """input: rows of (id, user_id, description, completed), whether to start with the header line
+       output: CSV lines as UTF-8 bytes"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    if header:
+        writer.writerow(CSV_HEADER)
+    writer.writerows((r[0], r[1], r[2], "true" if r[3] else "false") for r in rows)
+    return buf.getvalue().encode()
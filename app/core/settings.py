@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import List
+from typing import Dict, List, Literal
 from pathlib import Path
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
@@ -13,15 +13,137 @@ class Settings(BaseSettings):
 
     # DB
     database_url: str = Field("sqlite:///./app.db", alias="DATABASE_URL")
+    # serve requests through an AsyncEngine/AsyncSession instead of the threadpool
+    db_async: bool = Field(False, alias="DB_ASYNC")
+    # read replicas (comma-separated URLs): read-only repository calls are spread over the healthy ones
+    database_replica_urls_raw: str = Field("", alias="DATABASE_REPLICA_URLS")
+    db_replica_health_interval_seconds: float = Field(5, alias="DB_REPLICA_HEALTH_INTERVAL_SECONDS")
+    # after a user's write, that user's reads stay on the primary this long (replication lag); tracked per
+    # process: with --workers N, a read handled by another worker than the write may still hit a lagging replica
+    db_read_your_writes_seconds: float = Field(5, alias="DB_READ_YOUR_WRITES_SECONDS")
+    # horizontal sharding (comma-separated URLs): shards 1..N-1 next to DATABASE_URL (shard 0, which also
+    # holds the user directory); append only, a shard's position is its number
+    database_shard_urls_raw: str = Field("", alias="DATABASE_SHARD_URLS")
+    # how long a worker trusts its cached user -> shard placement (a user move waits this long)
+    shard_map_cache_seconds: float = Field(5, alias="SHARD_MAP_CACHE_SECONDS")
+    # task ids reserved from the directory at a time when sharded (ids stay unique across shards)
+    shard_id_block_size: int = Field(1000, alias="SHARD_ID_BLOCK_SIZE")
+    # a claimed username whose users row still does not exist after this long (the registration died
+    # in between) is free again
+    username_reservation_grace_seconds: float = Field(60, alias="USERNAME_RESERVATION_GRACE_SECONDS")
+    # connection pool (ignored for in-memory SQLite)
+    db_pool_size: int = Field(5, alias="DB_POOL_SIZE")
+    db_max_overflow: int = Field(10, alias="DB_MAX_OVERFLOW")
+    db_pool_timeout: float = Field(30, alias="DB_POOL_TIMEOUT")
+    db_pool_recycle: int = Field(1800, alias="DB_POOL_RECYCLE")
+    db_pool_pre_ping: bool = Field(True, alias="DB_POOL_PRE_PING")
+    # SQLite tuning, applied on every new connection
+    sqlite_journal_mode: Literal["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"] = Field("WAL", alias="SQLITE_JOURNAL_MODE")
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = Field("NORMAL", alias="SQLITE_SYNCHRONOUS")
+    sqlite_busy_timeout_ms: int = Field(5000, alias="SQLITE_BUSY_TIMEOUT_MS")
+    sqlite_mmap_size: int = Field(256 * 1024 * 1024, alias="SQLITE_MMAP_SIZE")
 
     # Auth
     secret_key: str = Field(..., alias="SECRET_KEY")
     algorithm: str = Field("HS256", alias="ALGORITHM")
     access_token_expire_minutes: int = Field(60, alias="ACCESS_TOKEN_EXPIRE_MINUTES")
+    # authenticated-user cache (token -> id/username); size 0 disables it
+    auth_cache_size: int = Field(10000, alias="AUTH_CACHE_SIZE")
+    auth_cache_ttl_seconds: float = Field(60, alias="AUTH_CACHE_TTL_SECONDS")
+    # bcrypt worker processes (0 = run in threads) and max queued+running password jobs before 503
+    password_hash_workers: int = Field(2, alias="PASSWORD_HASH_WORKERS")
+    password_hash_max_pending: int = Field(64, alias="PASSWORD_HASH_MAX_PENDING")
+
+    # Tasks pagination
+    tasks_page_size_default: int = Field(100, alias="TASKS_PAGE_SIZE_DEFAULT")
+    tasks_page_size_max: int = Field(500, alias="TASKS_PAGE_SIZE_MAX")
+    # max operations per POST /tasks/batch
+    tasks_batch_max: int = Field(1000, alias="TASKS_BATCH_MAX")
+    # rows fetched per chunk by GET /tasks/export
+    tasks_export_chunk_size: int = Field(1000, alias="TASKS_EXPORT_CHUNK_SIZE")
+    # POST /tasks/import: rows per INSERT/transaction, per-row errors reported back
+    tasks_import_chunk_size: int = Field(5000, alias="TASKS_IMPORT_CHUNK_SIZE")
+    tasks_import_max_errors: int = Field(100, alias="TASKS_IMPORT_MAX_ERRORS")
+    # POST /tasks/import: largest record and largest (decompressed) body accepted, in bytes
+    tasks_import_max_record_bytes: int = Field(1024 * 1024, alias="TASKS_IMPORT_MAX_RECORD_BYTES")
+    tasks_import_max_bytes: int = Field(256 * 1024 * 1024, alias="TASKS_IMPORT_MAX_BYTES")
+    # delta sync: how long delete tombstones are kept, and how often old ones are compacted (0 = never)
+    tasks_tombstone_retention_hours: float = Field(24 * 7, alias="TASKS_TOMBSTONE_RETENTION_HOURS")
+    tasks_tombstone_compact_interval_seconds: float = Field(3600, alias="TASKS_TOMBSTONE_COMPACT_INTERVAL_SECONDS")
+
+    # task change push (GET /tasks/events): "memory" = this process only, "sqlite" = shared by the
+    # workers of one host through EVENTS_SQLITE_PATH
+    events_broker: Literal["memory", "sqlite"] = Field("memory", alias="EVENTS_BROKER")
+    events_sqlite_path: str = Field(str(BASE_DIR.parent / "events.db"), alias="EVENTS_SQLITE_PATH")
+    events_poll_interval_seconds: float = Field(0.2, alias="EVENTS_POLL_INTERVAL_SECONDS")
+    # pending events per connection before it is told to resync
+    events_queue_size: int = Field(100, alias="EVENTS_QUEUE_SIZE")
+    events_keepalive_seconds: float = Field(15, alias="EVENTS_KEEPALIVE_SECONDS")
+
+    # Query instrumentation: Server-Timing header with statements and DB time per request; requests running
+    # more statements than the budget are logged with their statement fingerprints (0 = no budget)
+    server_timing: bool = Field(True, alias="SERVER_TIMING")
+    db_query_budget: int = Field(0, alias="DB_QUERY_BUDGET")
+    # Request profiler (off unless one of the first two is set): profile a random share of requests and/or
+    # keep the profile of every request slower than PROFILE_SLOW_MS; the last PROFILE_KEEP are kept
+    profile_sample_rate: float = Field(0, alias="PROFILE_SAMPLE_RATE")
+    profile_slow_ms: float = Field(0, alias="PROFILE_SLOW_MS")
+    profile_interval_ms: float = Field(10, alias="PROFILE_INTERVAL_MS")
+    profile_keep: int = Field(20, alias="PROFILE_KEEP")
+    # paths never profiled: long-lived streams would always count as slow and keep the sampler busy
+    profile_skip_paths_raw: str = Field("/tasks/events,/tasks/export", alias="PROFILE_SKIP_PATHS")
+    # users allowed on /admin endpoints
+    admin_usernames_raw: str = Field("", alias="ADMIN_USERNAMES")
+
+    # Logging: "json" (one object per line) or "text"; records queued for the writer thread before new ones are
+    # dropped; share of INFO records kept per logger, e.g. "app.business.tasks=0.01,app.business.users=0.1"
+    log_format: Literal["json", "text"] = Field("json", alias="LOG_FORMAT")
+    log_queue_size: int = Field(10000, alias="LOG_QUEUE_SIZE")
+    log_sample_rates_raw: str = Field("", alias="LOG_SAMPLE_RATES")
 
     # CORS
     cors_origins_raw: str = Field("http://127.0.0.1:5173", alias="CORS_ORIGINS")
 
+    @property
+    def database_replica_urls(self) -> List[str]:
+        """input: None
+           output: List[str]
+           Get the list of replica URLs from the raw string."""
+        return [u.strip() for u in self.database_replica_urls_raw.split(",") if u.strip()]
+
+    @property
+    def database_shard_urls(self) -> List[str]:
+        """input: None
+           output: List[str]
+           Get the list of extra shard URLs from the raw string."""
+        return [u.strip() for u in self.database_shard_urls_raw.split(",") if u.strip()]
+
+    @property
+    def profile_skip_paths(self) -> List[str]:
+        """input: None
+           output: List[str]
+           Get the list of paths the profiler skips from the raw string."""
+        return [p.strip() for p in self.profile_skip_paths_raw.split(",") if p.strip()]
+
+    @property
+    def admin_usernames(self) -> List[str]:
+        """input: None
+           output: List[str]
+           Get the list of admin usernames from the raw string."""
+        return [u.strip() for u in self.admin_usernames_raw.split(",") if u.strip()]
+
+    @property
+    def log_sample_rates(self) -> Dict[str, float]:
+        """input: None
+           output: Dict[str, float]
+           Get the logger name -> kept share mapping from the raw string."""
+        rates = {}
+        for item in self.log_sample_rates_raw.split(","):
+            name, _, rate = item.partition("=")
+            if name.strip() and rate.strip():
+                rates[name.strip()] = float(rate)
+        return rates
+
     @property
     def cors_origins(self) -> List[str]:
         """input: None
@@ -0,0 +1,190 @@
+import argparse
+import logging
+import sqlite3
+import time
+from typing import Dict
+from sqlalchemy import delete, insert, make_url, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from ..core.errors import DatabaseError
+from ..core.settings import get_settings
+from ..database import DATABASE_URL, home_shard, shard_session, shards
+from . import models
+from .repositories import directory as directory_repo, tasks as tasks_repo
+
+# Purpose: offline maintenance commands, e.g. `python -m app.data.maintenance rebuild-stats`
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# the rows of one user on its shard, parents first
+_USER_TABLES = (models.User.__table__, models.TaskCollection.__table__, models.Task.__table__,
+                models.TaskTombstone.__table__)
+
+def _shard_of(user_id: int) -> int:
+    with shard_session(0) as db:
+        placement = directory_repo.get_placement(db, user_id)
+    if placement is None:
+        raise SystemExit(f"user {user_id} is not in the directory")
+    return placement[0]
+
+def rebuild_stats(user_id=None) -> int:
+    """input: user id (None = every user)
+       output: number of counter rows recomputed
+       Recount the tasks behind GET /tasks/stats, to reconcile drift"""
+    indexes = range(len(shards)) if user_id is None else [_shard_of(user_id)]
+    recounted = 0
+    for index in indexes:
+        with shard_session(index) as db:
+            recounted += tasks_repo.rebuild_stats(db, user_id=user_id)
+    return recounted
+
+def _user_rows(table, user_id: int):
+    return (table.c.id if table.name == "users" else table.c.user_id) == user_id
+
+def _purge_user(db: Session, user_id: int) -> None:
+    for table in reversed(_USER_TABLES):
+        db.execute(delete(table).where(_user_rows(table, user_id)))
+
+def _copy_user(src: Session, dst: Session, user_id: int, *, chunk_size: int = 1000) -> int:
+    """input: sessions on the source and target shards, user id, rows per INSERT
+       output: number of rows copied
+       Copies the user's rows in one transaction on the target, after dropping leftovers of an
+       earlier, interrupted move. Task ids are kept (unique across shards); tombstone ids are not."""
+    copied = 0
+    try:
+        _purge_user(dst, user_id)
+        for table in _USER_TABLES:
+            columns = [c for c in table.c if not (table.name == "task_tombstones" and c.name == "id")]
+            result = src.execute(select(*columns).where(_user_rows(table, user_id)).execution_options(yield_per=chunk_size))
+            for part in result.partitions():
+                dst.execute(insert(table), [dict(row._mapping) for row in part])
+                copied += len(part)
+        dst.commit()
+        return copied
+    except SQLAlchemyError as e:
+        dst.rollback()
+        raise DatabaseError() from e
+
+def move_users(moves: Dict[int, int]) -> int:
+    """input: {user id: target shard}
+       output: number of rows copied
+       Online move: the users are flagged as moving and, once every worker has noticed
+       (SHARD_MAP_CACHE_SECONDS), their rows are copied and the directory is switched to the target.
+       Meanwhile their writes get 503 USER_MOVING and their reads go on from the source. The source rows
+       are deleted after another wait, when no worker still routes to them. Safe to run again after a crash."""
+    settle = settings.shard_map_cache_seconds + 1
+    sources: Dict[int, int] = {}
+    with shard_session(0) as db:
+        for user_id, target in moves.items():
+            if not 0 <= target < len(shards):
+                raise SystemExit(f"no shard {target}: {len(shards)} configured")
+            placement = directory_repo.get_placement(db, user_id)
+            if placement is None:
+                raise SystemExit(f"user {user_id} is not in the directory")
+            source, moving = placement
+            if source == target:
+                if moving:
+                    directory_repo.set_placement(db, user_id, shard=source, moving=False)
+                continue
+            directory_repo.set_placement(db, user_id, shard=source, moving=True)
+            sources[user_id] = source
+    if not sources:
+        return 0
+    time.sleep(settle)
+    copied = 0
+    for user_id, source in sources.items():
+        with shard_session(source) as src, shard_session(moves[user_id]) as dst:
+            rows = _copy_user(src, dst, user_id)
+        with shard_session(0) as db:
+            directory_repo.set_placement(db, user_id, shard=moves[user_id], moving=False)
+        logger.info("Moved user %s from shard %d to %d (%d rows)", user_id, source, moves[user_id], rows)
+        copied += rows
+    time.sleep(settle)
+    for user_id, source in sources.items():
+        with shard_session(source) as src:
+            try:
+                _purge_user(src, user_id)
+                src.commit()
+            except SQLAlchemyError as e:
+                src.rollback()
+                raise DatabaseError() from e
+    return copied
+
+def rebalance(*, batch: int = 100, dry_run: bool = False) -> int:
+    """input: users moved per batch, whether to only report
+       output: number of users moved (or to move)
+       Move every user whose shard is not its home shard, e.g. after adding a shard"""
+    moved = after = 0
+    pending: Dict[int, int] = {}
+    while True:
+        with shard_session(0) as db:
+            rows = directory_repo.list_placements(db, after=after)
+        if not rows:
+            break
+        after = rows[-1].user_id
+        for user_id, shard, moving in rows:
+            home = home_shard(user_id)
+            if shard != home or moving:
+                pending[user_id] = home
+            if len(pending) >= batch:
+                moved += len(pending)
+                if not dry_run:
+                    move_users(pending)
+                pending = {}
+    moved += len(pending)
+    if pending and not dry_run:
+        move_users(pending)
+    return moved
+
+def _sqlite_path(url: str) -> str:
+    u = make_url(url)
+    if not u.drivername.startswith("sqlite") or u.database in (None, "", ":memory:"):
+        raise SystemExit(f"not a SQLite file URL: {url}")
+    return u.database
+
+def sync_replica(replica_url: str) -> None:
+    """input: URL of a SQLite replica file
+       output: None
+       Copy the primary SQLite database onto the replica file (online backup): a local stand-in for
+       replication, to try DATABASE_REPLICA_URLS with two SQLite files"""
+    src = sqlite3.connect(_sqlite_path(DATABASE_URL))
+    dst = sqlite3.connect(_sqlite_path(replica_url))
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.data.maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats = commands.add_parser("rebuild-stats", help="recount the per-user task counters")
+    stats.add_argument("--user-id", type=int, default=None, help="only this user")
+    replica = commands.add_parser("sync-replica", help="copy the primary SQLite file onto a replica file")
+    replica.add_argument("replica_url", help="e.g. sqlite:///./replica.db")
+    replica.add_argument("--interval", type=float, default=0, help="repeat every N seconds (replication lag)")
+    move = commands.add_parser("move-user", help="move a user's rows to another shard (online)")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    balance = commands.add_parser("rebalance", help="move every user to its home shard (after adding shards)")
+    balance.add_argument("--batch", type=int, default=100, help="users moved together")
+    balance.add_argument("--dry-run", action="store_true", help="only count the users to move")
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild-stats":
+        print(f"recomputed task counters of {rebuild_stats(args.user_id)} users")
+    elif args.command == "move-user":
+        print(f"copied {move_users({args.user_id: args.shard})} rows")
+    elif args.command == "rebalance":
+        moved = rebalance(batch=args.batch, dry_run=args.dry_run)
+        print(f"{'would move' if args.dry_run else 'moved'} {moved} users")
+    elif args.command == "sync-replica":
+        while True:
+            sync_replica(args.replica_url)
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
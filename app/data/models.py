@@ -1,16 +1,41 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from ..database import Base
 
+# Sharding: users, tasks, task_collections and task_tombstones live on the user's shard;
+# user_directory and id_blocks only on DATABASE_URL (shard 0).
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
+    # tokens issued before this time (epoch seconds) are refused: set when the credentials change
+    tokens_valid_after = Column(Integer, nullable=False, default=0, server_default="0")
 
     tasks = relationship("Task", back_populates="owner", cascade="all, delete-orphan")
 
+# Directory of every user: username -> user id -> shard holding the user's rows.
+class UserDirectory(Base):
+    __tablename__ = "user_directory"
+
+    user_id = Column(Integer, primary_key=True)
+    username = Column(String, unique=True, nullable=False)
+    shard = Column(Integer, nullable=False, default=0)
+    # set while the user's rows are copied to another shard: writes are refused meanwhile
+    moving = Column(Boolean, nullable=False, default=False)
+    # when the username was claimed (epoch seconds); 0 for the users registered before this column
+    reserved_at = Column(Integer, nullable=False, default=0, server_default="0")
+
+# Next free id per id space, handed out in blocks (task ids must be unique across shards).
+class IdBlock(Base):
+    __tablename__ = "id_blocks"
+
+    name = Column(String, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
 class Task(Base):
     __tablename__ = "tasks"
 
@@ -18,9 +43,43 @@ class Task(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     description = Column(String, nullable=False)
     completed = Column(Boolean, nullable=False, default=False)
+    # task-list version of the last write to this task (see TaskCollection)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
 
     owner = relationship("User", back_populates="tasks")
 
     __table_args__ = (
         UniqueConstraint("id", "user_id", name="uq_task_id_user"),
-    )
\ No newline at end of file
+        # keyset pagination: WHERE user_id=? [AND completed=?] AND id>? ORDER BY id
+        Index("ix_tasks_user_completed_id", "user_id", "completed", "id"),
+        Index("ix_tasks_user_id_id", "user_id", "id"),
+        # delta sync: WHERE user_id=? AND revision>?
+        Index("ix_tasks_user_revision", "user_id", "revision"),
+    )
+
+# Per-user version of the task list, bumped by every task write; drives the task ETags.
+# Also holds the task counters of GET /tasks/stats, updated by the same statement.
+class TaskCollection(Base):
+    __tablename__ = "task_collections"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    task_count = Column(Integer, nullable=False, default=0, server_default="0")
+    completed_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # tombstones up to this revision were compacted away; older sync points must reload
+    compacted_revision = Column(Integer, nullable=False, default=0, server_default="0")
+
+# Deleted task ids, kept for delta sync until compacted.
+class TaskTombstone(Base):
+    __tablename__ = "task_tombstones"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(Integer, nullable=False)
+    revision = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+
+    __table_args__ = (
+        Index("ix_task_tombstones_user_revision", "user_id", "revision"),
+        Index("ix_task_tombstones_deleted_at", "deleted_at"),
+    )
@@ -0,0 +1,178 @@
+import threading
+import time
+from typing import List, Optional, Tuple
+from sqlalchemy import Row, case, delete, func, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+from .. import models
+from ...core.errors import DatabaseError, UsernameTakenError
+from ...core.settings import get_settings
+from ...database import SessionLocal, ShardMap, home_shard, shards_for
+
+# Purpose: the user directory and id blocks, on DATABASE_URL (shard 0) only.
+# The functions take the user id positionally: run_db/read_db route calls by their user_id keyword.
+
+def find_user_id(db: Session, username: str) -> Optional[int]:
+    """input: username
+       output: the user's id, or None if no such user
+       find the user id by username (one unique-index lookup)."""
+    return db.execute(
+        select(models.UserDirectory.user_id).where(models.UserDirectory.username == username)
+    ).scalar_one_or_none()
+
+def reserve_username(db: Session, username: str, *, grace_seconds: float) -> int:
+    """input: username, how long a claim may go without its users row
+       output: the new user's id
+       Claim the username and allocate the user id; the user is placed on its home shard.
+       A claim left by a registration that died before creating the users row is taken over once it is
+       older than grace_seconds.
+       Raises:
+         - UsernameTakenError if the username is already claimed"""
+    try:
+        return _claim(db, username)
+    except UsernameTakenError:
+        if not _drop_abandoned_claim(db, username, grace_seconds=grace_seconds):
+            raise
+    return _claim(db, username)
+
+def _claim(db: Session, username: str) -> int:
+    entry = models.UserDirectory(username=username, shard=0, moving=False, reserved_at=int(time.time()))
+    try:
+        db.add(entry)
+        db.flush()
+        # read before the commit expires the entry (a reload SELECT)
+        user_id = entry.user_id
+        entry.shard = home_shard(user_id)
+        db.commit()
+        return user_id
+    except IntegrityError as e:
+        db.rollback()
+        raise UsernameTakenError(username) from e
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def _drop_abandoned_claim(db: Session, username: str, *, grace_seconds: float) -> bool:
+    """input: a claimed username, how long a claim may go without its users row
+       output: whether the username may be claimed again (the claim was abandoned and is removed)
+       Only runs when a registration collides with an existing claim: one directory SELECT, one primary-key
+       SELECT on the user's shard (through the same kind of engine as db), and the DELETE if abandoned."""
+    table = models.UserDirectory
+    claim = db.execute(
+        select(table.user_id, table.shard, table.reserved_at).where(table.username == username)
+    ).one_or_none()
+    if claim is None:
+        # released in the meantime
+        return True
+    if time.time() - claim.reserved_at < grace_seconds:
+        return False
+    with SessionLocal(bind=shards_for(db).bind(claim.shard)) as shard_db:
+        if shard_db.get(models.User, claim.user_id) is not None:
+            return False
+    try:
+        # the claim seen above only: a registration that took it over meanwhile keeps it
+        db.execute(delete(table).where(table.user_id == claim.user_id, table.reserved_at == claim.reserved_at))
+        db.commit()
+        return True
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def release_username(db: Session, user_id: int) -> None:
+    """input: user id
+       output: None
+       Undo reserve_username when the user could not be created on its shard."""
+    try:
+        db.query(models.UserDirectory).filter(models.UserDirectory.user_id == user_id).delete()
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def get_placement(db: Session, user_id: int) -> Optional[Tuple[int, bool]]:
+    """input: user id
+       output: (shard, moving) of the user, or None if the user is not in the directory"""
+    row = db.execute(
+        select(models.UserDirectory.shard, models.UserDirectory.moving).where(models.UserDirectory.user_id == user_id)
+    ).one_or_none()
+    return (row[0], bool(row[1])) if row is not None else None
+
+def set_placement(db: Session, user_id: int, *, shard: int, moving: bool) -> None:
+    """input: user id, shard, moving flag
+       output: None
+       Record where the user's rows are (used by the user moves)."""
+    try:
+        db.execute(
+            update(models.UserDirectory).where(models.UserDirectory.user_id == user_id).values(shard=shard, moving=moving)
+        )
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def list_placements(db: Session, *, after: int = 0, limit: int = 1000) -> List[Row]:
+    """input: after (user id cursor), limit
+       output: List of (user_id, shard, moving) rows ordered by user id"""
+    return list(db.execute(
+        select(models.UserDirectory.user_id, models.UserDirectory.shard, models.UserDirectory.moving)
+        .where(models.UserDirectory.user_id > after).order_by(models.UserDirectory.user_id).limit(limit)
+    ).all())
+
+def reserve_ids(db: Session, name: str, count: int, *, floor: int = 1) -> int:
+    """input: id space name, number of ids, lowest id the space may hand out
+       output: the first of count consecutive ids nobody else will get
+       One atomic UPDATE ... RETURNING on the id space row (created on first use)."""
+    table = models.IdBlock.__table__
+    start = case((table.c.next_id < floor, floor), else_=table.c.next_id)
+    try:
+        next_id = db.execute(
+            update(table).where(table.c.name == name).values(next_id=start + count).returning(table.c.next_id)
+        ).scalar_one_or_none()
+        if next_id is None:
+            next_id = floor + count
+            db.execute(table.insert().values(name=name, next_id=next_id))
+        db.commit()
+        return next_id - count
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def max_task_id(db: Session) -> int:
+    """input: None
+       output: highest task id on the session's shard (0 if none)"""
+    return db.execute(select(func.max(models.Task.id))).scalar_one() or 0
+
+
+class IdAllocator:
+    """Hands out ids unique across shards (hi/lo): blocks of SHARD_ID_BLOCK_SIZE ids are reserved in the
+    directory and used up in memory, so one directory write serves a whole block of inserts.
+    Ids are increasing per process, not globally: ordering by id no longer follows creation order across workers."""
+
+    def __init__(self, name: str, *, block_size: int):
+        self.name = name
+        self.block_size = block_size
+        self._next = self._end = 0
+        self._lock = threading.Lock()
+
+    def take(self, count: int, *, shard_map: ShardMap) -> List[int]:
+        """input: number of ids, the shard map of the caller's session (see shards_for)
+           output: that many unused ids
+           A new block is reserved without holding the lock: under DB_ASYNC the reservation awaits the
+           driver on the event loop's thread, where a second caller waiting on the lock would block it."""
+        with self._lock:
+            if self._end - self._next >= count:
+                start = self._next
+                self._next += count
+                return list(range(start, start + count))
+        # concurrent callers may each reserve a block; the one stored last wins, the other's leftover is
+        # dropped like a short leftover: ids are sparse anyway
+        size = max(self.block_size, count)
+        with SessionLocal(bind=shard_map.bind(0)) as db:
+            start = reserve_ids(db, self.name, size)
+        with self._lock:
+            self._next, self._end = start + count, start + size
+        return list(range(start, start + count))
+
+
+# task ids, used by the task repository when there is more than one shard
+task_ids = IdAllocator("tasks", block_size=get_settings().shard_id_block_size)
@@ -1,15 +1,114 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, List, Set, Tuple, Union
+from sqlalchemy import (Integer, Row, Select, and_, bindparam, case, cast, delete, func, insert, literal_column, or_,
+                        select, text, update)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 from .. import models
+from . import directory
 from sqlalchemy.exc import SQLAlchemyError
-from ...core.errors import TaskNotFoundError, TaskForbiddenError, DatabaseError
+from ...core.errors import AppError, TaskNotFoundError, TaskForbiddenError, ChangesExpiredError, DatabaseError
+from ...database import shards, shards_for
+
+_TASK_COLUMNS = (models.Task.id, models.Task.user_id, models.Task.description, models.Task.completed)
+
+def get_version(db: Session, *, user_id: int) -> int:
+    """input: user_id
+       output: current version of the user's task list (0 before the first write)
+       One primary-key lookup; cheap enough to run before deciding whether to load any task."""
+    version = db.execute(
+        select(models.TaskCollection.version).where(models.TaskCollection.user_id == user_id)
+    ).scalar_one_or_none()
+    return version or 0
+
+def _upsert(db: Session):
+    """input: session
+       output: the dialect's insert() construct with on_conflict_do_update
+       Only SQLite and PostgreSQL are supported (database.py refuses other URLs at startup)."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"No upsert for the {dialect} dialect")
+
+def _bump_version(db: Session, user_id: int, *, tasks: int = 0, completed: Union[int, Select] = 0) -> int:
+    """input: user_id, change in the number of tasks and of completed tasks (a number, or a one-value SELECT of it)
+       output: the new version
+       Increments the user's task-list version and applies the counter deltas inside the caller's
+       transaction (upsert, one statement). The new version is also the revision stamped on the tasks
+       and tombstones of this write.
+       Every write bumps first, so the collection row serializes a user's writes: a SELECT given as the
+       completed delta is only read once that row is locked (FOR UPDATE on PostgreSQL), and sees the latest
+       committed task."""
+    table = models.TaskCollection.__table__
+    added, locked = completed, completed
+    if not isinstance(completed, int):
+        # a missing task changes nothing; the caller rolls back anyway
+        added = func.coalesce(completed.scalar_subquery(), 0)
+        locked = func.coalesce(completed.with_for_update().scalar_subquery(), 0)
+    stmt = _upsert(db)(table).values(user_id=user_id, version=1, task_count=tasks, completed_count=added)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.user_id], set_={
+        "version": table.c.version + 1,
+        "task_count": table.c.task_count + tasks,
+        "completed_count": table.c.completed_count + locked,
+    })
+    return db.execute(stmt.returning(table.c.version)).scalar_one()
+
+def get_stats(db: Session, *, user_id: int) -> Tuple[int, int]:
+    """input: user_id
+       output: (number of tasks, number of completed tasks)
+       Read from the user's counter row: one primary-key lookup, no scan of the tasks."""
+    row = db.execute(
+        select(models.TaskCollection.task_count, models.TaskCollection.completed_count)
+        .where(models.TaskCollection.user_id == user_id)
+    ).one_or_none()
+    return (row[0], row[1]) if row is not None else (0, 0)
+
+def rebuild_stats(db: Session, *, user_id: Optional[int] = None) -> int:
+    """input: user_id (None = every user)
+       output: number of counter rows recomputed
+       Recounts the tasks and overwrites the counters, to reconcile any drift. Scans the tasks: run it offline
+       (python -m app.data.maintenance rebuild-stats) or after a migration, not per request."""
+    table = models.TaskCollection.__table__
+    counts = select(
+        models.Task.user_id, literal_column("0"), func.count(), func.coalesce(func.sum(cast(models.Task.completed, Integer)), 0)
+    ).group_by(models.Task.user_id)
+    empty = update(table).where(~table.c.user_id.in_(select(models.Task.user_id).distinct()))
+    if user_id is not None:
+        counts = counts.where(models.Task.user_id == user_id)
+        empty = empty.where(table.c.user_id == user_id)
+    stmt = _upsert(db)(table).from_select(["user_id", "version", "task_count", "completed_count"], counts)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.user_id], set_={
+        "task_count": stmt.excluded.task_count,
+        "completed_count": stmt.excluded.completed_count,
+    })
+    try:
+        recounted = db.execute(stmt).rowcount
+        recounted += db.execute(empty.values(task_count=0, completed_count=0)).rowcount
+        db.commit()
+        return recounted
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def _with_ids(db: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """input: session, column values of new tasks
+       output: the same dicts; with several shards they get ids from the directory's id blocks, so task ids
+       stay unique across shards and a user's tasks keep them when moved (one shard: autoincrement).
+       Call before the transaction's first write: a new block is reserved on its own connection."""
+    if len(shards) > 1:
+        for row, task_id in zip(rows, directory.task_ids.take(len(rows), shard_map=shards_for(db))):
+            row["id"] = task_id
+    return rows
 
 def create_task(db: Session, *, user_id: int, description: str) -> models.Task:
     """input: user_id, description
         output: Task object
         Creates a new task for the given user_id with the provided description."""
-    task = models.Task(user_id=user_id, description=description, completed=False)
     try:
+        values = _with_ids(db, [{"user_id": user_id, "description": description, "completed": False}])[0]
+        task = models.Task(**values, revision=_bump_version(db, user_id, tasks=1))
         db.add(task)
         db.commit()
         db.refresh(task)
@@ -18,11 +117,98 @@ def create_task(db: Session, *, user_id: int, description: str) -> models.Task:
         db.rollback()
         raise DatabaseError() from e
 
-def list_for_user(db: Session, *, user_id: int) -> List[models.Task]:
-    """input: user_id
+def insert_many(db: Session, *, user_id: int, descriptions: List[str]) -> int:
+    """input: user_id, descriptions of the tasks to create
+       output: revision of the inserted tasks
+       Bulk create in one short transaction: a single executemany INSERT, no RETURNING and no ORM objects."""
+    try:
+        rows = _with_ids(db, [{"user_id": user_id, "description": d, "completed": False} for d in descriptions])
+        revision = _bump_version(db, user_id, tasks=len(descriptions))
+        db.execute(insert(models.Task.__table__), [{**row, "revision": revision} for row in rows])
+        db.commit()
+        return revision
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def _page(stmt: Select, *, user_id: int, limit: Optional[int], after: Optional[int],
+          completed: Optional[bool], order: str) -> Select:
+    """input: a SELECT over tasks, user_id, limit, after (task id cursor), completed, order
+       output: the SELECT restricted to one keyset page of the user's tasks, ordered by id
+       Served by the (user_id, completed, id) / (user_id, id) indexes, so the cost depends on limit only."""
+    stmt = stmt.where(models.Task.user_id == user_id)
+    if completed is not None:
+        stmt = stmt.where(models.Task.completed == completed)
+    if order == "desc":
+        if after is not None:
+            stmt = stmt.where(models.Task.id < after)
+        stmt = stmt.order_by(models.Task.id.desc())
+    else:
+        if after is not None:
+            stmt = stmt.where(models.Task.id > after)
+        stmt = stmt.order_by(models.Task.id.asc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def list_for_user(db: Session, *, user_id: int, limit: Optional[int] = None, after: Optional[int] = None,
+                  completed: Optional[bool] = None, order: str = "asc") -> List[models.Task]:
+    """input: user_id, limit=None, after=None (task id cursor), completed=None, order="asc"|"desc"
        output: List of Task objects
-       Lists all tasks owned by the given user_id."""
-    return db.query(models.Task).filter(models.Task.user_id == user_id).all()
+       Lists tasks owned by the given user_id ordered by id, resuming after the `after` cursor."""
+    stmt = _page(select(models.Task), user_id=user_id, limit=limit, after=after, completed=completed, order=order)
+    return list(db.scalars(stmt).all())
+
+def list_rows_for_user(db: Session, *, user_id: int, limit: Optional[int] = None, after: Optional[int] = None,
+                       completed: Optional[bool] = None, order: str = "asc") -> List[Row]:
+    """input: same as list_for_user
+       output: List of (id, user_id, description, completed) rows
+       list_for_user without ORM objects: plain rows for the direct-to-JSON response path."""
+    stmt = _page(select(*_TASK_COLUMNS), user_id=user_id, limit=limit, after=after, completed=completed, order=order)
+    return list(db.execute(stmt).all())
+
+def export_select(*, user_id: int) -> Select:
+    """input: user_id
+       output: SELECT of all the user's (id, user_id, description, completed) rows ordered by id
+       Statement only: the export streams it through its own session (database.stream_rows)."""
+    return select(*_TASK_COLUMNS).where(models.Task.user_id == user_id).order_by(models.Task.id)
+
+def search(db: Session, *, user_id: int, terms: List[str], limit: int, offset: int = 0) -> List[Row]:
+    """input: user_id, search terms (words; the last one is matched as a prefix), limit, offset
+       output: List of (id, user_id, description, completed) rows, best match first
+       Full-text search over the user's task descriptions: FTS5 on SQLite, tsvector/GIN on Postgres.
+       Only the last term is a prefix (search as you type): complete words are
+       plain index lookups, while a prefix longer than the indexed lengths (2-4) has to merge many terms."""
+    dialect = db.get_bind().dialect.name
+    words = ['"' + t.replace('"', "") + '"' for t in terms]
+    words[-1] += "*"
+    if dialect == "sqlite":
+        # the owner token scopes the match to the user inside the index; bm25 weights: description 1, owner 0
+        match = " AND ".join([f"owner:u{int(user_id)}"] + words)
+        fts = text(
+            "SELECT rowid AS id, bm25(tasks_fts, 1.0, 0.0) AS score FROM tasks_fts "
+            "WHERE tasks_fts MATCH :match ORDER BY score LIMIT :limit OFFSET :offset"
+        ).columns(literal_column("id"), literal_column("score")).subquery("hits")
+        stmt = (
+            select(*_TASK_COLUMNS)
+            .join(fts, models.Task.id == fts.c.id)
+            .where(models.Task.user_id == user_id)
+            .order_by(fts.c.score, models.Task.id)
+        )
+        params = {"match": match, "limit": limit, "offset": offset}
+        return list(db.execute(stmt, params).all())
+    if dialect == "postgresql":
+        query = func.to_tsquery("simple", bindparam("tsquery"))
+        tsv = literal_column("tasks.description_tsv")
+        stmt = (
+            select(*_TASK_COLUMNS)
+            .where(models.Task.user_id == user_id, tsv.op("@@")(query))
+            .order_by(func.ts_rank(tsv, query).desc(), models.Task.id)
+            .limit(limit).offset(offset)
+        )
+        tsquery = " & ".join(t.replace("'", "") for t in terms) + ":*"
+        return list(db.execute(stmt, {"tsquery": tsquery}).all())
+    raise NotImplementedError(f"No search for the {dialect} dialect")
 
 def get_owned(db: Session, *, user_id: int, task_id: int) -> models.Task:
     """input: user_id, task_id
@@ -33,37 +219,287 @@ def get_owned(db: Session, *, user_id: int, task_id: int) -> models.Task:
          - TaskForbiddenError if task exists but is not owned by user_id"""
     task = db.query(models.Task).filter(models.Task.id == task_id).first()
     if not task:
-        raise TaskNotFoundError(task_id)
+        _raise_missing(db, user_id=user_id, task_id=task_id)
     if task.user_id != user_id:
         raise TaskForbiddenError()
     return task
 
+def _on_other_shards(db: Session, task_ids: Iterable[int]) -> Set[int]:
+    """input: ids of tasks missing from the session's shard
+       output: those that exist on another shard (someone else's tasks: task ids are unique across shards)
+       Only called on error paths; one primary-key SELECT per other shard, through the same kind of
+       engine as db (async under DB_ASYNC)."""
+    task_ids = set(task_ids)
+    if len(shards) == 1 or not task_ids:
+        return set()
+    current = db.get_bind().url
+    shard_map = shards_for(db)
+    found: Set[int] = set()
+    for index in range(len(shard_map)):
+        bind = shard_map.bind(index)
+        if bind.url == current:
+            continue
+        with Session(bind) as other:
+            found.update(other.scalars(select(models.Task.id).where(models.Task.id.in_(task_ids - found))))
+    return found
+
+def _raise_missing(db: Session, *, user_id: int, task_id: int) -> None:
+    """input: user_id, task_id of a write that matched no row
+       output: None (always raises)
+       Tells a missing task apart from someone else's task with one extra SELECT, only on this rare path.
+       Raises:
+         - TaskNotFoundError if task does not exist
+         - TaskForbiddenError if task exists but is not owned by user_id"""
+    owner = db.execute(select(models.Task.user_id).where(models.Task.id == task_id)).scalar_one_or_none()
+    if owner is None and not _on_other_shards(db, [task_id]):
+        raise TaskNotFoundError(task_id)
+    raise TaskForbiddenError()
+
 def update_task(db: Session, *, user_id: int, task_id: int, description=None, completed=None) -> models.Task:
     """input: user_id, task_id, description=None, completed=None
        output: Task object
-       Updates a task owned by user_id with the given task_id."""
-    task = get_owned(db, user_id=user_id, task_id=task_id)
-
+       Updates a task owned by user_id with the given task_id.
+       Two statements: the version bump, which reads whether the completed flag really flips for the
+       completed counter, then UPDATE ... WHERE id=? AND user_id=? RETURNING ..."""
+    values = {}
     if description is not None:
-        task.description = description
+        values["description"] = description
     if completed is not None:
-        task.completed = bool(completed)
+        values["completed"] = bool(completed)
+    if not values:
+        return get_owned(db, user_id=user_id, task_id=task_id)
+    task_row = and_(models.Task.id == task_id, models.Task.user_id == user_id)
+    flip: Union[int, Select] = 0
+    if completed is not None:
+        flip = select(case((models.Task.completed == values["completed"], 0), else_=1 if values["completed"] else -1)
+                      ).where(task_row)
     try:
+        values["revision"] = _bump_version(db, user_id, completed=flip)
+        task = db.execute(
+            update(models.Task)
+            .where(task_row)
+            .values(**values)
+            .returning(models.Task)
+        ).scalar_one_or_none()
+        if task is None:
+            db.rollback()
+            _raise_missing(db, user_id=user_id, task_id=task_id)
+        # detach so commit does not expire it (which would cost a reload SELECT)
+        db.expunge(task)
         db.commit()
-        db.refresh(task)
         return task
     except SQLAlchemyError as e:
         db.rollback()
         raise DatabaseError() from e
 
-def delete_task(db: Session, *, user_id: int, task_id: int) -> None:
+def delete_task(db: Session, *, user_id: int, task_id: int) -> int:
     """input: user_id, task_id
-       output: None
-       Deletes a task owned by user_id with the given task_id."""
-    task = get_owned(db, user_id=user_id, task_id=task_id)
+       output: revision of the delete
+       Deletes a task owned by user_id with the given task_id and leaves a tombstone for delta sync.
+       Three statements: the version bump (which reads whether the task was completed), the DELETE and the tombstone."""
+    task_row = and_(models.Task.id == task_id, models.Task.user_id == user_id)
+    try:
+        revision = _bump_version(db, user_id, tasks=-1,
+                                 completed=select(-cast(models.Task.completed, Integer)).where(task_row))
+        deleted = db.execute(
+            delete(models.Task).where(task_row).returning(models.Task.id),
+            execution_options={"synchronize_session": False},
+        ).scalar_one_or_none()
+        if deleted is None:
+            db.rollback()
+            _raise_missing(db, user_id=user_id, task_id=task_id)
+        db.execute(insert(models.TaskTombstone).values(user_id=user_id, task_id=task_id, revision=revision))
+        db.commit()
+        return revision
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def apply_batch(db: Session, *, user_id: int, operations: List[Dict[str, Any]]) -> List[Tuple[Optional[Dict[str, Any]], Optional[AppError]]]:
+    """input: user_id, operations: dicts {"op": "create", "description"} | {"op": "update", "id", "description", "completed"}
+              | {"op": "delete", "id"}
+       output: one (task dict or None, AppError or None) pair per operation, in order; dicts include the revision
+       Applies many operations in one transaction with one ownership SELECT and a fixed number of bulk statements.
+       Operations on missing or foreign tasks fail individually; the rest are committed together.
+       Creates run first, then updates, then deletes; an id deleted earlier in the batch counts as missing.
+       Updates write only the columns they set (a later update of the same task wins), and an update result
+       is the task as the batch left it. The counters follow what the statements really changed, not the
+       ownership SELECT, so concurrent writes to the same tasks cannot make them drift."""
+    results: List[Tuple[Optional[Dict[str, Any]], Optional[AppError]]] = [(None, None)] * len(operations)
+    ids = {o["id"] for o in operations if o["op"] != "create"}
+    task = models.Task
+    try:
+        owners: Dict[int, int] = {}
+        if ids:
+            owners = dict(db.execute(select(task.id, task.user_id).where(task.id.in_(ids))).all())
+        elsewhere = _on_other_shards(db, ids - owners.keys())
+
+        creates, deletes, deleted = [], [], set()
+        # task id -> columns set by the batch's updates, and the operations to report the result to
+        changes: Dict[int, Dict[str, Any]] = {}
+        update_ops: Dict[int, List[int]] = {}
+        for i, o in enumerate(operations):
+            if o["op"] == "create":
+                creates.append(i)
+            elif o["id"] in elsewhere:
+                results[i] = (None, TaskForbiddenError())
+            elif o["id"] not in owners or o["id"] in deleted:
+                results[i] = (None, TaskNotFoundError(o["id"]))
+            elif owners[o["id"]] != user_id:
+                results[i] = (None, TaskForbiddenError())
+            elif o["op"] == "update":
+                values = changes.setdefault(o["id"], {})
+                if o.get("description") is not None:
+                    values["description"] = o["description"]
+                if o.get("completed") is not None:
+                    values["completed"] = bool(o["completed"])
+                update_ops.setdefault(o["id"], []).append(i)
+            else:
+                deletes.append(i)
+                deleted.add(o["id"])
+        if not (creates or changes or deletes):
+            return results
+
+        new_rows = _with_ids(db, [{"user_id": user_id, "description": operations[i]["description"], "completed": False}
+                              for i in creates])
+        # the whole batch is one revision; the version bump also holds the user's other writes until commit
+        revision = _bump_version(db, user_id, tasks=len(creates))
+        tasks_delta = completed_delta = 0
+        if creates:
+            rows = db.execute(
+                insert(task).returning(*_TASK_COLUMNS, sort_by_parameter_order=True),
+                [{**row, "revision": revision} for row in new_rows],
+            ).mappings().all()
+            for i, row in zip(creates, rows):
+                results[i] = ({**row, "revision": revision}, None)
+        if changes:
+            for flag in (True, False):
+                flip = [tid for tid, values in changes.items() if values.get("completed") is flag]
+                if flip:
+                    flipped = db.execute(
+                        update(task).where(task.id.in_(flip), task.user_id == user_id, task.completed != flag)
+                        .values(completed=flag),
+                        execution_options={"synchronize_session": False},
+                    ).rowcount
+                    completed_delta += flipped if flag else -flipped
+            described = [{"tid": tid, "new_description": values["description"]}
+                         for tid, values in changes.items() if "description" in values]
+            if described:
+                db.execute(
+                    update(task.__table__).where(task.id == bindparam("tid"), task.user_id == user_id)
+                    .values(description=bindparam("new_description")),
+                    described,
+                )
+            current = {
+                row["id"]: {**row, "revision": revision}
+                for row in db.execute(
+                    update(task).where(task.id.in_(changes), task.user_id == user_id)
+                    .values(revision=revision).returning(*_TASK_COLUMNS),
+                    execution_options={"synchronize_session": False},
+                ).mappings()
+            }
+            for tid, indexes in update_ops.items():
+                for i in indexes:
+                    # deleted by a concurrent request since the ownership SELECT
+                    results[i] = (dict(current[tid]), None) if tid in current else (None, TaskNotFoundError(tid))
+        if deletes:
+            gone = dict(db.execute(
+                delete(task).where(task.id.in_(deleted), task.user_id == user_id)
+                .returning(task.id, task.completed),
+                execution_options={"synchronize_session": False},
+            ).all())
+            tasks_delta -= len(gone)
+            completed_delta -= sum(1 for was_completed in gone.values() if was_completed)
+            for i in deletes:
+                tid = operations[i]["id"]
+                results[i] = ({"id": tid, "revision": revision}, None) if tid in gone else (None, TaskNotFoundError(tid))
+            if gone:
+                db.execute(insert(models.TaskTombstone),
+                           [{"user_id": user_id, "task_id": task_id, "revision": revision} for task_id in gone])
+        if tasks_delta or completed_delta:
+            collection = models.TaskCollection
+            db.execute(
+                update(collection).where(collection.user_id == user_id).values(
+                    task_count=collection.task_count + tasks_delta,
+                    completed_count=collection.completed_count + completed_delta,
+                ),
+                execution_options={"synchronize_session": False},
+            )
+        db.commit()
+        return results
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise DatabaseError() from e
+
+def list_changes(db: Session, *, user_id: int, since: int, after: Optional[int] = None,
+                 limit: int) -> Tuple[int, List[Row], List[Row], Optional[Tuple[int, int]]]:
+    """input: user_id, since (a version previously returned by this function, 0 for everything),
+              after (with since: resume after the task id of that revision, see the returned cursor), max changes
+       output: (current version, (id, user_id, description, completed, revision) rows written after the position,
+                (task_id, revision) rows of tasks deleted after it, (since, after) of the next page or None)
+       Reads only what changed, through the (user_id, revision) indexes of tasks and tombstones, at most
+       limit changes in (revision, id) order: one write can stamp many tasks with the same revision.
+       The version is read first, so a write racing with this call is at worst sent again next time.
+       Pages after the first of a full sync also replay deletes: a task sent on an earlier page may be gone.
+       Raises:
+         - ChangesExpiredError if tombstones newer than since were already compacted"""
+    collection = db.execute(
+        select(models.TaskCollection.version, models.TaskCollection.compacted_revision)
+        .where(models.TaskCollection.user_id == user_id)
+    ).one_or_none()
+    version, compacted = collection if collection is not None else (0, 0)
+    if after is None and 0 < since < compacted:
+        raise ChangesExpiredError(since)
+
+    def past_position(revision, task_id):
+        if after is None:
+            return revision > since
+        return or_(revision > since, and_(revision == since, task_id > after))
+
+    task, tomb = models.Task, models.TaskTombstone
+    upserts = list(db.execute(
+        select(*_TASK_COLUMNS, task.revision)
+        .where(task.user_id == user_id, past_position(task.revision, task.id))
+        .order_by(task.revision, task.id).limit(limit + 1)
+    ).all())
+    if since or after is not None:
+        deletes = list(db.execute(
+            select(tomb.task_id, tomb.revision)
+            .where(tomb.user_id == user_id, past_position(tomb.revision, tomb.task_id))
+            .order_by(tomb.revision, tomb.task_id).limit(limit + 1)
+        ).all())
+    else:
+        # a full sync starts from an empty list: no deletes to replay
+        deletes = []
+    positions = sorted([(r.revision, r.id) for r in upserts] + [(d.revision, d.task_id) for d in deletes])
+    if len(positions) <= limit:
+        return version, upserts, deletes, None
+    last = positions[limit - 1]
+    upserts = [r for r in upserts if (r.revision, r.id) <= last]
+    deletes = [d for d in deletes if (d.revision, d.task_id) <= last]
+    return version, upserts, deletes, last
+
+def compact_tombstones(db: Session, *, before: datetime) -> int:
+    """input: before (naive UTC datetime)
+       output: number of tombstones removed
+       Drops tombstones older than before and records, per user, the newest revision dropped,
+       so sync points from before it get ChangesExpiredError instead of silently missing deletes."""
+    tomb = models.TaskTombstone
+    coll = models.TaskCollection
+    old = tomb.deleted_at < before
     try:
-        db.delete(task)
+        newest_dropped = (
+            select(func.max(tomb.revision)).where(tomb.user_id == coll.user_id, old).scalar_subquery()
+        )
+        db.execute(
+            update(coll)
+            .where(coll.user_id.in_(select(tomb.user_id).where(old)))
+            .values(compacted_revision=newest_dropped),
+            execution_options={"synchronize_session": False},
+        )
+        removed = db.execute(delete(tomb).where(old), execution_options={"synchronize_session": False}).rowcount
         db.commit()
+        return removed
     except SQLAlchemyError as e:
         db.rollback()
         raise DatabaseError() from e
@@ -1,31 +1,19 @@
+
+from typing import Optional
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from .. import models
-from ...core.errors import UserNotFoundError, UsernameTakenError
+from ...core.errors import UserNotFoundError
 from sqlalchemy.exc import SQLAlchemyError
 from ...core.errors import DatabaseError
 
-def find_by_username(db: Session, username: str) -> models.User | None:
-    """input: username; 
-       output: User or None(if the user doesn't exist).
-       find the user by username."""
-    return db.query(models.User).filter(models.User.username == username).first()
+# User rows live on the user's shard; usernames are resolved through the directory (repositories.directory).
 
-def get_by_username(db: Session, username: str) -> models.User:
-    """input: username; 
+def create_user(db: Session, *, user_id: int, username: str, password_hash: str) -> models.User:
+    """input: user_id (from directory.reserve_username), username, password_hash;
        output: User;
-       get the user by username;"""
-    user = find_by_username(db, username)
-    if not user:
-        raise UserNotFoundError(username)
-    return user
-
-def create_user(db: Session, *, username: str, password_hash: str) -> models.User:
-    """input: username, password_hash;
-       output: User;
-       create a new user with the given username and password hash."""
-    if find_by_username(db, username):  
-        raise UsernameTakenError(username)
-    user = models.User(username=username, password_hash=password_hash)
+       create a new user with the given id, username and password hash."""
+    user = models.User(id=user_id, username=username, password_hash=password_hash)
     try:
         db.add(user); db.commit(); db.refresh(user)
         return user
@@ -33,7 +21,7 @@ def create_user(db: Session, *, username: str, password_hash: str) -> models.Use
         db.rollback()
         raise DatabaseError() from e
 
-def get_by_id(db: Session, user_id: int) -> models.User:
+def get_by_id(db: Session, *, user_id: int) -> models.User:
     """input: user_id;
        output: User;
        get the user by user_id;"""
@@ -41,3 +29,11 @@ def get_by_id(db: Session, user_id: int) -> models.User:
     if not user:
         raise UserNotFoundError(f"id:{user_id}")
     return user
+
+def get_tokens_valid_after(db: Session, *, user_id: int) -> Optional[int]:
+    """input: user_id;
+       output: the user's tokens_valid_after, or None if there is no such user;
+       one primary-key lookup, run when a token enters the auth cache."""
+    return db.execute(
+        select(models.User.tokens_valid_after).where(models.User.id == user_id)
+    ).scalar_one_or_none()
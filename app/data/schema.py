@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+from typing import Iterator, List
+from sqlalchemy import Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from ..database import Base
+from . import models  # noqa: F401  (registers the tables)
+from .repositories import directory as directory_repo, tasks as tasks_repo
+
+# Purpose: create the tables on startup and bring databases created by older versions up to date.
+# Every worker runs it: each database's steps run under that database's schema lock (see _schema_lock).
+
+# tables of the user directory, on DATABASE_URL only; every other table is on each shard
+_DIRECTORY_TABLES = ("user_directory", "id_blocks")
+
+def _tables(*, directory: bool, shard: bool) -> List[Table]:
+    return [t for t in Base.metadata.sorted_tables
+            if (directory if t.name in _DIRECTORY_TABLES else shard)]
+
+# PostgreSQL advisory lock key of the schema steps ("task")
+_SCHEMA_LOCK_KEY = 0x7461736B
+
+@contextmanager
+def _schema_lock(engine: Engine) -> Iterator[Connection]:
+    """input: Engine
+       output: a connection in a transaction that holds the database's schema lock, committed on exit
+       Workers starting together take turns: the checks (has_table, ...) and the DDL they guard run as
+       one transaction, so the next worker finds everything in place instead of creating it twice.
+       SQLite: BEGIN IMMEDIATE (the write lock); PostgreSQL: a transaction-level advisory lock."""
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        elif engine.dialect.name == "postgresql":
+            conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({_SCHEMA_LOCK_KEY})")
+        yield conn
+        conn.commit()
+
+def _add_missing_columns(conn: Connection, tables: List[Table]) -> None:
+    """input: Connection, the tables its database holds
+       output: None
+       create_all never alters existing tables: add the columns introduced since (they all have a server default)."""
+    insp = inspect(conn)
+    for table in tables:
+        if not insp.has_table(table.name):
+            continue
+        present = {c["name"] for c in insp.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present or column.server_default is None:
+                continue
+            ddl = column.type.compile(dialect=conn.dialect)
+            not_null = "" if column.nullable else " NOT NULL"
+            conn.execute(text(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl}{not_null} DEFAULT {column.server_default.arg}"
+            ))
+
+# Full-text index over task descriptions (GET /tasks/search).
+# SQLite: contentless FTS5 table kept in sync by triggers. Besides the description it indexes an owner
+# token ("u<user_id>"), so a search is scoped to one user inside the index instead of by a join afterwards.
+_SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE tasks_fts USING fts5(
+           description, owner, content='', prefix='2 3 4', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER tasks_fts_ai AFTER INSERT ON tasks BEGIN
+           INSERT INTO tasks_fts (rowid, description, owner) VALUES (new.id, new.description, 'u' || new.user_id);
+       END""",
+    """CREATE TRIGGER tasks_fts_ad AFTER DELETE ON tasks BEGIN
+           INSERT INTO tasks_fts (tasks_fts, rowid, description, owner)
+           VALUES ('delete', old.id, old.description, 'u' || old.user_id);
+       END""",
+    """CREATE TRIGGER tasks_fts_au AFTER UPDATE OF description, user_id ON tasks BEGIN
+           INSERT INTO tasks_fts (tasks_fts, rowid, description, owner)
+           VALUES ('delete', old.id, old.description, 'u' || old.user_id);
+           INSERT INTO tasks_fts (rowid, description, owner) VALUES (new.id, new.description, 'u' || new.user_id);
+       END""",
+    # index the tasks that existed before the table
+    "INSERT INTO tasks_fts (rowid, description, owner) SELECT id, description, 'u' || user_id FROM tasks",
+]
+# Postgres: generated tsvector column with a GIN index.
+_POSTGRES_FTS = [
+    """ALTER TABLE tasks ADD COLUMN IF NOT EXISTS description_tsv tsvector
+           GENERATED ALWAYS AS (to_tsvector('simple', description)) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_tasks_description_tsv ON tasks USING GIN (description_tsv)",
+]
+
+def _create_search_index(conn: Connection) -> None:
+    """input: Connection
+       output: None
+       Creates the full-text index of the dialect, once."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        if inspect(conn).has_table("tasks_fts"):
+            return
+        for ddl in _SQLITE_FTS:
+            conn.exec_driver_sql(ddl)
+    elif dialect == "postgresql":
+        for ddl in _POSTGRES_FTS:
+            conn.exec_driver_sql(ddl)
+
+def _has_task_counters(conn: Connection) -> bool:
+    insp = inspect(conn)
+    if not insp.has_table("tasks"):
+        # new database: counters start right
+        return True
+    return insp.has_table("task_collections") and \
+        "task_count" in {c["name"] for c in insp.get_columns("task_collections")}
+
+def _fill_directory(conn: Connection) -> None:
+    """input: Connection to DATABASE_URL
+       output: None
+       Registers the users created before the directory existed (they are all on shard 0)."""
+    conn.exec_driver_sql(
+        "INSERT INTO user_directory (user_id, username, shard, moving) SELECT id, username, 0, false FROM users"
+    )
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(
+            "SELECT setval(pg_get_serial_sequence('user_directory', 'user_id'), "
+            "(SELECT COALESCE(MAX(user_id), 0) + 1 FROM user_directory), false)"
+        )
+
+def _create_tables(conn: Connection, tables: List[Table]) -> None:
+    Base.metadata.create_all(bind=conn, tables=tables)
+    _add_missing_columns(conn, tables)
+    # create_all skips the indexes of tables that already exist
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+def create_schema(engine: Engine, shard_engines: List[Engine]) -> None:
+    """input: Engine of DATABASE_URL (directory and shard 0), Engines of all shards in order
+       output: None
+       Creates missing tables, columns and indexes on every database. Counts the existing tasks when the
+       per-user task counters are introduced, and fills the directory when it is introduced.
+       Safe to run from several workers at once: see _schema_lock."""
+    with _schema_lock(engine) as conn:
+        fill = inspect(conn).has_table("users") and not inspect(conn).has_table("user_directory")
+        _create_tables(conn, _tables(directory=True, shard=False))
+        if fill:
+            _fill_directory(conn)
+    for shard in shard_engines:
+        with _schema_lock(shard) as conn:
+            recount = not _has_task_counters(conn)
+            _create_tables(conn, _tables(directory=False, shard=True))
+            _create_search_index(conn)
+            if recount:
+                # joins the locked transaction: its commit leaves it to the lock's
+                with Session(bind=conn) as db:
+                    tasks_repo.rebuild_stats(db)
+    if len(shard_engines) > 1:
+        # ids handed out from now on must be above every task id already in use
+        highest = 0
+        for shard in shard_engines:
+            with Session(shard) as db:
+                highest = max(highest, directory_repo.max_task_id(db))
+        with _schema_lock(engine) as conn, Session(bind=conn) as db:
+            directory_repo.reserve_ids(db, "tasks", 0, floor=highest + 1)
@@ -1,10 +1,61 @@
-from sqlalchemy import create_engine, make_url
-from sqlalchemy.orm import sessionmaker, declarative_base
+import hashlib
+import itertools
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+from sqlalchemy import Executable, Row, create_engine, event, make_url, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from starlette.concurrency import run_in_threadpool
+from .core.errors import UserMovingError
+from .core.metrics import instrument_engine
+from .core import profiling
 from .core.settings import get_settings
 
 # Purpose: Sets up the database connection and session management for the application
 settings = get_settings()
 DATABASE_URL = settings.database_url
+logger = logging.getLogger(__name__)
+
+# async drivers used when DB_ASYNC is enabled and the URL names a sync driver
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+# the repositories rely on INSERT ... ON CONFLICT and RETURNING
+_SUPPORTED_DIALECTS = ("sqlite", "postgresql")
+
+T = TypeVar("T")
+
+_UNPICKED = object()
+
+class RequestSession:
+    """The database handle a request gets: the Session behind it is created by the first repository
+    call (run_db/read_db) and closed again right after each call, so a pool connection is only held
+    while a repository function runs. Requests rejected before any query (bad token, cached
+    principal plus 304, ...) never touch the pool, and no connection is held while the response is
+    serialized. Objects returned by the repositories are detached with their loaded attributes.
+    The replica picked by the first read_db serves every read of the request, so a version and the
+    rows it describes come from the same copy; after a write (run_db) the reads stay on the primary."""
+
+    __slots__ = ("_factory", "_session", "replica")
+
+    def __init__(self, factory: Callable[[], Union[Session, AsyncSession]]):
+        self._factory = factory
+        self._session: Optional[Union[Session, AsyncSession]] = None
+        # replica bind of this request's reads (None: primary); _UNPICKED until the first read_db
+        self.replica: Any = _UNPICKED
+
+    def acquire(self) -> Union[Session, AsyncSession]:
+        if self._session is None:
+            self._session = self._factory()
+        return self._session
+
+DbSession = Union[Session, AsyncSession, RequestSession]
 
 def _connect_args(url: str) -> dict:
     """input: Database URL as a string
@@ -17,17 +68,531 @@ def _connect_args(url: str) -> dict:
         # if parsing fails, send no extra args
         return {}
 
-engine = create_engine(DATABASE_URL, connect_args=_connect_args(DATABASE_URL))
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _is_sqlite_memory(url: str) -> bool:
+    u = make_url(url)
+    return u.drivername.startswith("sqlite") and u.database in (None, "", ":memory:")
+
+class _PoolWaitStats:
+    """Checkout counters kept by the instrumented pools."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.held_total = 0.0
+        self.held_max = 0.0
+
+class _TimedPoolMixin:
+    """Times how long each checkout waits for a free connection (QueuePool._do_get)
+    and how long the connection is held until it is returned (_do_return_conn)."""
+
+    def _do_get(self):
+        stats = self.__dict__.setdefault("wait_stats", _PoolWaitStats())
+        t0 = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            stats.timeouts += 1
+            raise
+        now = time.perf_counter()
+        waited = now - t0
+        stats.checkouts += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+        conn.checked_out_at = now
+        return conn
+
+    def _do_return_conn(self, record):
+        checked_out_at = record.__dict__.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            stats = self.__dict__.setdefault("wait_stats", _PoolWaitStats())
+            held = time.perf_counter() - checked_out_at
+            stats.held_total += held
+            stats.held_max = max(stats.held_max, held)
+        super()._do_return_conn(record)
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def _engine_kwargs(url: str, *, is_async: bool = False) -> dict:
+    """input: Database URL as a string, whether the engine is async
+       output: keyword arguments for create_engine / create_async_engine
+       Connection args plus the pool configuration from the settings (in-memory SQLite keeps its default pool).
+       SQLite file connections cannot be dropped by a server, so they skip the pre-ping round trip on checkout.
+       Raises ValueError for a database other than SQLite or PostgreSQL, so the app fails at startup."""
+    dialect = make_url(url).get_backend_name()
+    if dialect not in _SUPPORTED_DIALECTS:
+        raise ValueError(f"Unsupported database '{dialect}' in {make_url(url)!r}: use one of {', '.join(_SUPPORTED_DIALECTS)}")
+    kwargs: Dict[str, Any] = {"connect_args": _connect_args(url)}
+    if _is_sqlite_memory(url):
+        return kwargs
+    kwargs.update(
+        poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping and not make_url(url).drivername.startswith("sqlite"),
+    )
+    return kwargs
+
+def _install_sqlite_pragmas(sync_engine: Engine, url: str, *, query_only: bool = False) -> None:
+    """input: a (sync) Engine and its URL, whether connections must refuse writes (replicas)
+       output: None
+       For SQLite, applies WAL / synchronous / busy_timeout / mmap_size to every new connection."""
+    if not make_url(url).drivername.startswith("sqlite"):
+        return
+    pragmas = ["PRAGMA query_only=ON"] if query_only else []
+    pragmas += [
+        f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}",
+        f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}",
+    ]
+    if not _is_sqlite_memory(url):
+        pragmas.insert(0, f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for pragma in pragmas:
+                cur.execute(pragma)
+        finally:
+            cur.close()
+
+def _async_url(url: str) -> str:
+    """input: Database URL as a string
+       output: the same URL with an async driver
+       Swaps the dialect's default driver for its asyncio counterpart (sqlite -> sqlite+aiosqlite, ...)."""
+    u = make_url(url)
+    if "+" in u.drivername:
+        return url
+    return u.set(drivername=_ASYNC_DRIVERS.get(u.drivername, u.drivername)).render_as_string(hide_password=False)
+
+# user id -> time of the user's last write, shared by the sync and async replica sets (per process)
+_recent_writes: Dict[int, float] = {}
+
+class ReplicaSet:
+    """Read replicas of the primary: round-robin over the healthy ones.
+
+    A replica that fails a health check or a query is skipped until a later check succeeds.
+    Reads of a user who wrote in the last DB_READ_YOUR_WRITES_SECONDS stay on the primary, so
+    clients see their own writes despite replication lag (tracked per process)."""
+
+    def __init__(self, engines: List[Union[Engine, AsyncEngine]], *, sticky_seconds: float):
+        self.engines = engines
+        self.sticky_seconds = sticky_seconds
+        self.healthy = [True] * len(engines)
+        self._rr = itertools.count()
+
+    @staticmethod
+    def _bind(engine: Union[Engine, AsyncEngine]) -> Engine:
+        # sessions (including the one inside an AsyncSession) bind to sync engines
+        return engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+
+    def pick(self, user_id: Optional[int] = None) -> Optional[Engine]:
+        """input: id of the user the read is for, if any
+           output: the (sync) Engine of the next healthy replica, or None to read from the primary"""
+        if not self.engines:
+            return None
+        if user_id is not None:
+            wrote_at = _recent_writes.get(user_id)
+            if wrote_at is not None and time.monotonic() - wrote_at < self.sticky_seconds:
+                return None
+        for _ in range(len(self.engines)):
+            i = next(self._rr) % len(self.engines)
+            if self.healthy[i]:
+                return self._bind(self.engines[i])
+        return None
+
+    def mark_down(self, bind: Engine) -> None:
+        for i, engine in enumerate(self.engines):
+            if self._bind(engine) is bind and self.healthy[i]:
+                self.healthy[i] = False
+                logger.warning("Replica %s marked down", bind.url.render_as_string(hide_password=True))
+
+    async def check(self) -> None:
+        """input: None
+           output: None
+           Ping every replica (SELECT 1) and update its health."""
+        for i, engine in enumerate(self.engines):
+            try:
+                if isinstance(engine, AsyncEngine):
+                    async with engine.connect() as conn:
+                        await conn.execute(text("SELECT 1"))
+                else:
+                    await run_in_threadpool(_ping, engine)
+                ok = True
+            except Exception:
+                ok = False
+            if ok != self.healthy[i]:
+                logger.warning("Replica %s is %s", engine.url.render_as_string(hide_password=True),
+                               "back up" if ok else "down")
+            self.healthy[i] = ok
+
+def _ping(sync_engine: Engine) -> None:
+    with sync_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+def note_write(user_id: Optional[int]) -> None:
+    """input: id of the user who just wrote
+       output: None
+       Starts the user's read-your-writes window (see ReplicaSet)."""
+    if user_id is None or not settings.database_replica_urls:
+        return
+    now = time.monotonic()
+    _recent_writes[user_id] = now
+    if len(_recent_writes) > 10000:
+        horizon = now - settings.db_read_your_writes_seconds
+        for uid in [u for u, at in _recent_writes.items() if at < horizon]:
+            del _recent_writes[uid]
+
+# user id -> (shard, moving, expiry) as last read from the directory, shared by both shard maps (per process)
+_placements: Dict[int, Tuple[int, bool, float]] = {}
+
+class ShardMap:
+    """The databases holding the users' rows (users, tasks, counters, tombstones), one user per shard.
+
+    Shard 0 is DATABASE_URL, which also holds the directory (user_directory); DATABASE_SHARD_URLS adds
+    shards 1..N-1. A new user is placed on home_shard(user_id), a hash of the id, and the directory
+    records the placement, so users stay where they are when shards are added until they are moved
+    (python -m app.data.maintenance rebalance). Placements are cached per process for
+    SHARD_MAP_CACHE_SECONDS: a move waits that long for every worker to notice it."""
+
+    def __init__(self, engines: List[Union[Engine, AsyncEngine]], *, cache_seconds: float):
+        self.engines = engines
+        self.cache_seconds = cache_seconds
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def bind(self, index: int) -> Engine:
+        """input: shard number
+           output: the shard's (sync) Engine, the one sessions bind to"""
+        engine = self.engines[index]
+        return engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+
+    async def locate(self, db: "DbSession", user_id: int, *, write: bool) -> int:
+        """input: a session (its own bind is shard 0, where the directory is), user id, whether the call writes
+           output: number of the shard holding the user's rows
+           Raises:
+             - UserMovingError for a write while the user is being moved"""
+        now = time.monotonic()
+        cached = _placements.get(user_id)
+        if cached is None or cached[2] < now:
+            # the repositories import this module
+            from .data.repositories import directory as directory_repo
+            placement = await _call(db, directory_repo.get_placement, (user_id,), {})
+            shard, moving = placement if placement is not None else (home_shard(user_id), False)
+            if len(_placements) > 100000:
+                _placements.clear()
+            cached = _placements[user_id] = (shard, moving, now + self.cache_seconds)
+        if write and cached[1]:
+            raise UserMovingError()
+        return cached[0]
+
+def home_shard(user_id: int) -> int:
+    """input: user id
+       output: the shard a new user is placed on (and rebalance moves the user to)"""
+    digest = hashlib.blake2b(user_id.to_bytes(8, "big", signed=True), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % (len(settings.database_shard_urls) + 1)
+
+class RoutingSession(Session):
+    """Session that sends the statements of one repository call to the user's shard while
+       session.info["shard"] holds it (set by run_db/read_db), and reads from a replica while
+       session.info["replica"] holds one (set by read_db); flushes and INSERT/UPDATE/DELETE
+       statements never go to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        shard = self.info.get("shard")
+        if shard is not None:
+            return shard
+        return super().get_bind(mapper, clause=clause, **kw)
+
+engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL))
+_install_sqlite_pragmas(engine, DATABASE_URL)
+instrument_engine(engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
 Base = declarative_base()
 
+def _replica_engine(url: str) -> Engine:
+    replica = create_engine(url, **_engine_kwargs(url))
+    _install_sqlite_pragmas(replica, url, query_only=True)
+    instrument_engine(replica)
+    return replica
+
+def _async_replica_engine(url: str) -> AsyncEngine:
+    replica = create_async_engine(_async_url(url), **_engine_kwargs(url, is_async=True))
+    _install_sqlite_pragmas(replica.sync_engine, url, query_only=True)
+    instrument_engine(replica.sync_engine)
+    return replica
+
+def _shard_engine(url: str) -> Engine:
+    shard = create_engine(url, **_engine_kwargs(url))
+    _install_sqlite_pragmas(shard, url)
+    instrument_engine(shard)
+    return shard
+
+def _async_shard_engine(url: str) -> AsyncEngine:
+    shard = create_async_engine(_async_url(url), **_engine_kwargs(url, is_async=True))
+    _install_sqlite_pragmas(shard.sync_engine, url)
+    instrument_engine(shard.sync_engine)
+    return shard
+
+replicas = ReplicaSet([_replica_engine(u) for u in settings.database_replica_urls],
+                      sticky_seconds=settings.db_read_your_writes_seconds)
+shards = ShardMap([engine] + [_shard_engine(u) for u in settings.database_shard_urls],
+                  cache_seconds=settings.shard_map_cache_seconds)
+
+async_engine = None
+AsyncSessionLocal = None
+async_replicas = None
+async_shards = None
+if settings.db_async:
+    async_engine = create_async_engine(_async_url(DATABASE_URL), **_engine_kwargs(DATABASE_URL, is_async=True))
+    _install_sqlite_pragmas(async_engine.sync_engine, DATABASE_URL)
+    instrument_engine(async_engine.sync_engine)
+    # objects are read after commit when the response is serialized, outside of any greenlet
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False,
+                                           sync_session_class=RoutingSession)
+    async_replicas = ReplicaSet([_async_replica_engine(u) for u in settings.database_replica_urls],
+                                sticky_seconds=settings.db_read_your_writes_seconds)
+    async_shards = ShardMap([async_engine] + [_async_shard_engine(u) for u in settings.database_shard_urls],
+                            cache_seconds=settings.shard_map_cache_seconds)
+
+async def check_replicas() -> None:
+    """input: None
+    output: None
+    purpose: Health-check the replicas of both engines (run periodically by the app lifespan)."""
+    await replicas.check()
+    if async_replicas is not None:
+        await async_replicas.check()
+
 # Dependency
-def get_db():
+async def get_db() -> RequestSession:
     """input: None
-    output: Yields a database session for use in requests.
-    purpose: Provides a session to interact with the database, ensuring it is closed after use."""
+    output: a RequestSession over SessionLocal for use in requests.
+    purpose: Provides a lazily opened session; run_db/read_db close it after each call, so there is
+    nothing to tear down when the request ends (and no threadpool hop to create it)."""
+    return RequestSession(SessionLocal)
+
+async def get_async_db() -> RequestSession:
+    """input: None
+    output: a RequestSession over AsyncSessionLocal for use in requests.
+    purpose: Async counterpart of get_db, used when DB_ASYNC is enabled."""
+    return RequestSession(AsyncSessionLocal)
+
+# the session dependency used by the routers, picked once from the settings
+get_session = get_async_db if settings.db_async else get_db
+
+def shards_for(db: Session) -> ShardMap:
+    """input: the Session a repository function runs with (inside an AsyncSession: its sync_session)
+       output: the ShardMap built on the same kind of engines
+       A session a repository function opens on another shard must use it: on the async engines its
+       queries await the driver like the caller's, instead of blocking the event loop."""
+    return async_shards if async_shards is not None and db.get_bind().dialect.is_async else shards
+
+def shard_session(index: int) -> Session:
+    """input: shard number
+    output: a Session bound to that shard
+    purpose: For maintenance that runs shard by shard (compaction, recounts, moving users)."""
+    return SessionLocal(bind=shards.bind(index))
+
+def _call_and_close(db: Session, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    # a profiled request samples this worker thread while the call runs
+    attached = profiling.attach_thread()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+        profiling.detach_thread(attached)
+
+async def _call(db: Union[Session, AsyncSession], fn: Callable[..., T], args: tuple, kwargs: dict,
+                *, release: bool = False) -> T:
+    """Runs fn(session, ...) off the event loop; with release, closes the session afterwards
+    (same threadpool hop), which returns its connections to the pool."""
+    if isinstance(db, AsyncSession):
+        try:
+            return await db.run_sync(fn, *args, **kwargs)
+        finally:
+            if release:
+                await db.close()
+    if release:
+        return await run_in_threadpool(_call_and_close, db, fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+def _sync_session(db: Union[Session, AsyncSession]) -> Session:
+    return db.sync_session if isinstance(db, AsyncSession) else db
+
+async def _route(db: Union[Session, AsyncSession], user_id: Optional[int], *, write: bool) -> Optional[Engine]:
+    """input: a session, id of the user the call is for (None: not a per-user call), whether it writes
+    output: bind of the user's shard, or None when the call stays on the session's own bind (shard 0)"""
+    shard_map = async_shards if isinstance(db, AsyncSession) else shards
+    if user_id is None or shard_map is None or len(shard_map) == 1:
+        return None
+    index = await shard_map.locate(db, user_id, write=write)
+    return shard_map.bind(index) if index else None
+
+async def run_db(db: DbSession, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """input: a Session or AsyncSession, a sync repository function and its arguments
+    output: the function's result
+    purpose: Awaitable entry point to the repositories. With an AsyncSession the function runs
+    through AsyncSession.run_sync, so its queries await the async driver instead of blocking;
+    with a plain Session it runs in the threadpool, as sync routes did.
+    A user_id keyword routes the call to that user's shard (other calls run on shard 0, with the
+    directory) and starts the user's read-your-writes window; never runs on a replica.
+    A RequestSession is opened for the call and closed right after it."""
+    if isinstance(db, RequestSession):
+        db.replica = None
+    result = await _call_primary(db, fn, args, kwargs, write=True)
+    note_write(kwargs.get("user_id"))
+    return result
+
+async def primary_read_db(db: DbSession, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """input: a Session or AsyncSession, a read-only repository function and its arguments
+    output: the function's result
+    purpose: read_db for reads that must see the latest commit (credentials, right after a registration):
+    runs on the primary (the user's shard) like run_db, but goes on while the user is being moved
+    and does not start a read-your-writes window.
+    A RequestSession is opened for the call and closed right after it."""
+    return await _call_primary(db, fn, args, kwargs, write=False)
+
+async def _call_primary(db: DbSession, fn: Callable[..., T], args: tuple, kwargs: dict, *, write: bool) -> T:
+    release = isinstance(db, RequestSession)
+    if release:
+        db = db.acquire()
+    try:
+        shard = await _route(db, kwargs.get("user_id"), write=write)
+        if shard is None:
+            return await _call(db, fn, args, kwargs, release=release)
+        session = _sync_session(db)
+        session.info["shard"] = shard
+        try:
+            return await _call(db, fn, args, kwargs, release=release)
+        finally:
+            session.info.pop("shard", None)
+    except BaseException:
+        if release:
+            await release_db(db)
+        raise
+
+async def read_db(db: DbSession, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """input: a Session or AsyncSession, a read-only repository function and its arguments
+    output: the function's result
+    purpose: run_db for calls that only read: they go to a healthy replica when replicas are configured
+    (unless the user_id argument wrote recently), and fall back to the primary if the replica fails.
+    All reads through one RequestSession use the same replica (see RequestSession).
+    Replicas copy DATABASE_URL: calls routed to another shard read that shard directly.
+    A RequestSession is opened for the call and closed right after it."""
+    handle = db
+    release = isinstance(db, RequestSession)
+    if release:
+        db = db.acquire()
+    session = _sync_session(db)
+    try:
+        shard = await _route(db, kwargs.get("user_id"), write=False)
+        if shard is not None:
+            session.info["shard"] = shard
+            return await _call(db, fn, args, kwargs, release=release)
+        replica_set = async_replicas if isinstance(db, AsyncSession) else replicas
+        replica = _request_replica(handle, replica_set, kwargs.get("user_id"))
+        if replica is None:
+            return await _call(db, fn, args, kwargs, release=release)
+        session.info["replica"] = replica
+        try:
+            return await _call(db, fn, args, kwargs, release=release)
+        except OperationalError:
+            replica_set.mark_down(replica)
+            if release:
+                # the primary is never behind the replica the earlier reads used
+                handle.replica = None
+            session.info.pop("replica", None)
+            await (db.rollback() if isinstance(db, AsyncSession) else run_in_threadpool(db.rollback))
+            return await _call(db, fn, args, kwargs, release=release)
+    except BaseException:
+        if release:
+            await release_db(db)
+        raise
+    finally:
+        session.info.pop("shard", None)
+        session.info.pop("replica", None)
+
+def _request_replica(handle: DbSession, replica_set: Optional[ReplicaSet], user_id: Optional[int]) -> Optional[Engine]:
+    """input: the handle read_db was called with, the replica set, id of the user the read is for
+    output: replica bind for this read, None for the primary; picked once per RequestSession"""
+    if replica_set is None:
+        return None
+    if not isinstance(handle, RequestSession):
+        return replica_set.pick(user_id)
+    if handle.replica is _UNPICKED:
+        handle.replica = replica_set.pick(user_id)
+    return handle.replica
+
+async def release_db(db: DbSession) -> None:
+    """input: a Session, AsyncSession or RequestSession
+    output: None
+    purpose: Ends the session's transaction and returns its connections to the pool (the session stays usable)."""
+    if isinstance(db, RequestSession):
+        if db._session is None:
+            return
+        db = db._session
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
+
+async def stream_rows(stmt: Executable, *, chunk_size: int, user_id: Optional[int] = None) -> AsyncIterator[List[Row]]:
+    """input: a SELECT, rows per chunk, id of the user the rows are read for
+    output: async iterator over lists of at most chunk_size rows
+    purpose: Streams a large result with a dedicated session and a server-side cursor (yield_per),
+    so memory stays constant whatever the row count. The request's session cannot be used: it is
+    closed before a streaming response body is sent. Reads the user's shard, from a replica when one is available."""
+    stmt = stmt.execution_options(yield_per=chunk_size)
+    if settings.db_async:
+        async with AsyncSessionLocal() as db:
+            shard = await _route(db, user_id, write=False)
+            db.sync_session.info.update(shard=shard, replica=None if shard is not None else async_replicas.pick(user_id))
+            result = await db.stream(stmt)
+            async for part in result.partitions():
+                yield part
+        return
     db = SessionLocal()
     try:
-        yield db
+        shard = await _route(db, user_id, write=False)
+        db.info.update(shard=shard, replica=None if shard is not None else replicas.pick(user_id))
+        partitions = (await run_in_threadpool(db.execute, stmt)).partitions()
+        while True:
+            part = await run_in_threadpool(next, partitions, None)
+            if part is None:
+                break
+            yield part
     finally:
-        db.close()
\ No newline at end of file
+        await run_in_threadpool(db.close)
+
+def pool_status(sync_engine: Engine) -> Dict[str, Any]:
+    """input: a (sync) Engine, e.g. engine or async_engine.sync_engine
+       output: dict with pool size, checked-in/out connections, overflow and checkout wait statistics
+       Snapshot of the connection pool for the metrics endpoints."""
+    pool = sync_engine.pool
+    status: Dict[str, Any] = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                      overflow=pool.overflow())
+    stats = pool.__dict__.get("wait_stats")
+    if stats is not None:
+        status.update(
+            checkouts=stats.checkouts,
+            checkout_timeouts=stats.timeouts,
+            checkout_wait_seconds_total=stats.wait_total,
+            checkout_wait_seconds_max=stats.wait_max,
+            connection_held_seconds_total=stats.held_total,
+            connection_held_seconds_max=stats.held_max,
+        )
+    return status
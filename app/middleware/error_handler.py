@@ -1,20 +1,24 @@
 import uuid
 import logging
-from fastapi import Request, HTTPException
+from fastapi import HTTPException
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from sqlalchemy.exc import SQLAlchemyError
 from jose import JWTError
-from app.core.errors import AppError, DatabaseError  
+from app.core.errors import AppError, DatabaseError
+from app.core.logging import request_id
 
 logger = logging.getLogger(__name__)
 
+# paths whose 404/405 responses are passed through untouched
+_DOCS_PATHS = ("/docs", "/redoc", "/openapi.json")
+
 def _json(status: int, code: str, message: str,
           *, fields: dict | None = None, details=None,
-          headers=None, error_id: str | None = None) -> JSONResponse:
+          headers=None, error_id: str | None = None) -> ORJSONResponse:
     """input: status, code, message, fields=None, details=None, headers=None, error_id=None
-       output: JSONResponse
+       output: ORJSONResponse
        Creates a JSON response with the given status, code, message, and optional fields, details, headers, and error_id."""
     body = {
         "error": {
@@ -22,7 +26,7 @@ def _json(status: int, code: str, message: str,
             "message": message,
         }
     }
-    
+
     if details is not None:
         body["error"]["details"] = details
     if fields is not None:
@@ -30,56 +34,85 @@ def _json(status: int, code: str, message: str,
     if error_id is not None:
         body["error"]["errorId"] = error_id
 
-    return JSONResponse(status_code=status, content=body, headers=headers)
+    return ORJSONResponse(status_code=status, content=body, headers=headers)
+
+def _error_response(exc: Exception, method: str, path: str) -> ORJSONResponse:
+    """input: exception raised by the app, request method and path
+       output: ORJSONResponse
+       Maps an exception to the uniform error envelope (call from inside the except block)."""
+    if isinstance(exc, AppError):
+        return _json(exc.http_status, exc.code, exc.message, details=getattr(exc, "details", None))
+
+    if isinstance(exc, RequestValidationError):
+        # 422 validation errors
+        field_map: dict[str, list[str]] = {}
+        for err in exc.errors():
+            loc = err.get("loc", [])
+            key = ".".join(str(x) for x in (loc[1:] if loc and loc[0] in {"body","query","path","header"} else loc)) or "request"
+            field_map.setdefault(key, []).append(err["msg"])
+        return _json(422, "VALIDATION_ERROR", "Invalid input.", fields=field_map)
+
+    if isinstance(exc, HTTPException):
+        detail = exc.detail
+        msg = detail if isinstance(detail, str) else (detail.get("message") if isinstance(detail, dict) else str(detail))
+        code = (detail.get("error") if isinstance(detail, dict) else None) or "HTTP_ERROR"
+        return _json(exc.status_code, code, msg or "HTTP error", headers=exc.headers)
+
+    if isinstance(exc, JWTError):
+        # Token issues
+        return _json(401, "INVALID_TOKEN", "Could not validate credentials",
+                     headers={"WWW-Authenticate": "Bearer"})
+
+    if isinstance(exc, SQLAlchemyError):
+        # DB issues
+        err_id = request_id.get() or str(uuid.uuid4())
+        logger.exception("SQLAlchemyError %s at %s %s", err_id, method, path)
+        return _json(500, "DATABASE_ERROR", "Something went wrong. Try again later.", error_id=err_id)
+
+    # Catch-all for unexpected errors
+    err_id = request_id.get() or str(uuid.uuid4())
+    logger.exception("Unhandled %s at %s %s", err_id, method, path)
+    return _json(500, "INTERNAL_SERVER_ERROR", "Unexpected error. Try again later.", error_id=err_id)
+
+class ErrorHandlingMiddleware:
+    """Pure ASGI middleware: turns exceptions into the uniform error envelope and rewrites
+       bare 404/405 responses, without the extra task and stream BaseHTTPMiddleware adds per request."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """input: ASGI scope, receive, send
+           output: None
+           Handles errors during request processing and sends appropriate JSON responses."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rewrite = scope.get("path", "") not in _DOCS_PATHS
+        started = False
+        replaced = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal started, replaced
+            if replaced:
+                # swallow the body of a response we already replaced
+                return
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if rewrite and status in (404, 405):
+                    replaced = True
+                    response = _json(404, "HTTP_ERROR", "Not found") if status == 404 \
+                        else _json(405, "HTTP_ERROR", "Method not allowed")
+                    await response(scope, receive, send)
+                    return
+                started = True
+            await send(message)
 
-class ErrorHandlingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        """input: request, call_next
-           output: JSONResponse or response from call_next
-           Handles errors during request processing and returns appropriate JSON responses."""
         try:
-            response = await call_next(request)
-
-        except AppError as e:
-            return _json(e.http_status, e.code, e.message, details=getattr(e, "details", None))
-
-        except RequestValidationError as e:
-            # 422 validation errors
-            field_map: dict[str, list[str]] = {}
-            for err in e.errors():
-                loc = err.get("loc", [])
-                key = ".".join(str(x) for x in (loc[1:] if loc and loc[0] in {"body","query","path","header"} else loc)) or "request"
-                field_map.setdefault(key, []).append(err["msg"])
-            return _json(422, "VALIDATION_ERROR", "Invalid input.", fields=field_map)
-
-        except HTTPException as e:
-            detail = e.detail
-            msg = detail if isinstance(detail, str) else (detail.get("message") if isinstance(detail, dict) else str(detail))
-            code = (detail.get("error") if isinstance(detail, dict) else None) or "HTTP_ERROR"
-            return _json(e.status_code, code, msg or "HTTP error", headers=e.headers)
-
-        except JWTError:
-            # Token issues
-            return _json(401, "INVALID_TOKEN", "Could not validate credentials",
-                         headers={"WWW-Authenticate": "Bearer"})
-
-        except SQLAlchemyError:
-            # DB issues
-            err_id = str(uuid.uuid4())
-            logger.exception("SQLAlchemyError %s at %s %s", err_id, request.method, request.url.path)
-            return _json(500, "DATABASE_ERROR", "Something went wrong. Try again later.", error_id=err_id)
-
-        except Exception:
-            # Catch-all for unexpected errors
-            err_id = str(uuid.uuid4())
-            logger.exception("Unhandled %s at %s %s", err_id, request.method, request.url.path)
-            return _json(500, "INTERNAL_SERVER_ERROR", "Unexpected error. Try again later.", error_id=err_id)
-        
-        path = request.url.path
-        if path not in ("/docs", "/redoc", "/openapi.json") and response.status_code in (404, 405):
-            if response.status_code == 404:
-                return _json(404, "HTTP_ERROR", "Not found")
-            if response.status_code == 405:
-                return _json(405, "HTTP_ERROR", "Method not allowed")
-
-        return response
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            if started or replaced:
+                raise
+            response = _error_response(e, scope.get("method", ""), scope.get("path", ""))
+            await response(scope, receive, send)
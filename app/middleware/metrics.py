@@ -0,0 +1,74 @@
+import logging
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+# fingerprints listed in an over-budget warning
+_TOP_STATEMENTS = 5
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request count, latency, in-flight requests and DB usage per route template.
+
+    server_timing: add `Server-Timing: db;dur=<ms>;desc="<n> queries", app;dur=<ms>` to every response
+    query_budget:  log requests that ran more statements than this, with their most repeated statements (0 = off)"""
+
+    def __init__(self, app: ASGIApp, *, server_timing: bool = True, query_budget: int = 0):
+        self.app = app
+        self.server_timing = server_timing
+        self.query_budget = query_budget
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """input: ASGI scope, receive, send
+           output: None (calls the app and records the request once it is done)
+           The route label is the matched template (/tasks/{task_id}), read from the scope after routing,
+           so label cardinality stays bounded; unmatched paths share one label."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status = 500
+        usage = metrics.QueryUsage(fingerprints=self.query_budget > 0)
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    # statements run before the headers go out; a streamed body may run more afterwards
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", f'db;dur={usage.seconds * 1e3:.2f};desc="{usage.count} queries", '
+                                                    f"app;dur={(time.perf_counter() - t0) * 1e3:.2f}")
+            await send(message)
+
+        token = metrics.request_db_usage.set(usage)
+        metrics.http_in_progress.inc(method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            metrics.http_in_progress.dec(method)
+            metrics.request_db_usage.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            labels = (method, route, str(status))
+            metrics.http_requests.inc(*labels)
+            metrics.http_request_duration.observe(elapsed, *labels)
+            metrics.request_db_queries.observe(usage.count, route)
+            metrics.request_db_time.observe(usage.seconds, route)
+            if self.query_budget and usage.count > self.query_budget:
+                self._log_over_budget(method, route, usage)
+
+    def _log_over_budget(self, method: str, route: str, usage: metrics.QueryUsage) -> None:
+        """input: request method and route template, the request's query usage
+           output: None
+           One warning with the statement count and the most repeated statements; a statement repeated
+           many times in one request is the usual sign of an N+1 query (one query per row of a list)."""
+        top = sorted(usage.fingerprints.items(), key=lambda item: item[1], reverse=True)[:_TOP_STATEMENTS]
+        logger.warning(
+            "%s %s ran %d statements (budget %d) in %.1f ms; most repeated:\n%s",
+            method, route, usage.count, self.query_budget, usage.seconds * 1e3,
+            "\n".join(f"  {count}x {statement}" for statement, count in top),
+        )
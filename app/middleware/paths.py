@@ -0,0 +1,20 @@
+import re
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+_SLASHES = re.compile(r"/{2,}")
+
+class CollapseSlashesMiddleware:
+    """Pure ASGI middleware normalizing paths like //register to /register before routing."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """input: ASGI scope with path like /register or //register
+           output: None (calls the app with the normalized path)
+           middleware to ensure no double slashes in paths"""
+        if scope["type"] == "http":
+            path = scope.get("path", "")
+            if "//" in path:
+                scope["path"] = _SLASHES.sub("/", path)
+        await self.app(scope, receive, send)
@@ -0,0 +1,55 @@
+import random
+import time
+from typing import Iterable
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.profiling import Profiler
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware profiling a random share of requests and keeping the profiles of slow ones.
+
+    sample_rate: share of requests (0..1) whose profile is always kept
+    slow_ms:     also keep the profile of any request slower than this (0 = off); every request is sampled
+                 then, since a request is only known to be slow once it is done
+    skip_paths:  paths never profiled, e.g. streams (server-sent events, exports) that stay open far longer
+                 than slow_ms and would push the profiles of really slow requests out"""
+
+    def __init__(self, app: ASGIApp, *, profiler: Profiler, sample_rate: float = 0.0, slow_ms: float = 0.0,
+                 skip_paths: Iterable[str] = ()):
+        self.app = app
+        self.profiler = profiler
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """input: ASGI scope, receive, send
+           output: None (calls the app; profiles the request when it is picked or could turn out slow)"""
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and not self.slow_ms:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        handle = self.profiler.begin()
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - t0) * 1e3
+            slow = bool(self.slow_ms) and duration_ms >= self.slow_ms
+            self.profiler.end(
+                handle, keep=sampled or slow,
+                reason="slow" if slow else "sampled", method=scope["method"], path=scope["path"],
+                route=getattr(scope.get("route"), "path", None), status=status,
+                duration_ms=round(duration_ms, 2), started_at=started,
+            )
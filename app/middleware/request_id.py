@@ -0,0 +1,36 @@
+import re
+import uuid
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.logging import request_id
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# ids accepted from the client (e.g. set by a proxy); anything else is replaced by a fresh one
+_VALID_ID = re.compile(r"[A-Za-z0-9._-]{1,128}")
+
+class RequestIdMiddleware:
+    """Pure ASGI middleware giving every request an id: taken from X-Request-ID or generated,
+       stamped on the request's log records and echoed back in the X-Request-ID response header."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """input: ASGI scope, receive, send
+           output: None (calls the app with the request id set)"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = next((v for k, v in scope["headers"] if k == b"x-request-id"), b"").decode("latin-1")
+        rid = incoming if _VALID_ID.fullmatch(incoming) else uuid.uuid4().hex
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(REQUEST_ID_HEADER, rid)
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from ..authentication import Principal, get_admin_user
+from ..core.errors import ProfileNotFoundError
+from ..core.profiling import Profiler
+from ..core.settings import get_settings
+
+# Purpose: Router for admin-only diagnostics (users listed in ADMIN_USERNAMES)
+router = APIRouter(prefix="/admin")
+settings = get_settings()
+
+# request profiles taken by ProfilingMiddleware (app.py adds it when PROFILE_SAMPLE_RATE or PROFILE_SLOW_MS is set)
+profiler = Profiler(interval=settings.profile_interval_ms / 1000, keep=settings.profile_keep)
+
+@router.get("/profiles")
+def list_profiles(_: Principal = Depends(get_admin_user)):
+    """input: None
+       output: stored request profiles, newest first: id, reason (sampled/slow), method, path, route, status,
+               duration_ms, started_at, interval_ms, samples
+       List the request profiles still in the buffer"""
+    return profiler.summaries()
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: int, _: Principal = Depends(get_admin_user)):
+    """input: profile_id (int)
+       output: the profile as collapsed stacks ("frame;frame;... count" per line), for flamegraph.pl or speedscope
+       Get one request profile"""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise ProfileNotFoundError(profile_id)
+    return PlainTextResponse(profiler.collapsed(profile))
@@ -0,0 +1,45 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from .. import database
+from ..core import metrics
+from ..business import tasks as tasks_service
+
+# Purpose: Router for operational metrics endpoints
+router = APIRouter(prefix="/metrics")
+
+@router.get("", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """input: None
+       output: Prometheus text exposition of this process's metrics
+       Request count and latency per route template and status, requests in flight,
+       database queries and time per request, bcrypt time, auth cache hits and misses"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/pool")
+def pool_metrics():
+    """input: None
+       output: connection pool state per engine
+       Report checked-out connections, overflow and checkout wait time"""
+    pools = {"primary": database.pool_status(database.engine)}
+    if database.async_engine is not None:
+        pools["async"] = database.pool_status(database.async_engine.sync_engine)
+    for name, replica_set in (("replica", database.replicas), ("async_replica", database.async_replicas)):
+        if replica_set is None:
+            continue
+        for i, (replica, healthy) in enumerate(zip(replica_set.engines, replica_set.healthy)):
+            bind = replica.sync_engine if hasattr(replica, "sync_engine") else replica
+            pools[f"{name}_{i}"] = {**database.pool_status(bind), "healthy": healthy}
+    for name, shard_map in (("shard", database.shards), ("async_shard", database.async_shards)):
+        if shard_map is None:
+            continue
+        # shard 0 is the primary
+        for i in range(1, len(shard_map)):
+            pools[f"{name}_{i}"] = database.pool_status(shard_map.bind(i))
+    return pools
+
+@router.get("/events")
+def events_metrics():
+    """input: None
+       output: task event broker state
+       Report connected listeners and events published by this process"""
+    return tasks_service.task_events.stats()
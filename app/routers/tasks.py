@@ -1,46 +1,187 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from typing import List
-from ..database import get_db
+import asyncio
+import orjson
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
+from ..database import DbSession, get_session
 from .. import schemas
-from ..authentication import get_current_user
-from ..data import models
+from ..authentication import get_current_user_id
 from ..business import tasks as tasks_service
+from ..core.settings import get_settings
+from ..core.serialization import task_changes_to_json, task_rows_to_json
+from ..core.http_cache import cache_headers, etag_matches, not_modified, weak_etag
 
 # Purpose: Router for task-related endpoints
 router = APIRouter(prefix="/tasks")
+settings = get_settings()
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 @router.post("", response_model=schemas.TaskOut)
-def add_task(task_in: schemas.TaskCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def add_task(task_in: schemas.TaskCreate, db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
     """input: TaskCreate schema
        output: TaskOut schema
        Add a new task for the current user"""
-    return tasks_service.add_task(db, current_user=current_user, description=task_in.description)
+    return await tasks_service.add_task(db, user_id=user_id, description=task_in.description)
 
 @router.get("", response_model=List[schemas.TaskOut])
-def list_tasks(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def list_tasks(request: Request,
+                     limit: int = Query(settings.tasks_page_size_default, ge=1, le=settings.tasks_page_size_max),
+                     after: Optional[int] = Query(None, description="Cursor: id of the last task of the previous page"),
+                     completed: Optional[bool] = None,
+                     order: Literal["asc", "desc"] = "asc",
+                     db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
+    """input: limit, after (cursor), completed filter, order
+       output: List of TaskOut schemas (one page), next cursor in the X-Next-Cursor header
+       List the tasks of the current user, one keyset page at a time.
+       Carries a weak ETag from the user's task-list version; a matching If-None-Match gets 304
+       before any task is read. Rows are encoded straight to JSON bytes; response_model only documents the shape."""
+    version = await tasks_service.get_version(db, user_id=user_id)
+    etag = weak_etag(user_id, version, request.url.query)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    page, next_cursor = await tasks_service.list_tasks(
+        db, user_id=user_id, limit=limit, after=after, completed=completed, order=order,
+    )
+    headers = cache_headers(etag)
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+    return Response(content=task_rows_to_json(page), media_type="application/json", headers=headers)
+
+@router.get("/stats", response_model=schemas.TaskStats)
+async def task_stats(db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
     """input: None
-       output: List of TaskOut schemas
-       List all tasks for the current user"""
-    return tasks_service.list_tasks(db, current_user=current_user)
+       output: TaskStats schema (total, completed, open)
+       Task counts of the current user, read from counters instead of counting the tasks"""
+    return await tasks_service.get_stats(db, user_id=user_id)
+
+@router.get("/search", response_model=List[schemas.TaskOut])
+async def search_tasks(q: str = Query(..., min_length=1, max_length=200),
+                       limit: int = Query(settings.tasks_page_size_default, ge=1, le=settings.tasks_page_size_max),
+                       offset: int = Query(0, ge=0, description="Cursor: X-Next-Cursor of the previous page"),
+                       db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
+    """input: q (words to look for), limit, offset
+       output: List of TaskOut schemas, best match first; next page's offset in the X-Next-Cursor header
+       Full-text search in the current user's tasks, served by the search index"""
+    page, next_offset = await tasks_service.search_tasks(db, user_id=user_id, q=q, limit=limit, offset=offset)
+    headers = {NEXT_CURSOR_HEADER: str(next_offset)} if next_offset is not None else None
+    return Response(content=task_rows_to_json(page), media_type="application/json", headers=headers)
+
+@router.get("/changes", response_model=schemas.TaskChanges)
+async def list_changes(since: int = Query(0, ge=0, description="version from the previous response, 0 for everything"),
+                       after: Optional[int] = Query(None, description="Cursor: next_after of the previous page "
+                                                                      "(pass its next_since as since)"),
+                       limit: int = Query(settings.tasks_page_size_max, ge=1, le=settings.tasks_page_size_max),
+                       db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
+    """input: since (version of the client's copy), after (page cursor), limit
+       output: TaskChanges schema: current version and at most limit upserts/deletes after since, by revision;
+               has_more with next_since/next_after when more changes are left
+       Delta sync for the current user: the cost depends on what changed, not on the list size.
+       410 CHANGES_EXPIRED when deletes after since were compacted; the client must reload from since=0."""
+    version, upserts, deletes, next_page = await tasks_service.list_changes(db, user_id=user_id, since=since,
+                                                                            after=after, limit=limit)
+    return Response(content=task_changes_to_json(version, upserts, deletes, next_page), media_type="application/json")
+
+@router.post("/import", response_model=schemas.TaskImportResult)
+async def import_tasks(request: Request, format: Literal["ndjson", "csv"] = "ndjson",
+                       db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
+    """input: request body streamed as NDJSON (one TaskCreate per line) or CSV (header with a description column),
+              gzip when sent with Content-Encoding: gzip
+       output: TaskImportResult schema: imported and failed row counts, first per-row errors
+       Bulk create tasks for the current user without buffering the upload"""
+    gzip = request.headers.get("content-encoding", "").lower() == "gzip"
+    return await tasks_service.import_tasks(db, user_id=user_id, body=request.stream(), fmt=format, gzip=gzip)
+
+_EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+@router.get("/export")
+async def export_tasks(format: Literal["ndjson", "csv"] = "ndjson", gzip: bool = False,
+                       user_id: int = Depends(get_current_user_id)):
+    """input: format (ndjson | csv), gzip flag
+       output: streamed file with every task of the current user
+       Rows are read with a server-side cursor and written as they arrive: constant memory for any account size"""
+    filename = f"tasks.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        tasks_service.export_tasks(user_id=user_id, fmt=format, gzip=gzip),
+        media_type="application/gzip" if gzip else _EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.get("/events")
+async def task_events(user_id: int = Depends(get_current_user_id)):
+    """input: None (authenticated user)
+       output: text/event-stream of the current user's task changes
+       Push instead of polling: one "upsert" / "delete" event per change (same shape as GET /tasks/changes),
+       a comment line as keepalive, and "resync" when this connection fell behind and events were dropped
+       (the client then catches up through GET /tasks/changes)."""
+    sub = tasks_service.subscribe(user_id)
+
+    async def stream():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.get(), settings.events_keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"event: " + event["type"].encode() + b"\ndata: " + orjson.dumps(event) + b"\n\n"
+        finally:
+            tasks_service.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/{task_id}", response_model=schemas.TaskOut)
+async def get_task(task_id: int, request: Request, response: Response,
+                   db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
+    """input: task_id (int)
+       output: TaskOut schema, or 304 when If-None-Match matches
+       Get one task of the current user, with the same version-based weak ETag as the list"""
+    version = await tasks_service.get_version(db, user_id=user_id)
+    etag = weak_etag(user_id, version, task_id)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    task = await tasks_service.get_task(db, user_id=user_id, task_id=task_id)
+    response.headers.update(cache_headers(etag))
+    return task
+
+@router.post("/batch", response_model=schemas.TaskBatchResponse)
+async def batch_tasks(batch: schemas.TaskBatchRequest, db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
+    """input: TaskBatchRequest schema (list of create/update/delete operations)
+       output: TaskBatchResponse schema, one result per operation in request order
+       Apply many task operations for the current user in one transaction"""
+    results = await tasks_service.batch_tasks(
+        db, user_id=user_id, operations=[op.model_dump() for op in batch.operations],
+    )
+    out = []
+    for index, (op, (task, err)) in enumerate(zip(batch.operations, results)):
+        item = {"index": index, "op": op.op, "ok": err is None, "id": getattr(op, "id", None)}
+        if err is not None:
+            item["error"] = {"code": err.code, "message": err.message}
+        elif op.op != "delete":
+            item["id"] = task["id"]
+            item["task"] = task
+        out.append(item)
+    return {"results": out}
 
 @router.put("/{task_id}", response_model=schemas.TaskOut)
-def update_task(task_id: int, task_up: schemas.TaskUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def update_task(task_id: int, task_up: schemas.TaskUpdate, db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
     """input: TaskUpdate schema
        output: TaskOut schema
        Update an existing task for the current user"""
-    return tasks_service.update_task(
+    return await tasks_service.update_task(
         db,
-        current_user=current_user,
+        user_id=user_id,
         task_id=task_id,
         description=task_up.description,
         completed=task_up.completed,
     )
 
 @router.delete("/{task_id}")
-def delete_task(task_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def delete_task(task_id: int, db: DbSession = Depends(get_session), user_id: int = Depends(get_current_user_id)):
     """input: task_id (int)
        output: None
        Delete a task for the current user"""
-    tasks_service.delete_task(db, current_user=current_user, task_id=task_id)
+    await tasks_service.delete_task(db, user_id=user_id, task_id=task_id)
     return {"message": "Task deleted successfully"}
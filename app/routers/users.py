@@ -1,8 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import DbSession, get_session
 from .. import schemas
-from ..authentication import create_access_token
+from ..authentication import create_user_token
 from ..business import users as users_service
 from fastapi.security import OAuth2PasswordRequestForm
 
@@ -10,30 +9,30 @@ from fastapi.security import OAuth2PasswordRequestForm
 router = APIRouter()
 
 @router.post("/register", response_model=schemas.UserOut)
-def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user_in: schemas.UserCreate, db: DbSession = Depends(get_session)):
     """input: UserCreate schema
        output: UserOut schema
        register a new user"""
-    user = users_service.register_user(db, username=user_in.username, password=user_in.password)
+    user = await users_service.register_user(db, username=user_in.username, password=user_in.password)
     return user
 
 @router.post("/login", response_model=schemas.Token)
-def login(creds: schemas.LoginRequest, db: Session = Depends(get_db)):
+async def login(creds: schemas.LoginRequest, db: DbSession = Depends(get_session)):
     """input: LoginRequest schema
        output: Token schema
        authenticate a user and return a JWT token"""
-    user = users_service.authenticate_user(db, username=creds.username, password=creds.password)
-    token = create_access_token({"sub": user.username})
+    user = await users_service.authenticate_user(db, username=creds.username, password=creds.password)
+    token = create_user_token(user)
     return {"access_token": token}
 
 @router.post("/token", response_model=schemas.Token)
-def issue_token(form: OAuth2PasswordRequestForm = Depends(),
-                db: Session = Depends(get_db)):
+async def issue_token(form: OAuth2PasswordRequestForm = Depends(),
+                      db: DbSession = Depends(get_session)):
       """input: OAuth2PasswordRequestForm
          output: Token schema
          authenticate a user and return a JWT token"""
-      user = users_service.authenticate_user(
+      user = await users_service.authenticate_user(
         db, username=form.username, password=form.password
     )
-      token = create_access_token({"sub": user.username})
+      token = create_user_token(user)
       return {"access_token": token, "token_type": "bearer"}
\ No newline at end of file
@@ -1,5 +1,9 @@
 from .users import UserCreate, UserOut, Token, LoginRequest
-from .tasks import TaskBase, TaskCreate, TaskUpdate, TaskOut
+from .tasks import (
+    TaskBase, TaskCreate, TaskUpdate, TaskOut, TaskStats, TaskChange, TaskChanges, TaskImportError, TaskImportResult,
+    TaskBatchCreate, TaskBatchUpdate, TaskBatchDelete, TaskBatchOp,
+    TaskBatchRequest, TaskBatchError, TaskBatchResult, TaskBatchResponse,
+)
 
 __all__ = [
     "UserCreate",
@@ -10,4 +14,17 @@ __all__ = [
     "TaskCreate",
     "TaskUpdate",
     "TaskOut",
+    "TaskStats",
+    "TaskChange",
+    "TaskChanges",
+    "TaskImportError",
+    "TaskImportResult",
+    "TaskBatchCreate",
+    "TaskBatchUpdate",
+    "TaskBatchDelete",
+    "TaskBatchOp",
+    "TaskBatchRequest",
+    "TaskBatchError",
+    "TaskBatchResult",
+    "TaskBatchResponse",
 ]
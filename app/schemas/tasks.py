@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Union
+from typing_extensions import Annotated
 
 # -------- Tasks --------
 class TaskBase(BaseModel):
@@ -20,3 +21,65 @@ class TaskOut(BaseModel):
     
     class Config:
         from_attributes = True
+
+class TaskStats(BaseModel):
+    total: int
+    completed: int
+    open: int
+
+# -------- Delta sync --------
+class TaskChange(BaseModel):
+    op: Literal["upsert", "delete"]
+    revision: int
+    id: Optional[int] = None
+    task: Optional[TaskOut] = None
+
+class TaskChanges(BaseModel):
+    version: int
+    changes: List[TaskChange]
+    has_more: bool
+    next_since: Optional[int] = None
+    next_after: Optional[int] = None
+
+# -------- Import --------
+class TaskImportError(BaseModel):
+    row: int
+    message: str
+
+class TaskImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[TaskImportError]
+
+# -------- Batch --------
+class TaskBatchCreate(BaseModel):
+    op: Literal["create"]
+    description: str
+
+class TaskBatchUpdate(TaskBase):
+    op: Literal["update"]
+    id: int
+
+class TaskBatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: int
+
+TaskBatchOp = Annotated[Union[TaskBatchCreate, TaskBatchUpdate, TaskBatchDelete], Field(discriminator="op")]
+
+class TaskBatchRequest(BaseModel):
+    operations: List[TaskBatchOp] = Field(min_length=1)
+
+class TaskBatchError(BaseModel):
+    code: str
+    message: str
+
+class TaskBatchResult(BaseModel):
+    index: int
+    op: str
+    ok: bool
+    id: Optional[int] = None
+    task: Optional[TaskOut] = None
+    error: Optional[TaskBatchError] = None
+
+class TaskBatchResponse(BaseModel):
+    results: List[TaskBatchResult]
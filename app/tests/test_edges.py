@@ -2,6 +2,7 @@ import httpx
 import pytest
 import random
 import string
+import time
 
 BASE_URL = "http://127.0.0.1:8000"
 
@@ -23,6 +24,16 @@ def login(c: httpx.Client, username: str, password: str):
 def auth_headers(token: str):
     return {"Authorization": f"Bearer {token}"}
 
+def db_queries(response: httpx.Response) -> int:
+    """SQL statements the request ran, from its Server-Timing header (db;dur=..;desc="N queries")."""
+    db = next(m for m in response.headers["server-timing"].split(",") if m.strip().startswith("db;"))
+    return int(db.split('desc="')[1].split()[0])
+
+def assert_queries(response: httpx.Response, budget: int):
+    """Fail when the request ran more statements than budget."""
+    n = db_queries(response)
+    assert n <= budget, f"{response.request.method} {response.request.url.path} ran {n} queries (budget {budget})"
+
 # ---------- Registration edge cases ----------
 
 def test_register_idempotent_same_password_returns_200(client):
@@ -67,6 +78,68 @@ def test_login_wrong_password_401_with_code(client):
     # our global handler (InvalidCredentialsError) should set this code
     assert r.json().get("error", {}).get("code") == "INVALID_PASSWORD"
 
+def test_login_while_user_is_moving(client):
+    # shares the server's settings (DATABASE_URL, DATABASE_SHARD_URLS) to flag the user in the directory
+    from app.core.settings import get_settings
+    from app.database import shard_session, shards
+    from app.data.repositories import directory as directory_repo
+    if len(shards) == 1:
+        pytest.skip("users only move between shards (DATABASE_SHARD_URLS)")
+    username, pw = rnd_user("moving"), "Secret123"
+    user_id = register(client, username, pw).json()["id"]
+    with shard_session(0) as db:
+        shard, _ = directory_repo.get_placement(db, user_id)
+        directory_repo.set_placement(db, user_id, shard=shard, moving=True)
+    try:
+        time.sleep(get_settings().shard_map_cache_seconds + 0.5)  # until the server sees the flag
+        r = login(client, username, pw)
+        assert r.status_code == 200
+        assert register(client, username, pw).status_code == 200
+        token = r.json()["access_token"]
+        # writes wait for the move
+        r = client.post(f"{BASE_URL}/tasks", json={"description": "x"}, headers=auth_headers(token))
+        assert r.status_code == 503 and r.json()["error"]["code"] == "USER_MOVING"
+    finally:
+        with shard_session(0) as db:
+            directory_repo.set_placement(db, user_id, shard=shard, moving=False)
+
+def test_abandoned_username_claim_is_taken_over(client):
+    # a registration that died between the directory claim and the users row, written straight to the directory
+    from app.core.settings import get_settings
+    from app.database import shard_session
+    from app.data import models
+    grace = get_settings().username_reservation_grace_seconds
+    fresh, stale, pw = rnd_user("claim"), rnd_user("claim"), "Secret123"
+    with shard_session(0) as db:
+        db.add_all([models.UserDirectory(username=fresh, shard=0, reserved_at=int(time.time())),
+                    models.UserDirectory(username=stale, shard=0, reserved_at=int(time.time() - grace - 1))])
+        db.commit()
+    assert register(client, fresh, pw).status_code == 409  # may still be in progress
+    r = register(client, stale, pw)
+    assert r.status_code == 200
+    assert login(client, stale, pw).status_code == 200
+
+def test_credential_change_revokes_earlier_tokens(client):
+    # changes the password through the ORM, in this process, on the server's database
+    import app.authentication  # noqa: F401  (its listener stamps tokens_valid_after)
+    from app.core.passwords import pwd_context
+    from app.database import shard_session
+    from app.data import models
+    from app.data.repositories import directory as directory_repo
+    username, pw = rnd_user("revoke"), "Secret123"
+    user_id = register(client, username, pw).json()["id"]
+    token = login(client, username, pw).json()["access_token"]
+    time.sleep(1.1)  # iat has whole seconds
+    with shard_session(0) as db:
+        shard, _ = directory_repo.get_placement(db, user_id)
+    with shard_session(shard) as db:
+        db.get(models.User, user_id).password_hash = pwd_context.hash("Secret456")
+        db.commit()
+    # not cached by the server yet: checked against the stored tokens_valid_after
+    assert client.get(f"{BASE_URL}/tasks", headers=auth_headers(token)).status_code == 401
+    token = login(client, username, "Secret456").json()["access_token"]
+    assert client.get(f"{BASE_URL}/tasks", headers=auth_headers(token)).status_code == 200
+
 def test_tasks_requires_auth_header_401(client):
     r = client.get(f"{BASE_URL}/tasks")
     assert r.status_code == 401  # produced by OAuth2 (not our handler)
@@ -149,3 +222,444 @@ def test_delete_idempotent_behavior(client):
     r2 = client.delete(f"{BASE_URL}/tasks/{tid}", headers=headers)
     assert r2.status_code == 404
     assert r2.json().get("error", {}).get("code") == "TASK_NOT_FOUND"
+
+def test_list_tasks_keyset_pagination_and_filter(client):
+    user, pw = rnd_user("page"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    token = login(client, user, pw).json()["access_token"]
+    headers = auth_headers(token)
+
+    ids = [client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": f"t{i}"}).json()["id"] for i in range(5)]
+    client.put(f"{BASE_URL}/tasks/{ids[1]}", headers=headers, json={"completed": True})
+
+    # walk the pages via the cursor header
+    seen, after = [], None
+    while True:
+        params = {"limit": 2}
+        if after is not None:
+            params["after"] = after
+        r = client.get(f"{BASE_URL}/tasks", headers=headers, params=params)
+        assert r.status_code == 200
+        assert len(r.json()) <= 2
+        seen += [t["id"] for t in r.json()]
+        after = r.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert seen == ids
+
+    r = client.get(f"{BASE_URL}/tasks", headers=headers, params={"completed": False, "order": "desc"})
+    assert [t["id"] for t in r.json()] == [i for i in reversed(ids) if i != ids[1]]
+    assert "X-Next-Cursor" not in r.headers
+
+    # page size is bounded
+    assert client.get(f"{BASE_URL}/tasks", headers=headers, params={"limit": 0}).status_code == 422
+
+def test_batch_operations_per_item_results(client):
+    user_a, user_b, pw = rnd_user("batcha"), rnd_user("batchb"), "Secret123"
+    assert register(client, user_a, pw).status_code == 200
+    assert register(client, user_b, pw).status_code == 200
+    ha = auth_headers(login(client, user_a, pw).json()["access_token"])
+    hb = auth_headers(login(client, user_b, pw).json()["access_token"])
+
+    foreign = client.post(f"{BASE_URL}/tasks", headers=hb, json={"description": "B's task"}).json()["id"]
+    mine = client.post(f"{BASE_URL}/tasks", headers=ha, json={"description": "old"}).json()["id"]
+    doomed = client.post(f"{BASE_URL}/tasks", headers=ha, json={"description": "doomed"}).json()["id"]
+
+    r = client.post(f"{BASE_URL}/tasks/batch", headers=ha, json={"operations": [
+        {"op": "create", "description": "n1"},
+        {"op": "create", "description": "n2"},
+        {"op": "update", "id": mine, "completed": True},
+        {"op": "delete", "id": doomed},
+        {"op": "update", "id": foreign, "completed": True},
+        {"op": "delete", "id": 99999999},
+    ]})
+    assert r.status_code == 200
+    res = r.json()["results"]
+    assert [x["ok"] for x in res] == [True, True, True, True, False, False]
+    assert [res[0]["task"]["description"], res[1]["task"]["description"]] == ["n1", "n2"]
+    assert res[2]["task"] == {"id": mine, "user_id": res[0]["task"]["user_id"], "description": "old", "completed": True}
+    assert res[4]["error"]["code"] == "TASK_FORBIDDEN"
+    assert res[5]["error"]["code"] == "TASK_NOT_FOUND"
+
+    tasks = {t["id"]: t for t in client.get(f"{BASE_URL}/tasks", headers=ha).json()}
+    assert doomed not in tasks and tasks[mine]["completed"] is True
+    assert {res[0]["id"], res[1]["id"]} <= set(tasks)
+
+    # malformed operation -> validation error
+    r = client.post(f"{BASE_URL}/tasks/batch", headers=ha, json={"operations": [{"op": "update"}]})
+    assert r.status_code == 422
+
+def test_pool_metrics_report_connection_state(client):
+    r = client.get(f"{BASE_URL}/metrics/pool")
+    assert r.status_code == 200
+    primary = r.json()["primary"]
+    assert {"pool", "checked_out"} <= set(primary)
+
+def test_prometheus_metrics_per_route_template(client):
+    user, pw = rnd_user("prom"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+    tid = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "m"}).json()["id"]
+    client.get(f"{BASE_URL}/tasks/{tid}", headers=headers)
+    client.get(f"{BASE_URL}/tasks/{10**9}", headers=headers)
+
+    r = client.get(f"{BASE_URL}/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    samples = {}
+    for line in r.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    # the task id is not a label: both lookups share the route template
+    assert samples['http_requests_total{method="GET",route="/tasks/{task_id}",status="200"}'] >= 1
+    assert samples['http_requests_total{method="GET",route="/tasks/{task_id}",status="404"}'] >= 1
+    assert samples['http_requests_in_progress{method="GET"}'] == 1  # this scrape
+    assert samples['http_request_db_queries_count{route="/tasks"}'] >= 1
+    assert samples['http_request_db_queries_sum{route="/tasks"}'] >= 1
+    assert samples['db_queries_total'] >= 1
+    assert samples['password_hash_duration_seconds_count{op="hash"}'] >= 1
+    assert samples['password_hash_duration_seconds_count{op="verify"}'] >= 1
+    assert samples['password_hash_pending'] == 0
+    # the token is looked up once, then served from the auth cache
+    assert samples['auth_cache_lookups_total{result="miss"}'] >= 1
+    assert samples['auth_cache_lookups_total{result="hit"}'] >= 2
+    assert samples['auth_cache_entries'] >= 1
+
+def test_query_budget_per_route(client):
+    # budgets leave room for one shard-directory lookup (sharded setups); adding a query to a route fails here
+    user, pw = rnd_user("qb"), "Secret123"
+    assert_queries(register(client, user, pw), 6)
+    r = login(client, user, pw)
+    assert_queries(r, 3)
+    headers = auth_headers(r.json()["access_token"])
+    r = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "q"})
+    assert_queries(r, 4)
+    tid = r.json()["id"]
+    assert_queries(client.get(f"{BASE_URL}/tasks", headers=headers), 3)
+    assert_queries(client.get(f"{BASE_URL}/tasks/{tid}", headers=headers), 3)
+    assert_queries(client.get(f"{BASE_URL}/tasks/stats", headers=headers), 2)
+    assert_queries(client.get(f"{BASE_URL}/tasks/search", headers=headers, params={"q": "q"}), 2)
+    assert_queries(client.get(f"{BASE_URL}/tasks/changes", headers=headers, params={"since": 0}), 3)
+    assert_queries(client.put(f"{BASE_URL}/tasks/{tid}", headers=headers, json={"completed": True}), 3)
+    assert_queries(client.delete(f"{BASE_URL}/tasks/{tid}", headers=headers), 4)
+    assert db_queries(client.get(f"{BASE_URL}/tasks")) == 0  # rejected before any query
+
+def test_query_count_does_not_grow_with_rows(client):
+    # N+1 guard: listing or batch-updating many tasks costs the same statements as a few
+    user, pw = rnd_user("np1"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+
+    def counts(n):
+        ops = [{"op": "create", "description": f"t{i}"} for i in range(n)]
+        ids = [x["id"] for x in client.post(f"{BASE_URL}/tasks/batch", headers=headers,
+                                            json={"operations": ops}).json()["results"]]
+        listed = client.get(f"{BASE_URL}/tasks", headers=headers)
+        ops = [{"op": "update", "id": i, "completed": True} for i in ids]
+        updated = client.post(f"{BASE_URL}/tasks/batch", headers=headers, json={"operations": ops})
+        return db_queries(listed), db_queries(updated)
+
+    assert counts(2) == counts(40)
+
+def test_admin_profiles_require_admin(client):
+    user, pw = rnd_user("prof"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+    assert client.get(f"{BASE_URL}/admin/profiles").status_code == 401
+    r = client.get(f"{BASE_URL}/admin/profiles", headers=headers)
+    assert r.status_code == 403 and r.json()["error"]["code"] == "ADMIN_REQUIRED"
+    assert client.get(f"{BASE_URL}/admin/profiles/1", headers=headers).status_code == 403
+
+def test_request_id_generated_or_passed_through(client):
+    r = client.get(f"{BASE_URL}/tasks")  # errors carry one too
+    assert r.status_code == 401 and len(r.headers["x-request-id"]) == 32
+    assert client.get(f"{BASE_URL}/tasks").headers["x-request-id"] != r.headers["x-request-id"]
+    r = client.get(f"{BASE_URL}/tasks", headers={"X-Request-ID": "edge-7f3a.1"})
+    assert r.headers["x-request-id"] == "edge-7f3a.1"
+    r = client.get(f"{BASE_URL}/tasks", headers={"X-Request-ID": "not a valid id"})
+    assert r.headers["x-request-id"] != "not a valid id"
+
+def test_conditional_get_etag_304_until_write(client):
+    user, pw = rnd_user("etag"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+    tid = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "cached"}).json()["id"]
+
+    r1 = client.get(f"{BASE_URL}/tasks", headers=headers)
+    etag = r1.headers["ETag"]
+    r2 = client.get(f"{BASE_URL}/tasks", headers={**headers, "If-None-Match": etag})
+    assert r2.status_code == 304 and r2.headers["ETag"] == etag
+
+    # another page shape has its own tag
+    assert client.get(f"{BASE_URL}/tasks?limit=1", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+    r_one = client.get(f"{BASE_URL}/tasks/{tid}", headers=headers)
+    assert r_one.status_code == 200 and r_one.json()["description"] == "cached"
+    one_etag = r_one.headers["ETag"]
+    assert client.get(f"{BASE_URL}/tasks/{tid}", headers={**headers, "If-None-Match": one_etag}).status_code == 304
+
+    # any write bumps the version
+    client.put(f"{BASE_URL}/tasks/{tid}", headers=headers, json={"completed": True})
+    r3 = client.get(f"{BASE_URL}/tasks", headers={**headers, "If-None-Match": etag})
+    assert r3.status_code == 200 and r3.headers["ETag"] != etag
+    assert client.get(f"{BASE_URL}/tasks/{tid}", headers={**headers, "If-None-Match": one_etag}).status_code == 200
+
+def test_delta_sync_returns_only_changes_since_version(client):
+    user, pw = rnd_user("sync"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+    a = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "a"}).json()["id"]
+    b = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "b"}).json()["id"]
+
+    full = client.get(f"{BASE_URL}/tasks/changes", headers=headers).json()
+    assert {c["task"]["id"] for c in full["changes"]} == {a, b}
+    since = full["version"]
+
+    assert client.get(f"{BASE_URL}/tasks/changes?since={since}", headers=headers).json() == {
+        "version": since, "changes": [], "has_more": False}
+
+    client.put(f"{BASE_URL}/tasks/{a}", headers=headers, json={"completed": True})
+    client.delete(f"{BASE_URL}/tasks/{b}", headers=headers)
+    delta = client.get(f"{BASE_URL}/tasks/changes?since={since}", headers=headers).json()
+    assert delta["version"] > since
+    assert [(c["op"], c.get("id") or c["task"]["id"]) for c in delta["changes"]] == [("upsert", a), ("delete", b)]
+    assert delta["changes"][0]["task"]["completed"] is True
+
+def test_delta_sync_pages_through_one_revision(client):
+    user, pw = rnd_user("sync"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+    # one batch: five tasks stamped with the same revision
+    ops = [{"op": "create", "description": f"t{i}"} for i in range(5)]
+    client.post(f"{BASE_URL}/tasks/batch", headers=headers, json={"operations": ops})
+    client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "t5"})
+
+    mirror, params, pages = {}, {"since": 0, "limit": 2}, 0
+    while True:
+        page = client.get(f"{BASE_URL}/tasks/changes", headers=headers, params=params).json()
+        assert len(page["changes"]) <= 2
+        for c in page["changes"]:
+            if c["op"] == "upsert":
+                mirror[c["task"]["id"]] = c["task"]["description"]
+            else:
+                mirror.pop(c["id"], None)
+        if pages == 0:
+            # a task already sent is deleted while the client is still paging
+            client.delete(f"{BASE_URL}/tasks/{page['changes'][0]['task']['id']}", headers=headers)
+        pages += 1
+        if not page["has_more"]:
+            break
+        params = {"since": page["next_since"], "after": page["next_after"], "limit": 2}
+    assert pages >= 3
+    server = {t["id"]: t["description"] for t in client.get(f"{BASE_URL}/tasks", headers=headers).json()}
+    assert mirror == server and len(server) == 5
+    done = client.get(f"{BASE_URL}/tasks/changes", headers=headers, params={"since": page["version"]}).json()
+    assert done["changes"] == []
+
+def test_task_events_stream_pushes_changes(client):
+    user, pw = rnd_user("sse"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+
+    with httpx.Client(timeout=10.0) as listener:
+        with listener.stream("GET", f"{BASE_URL}/tasks/events", headers=headers) as r:
+            assert r.status_code == 200
+            assert r.headers["content-type"].startswith("text/event-stream")
+            lines = r.iter_lines()
+            assert next(lines).startswith("retry:")
+
+            tid = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "pushed"}).json()["id"]
+            client.delete(f"{BASE_URL}/tasks/{tid}", headers=headers)
+
+            events = []
+            for line in lines:
+                if line.startswith("event:"):
+                    events.append(line.split(":", 1)[1].strip())
+                if len(events) == 2:
+                    break
+    assert events == ["upsert", "delete"]
+
+
+def test_sqlite_broker_catches_up_and_resyncs_after_pruning(tmp_path):
+    # two workers' brokers on one file, in this process; polls and prunes are run by hand
+    import asyncio
+    from app.core.events import RESYNC_EVENT, SqliteFileBroker
+
+    async def scenario():
+        path = str(tmp_path / "events.db")
+        writer, reader = (SqliteFileBroker(path, queue_size=5000, poll_interval=3600) for _ in range(2))
+        for broker in (writer, reader):
+            await broker.start()
+        try:
+            sub = reader.subscribe(1)
+            await writer.publish_many(1, [{"type": "upsert", "revision": i} for i in range(2500)])
+            await reader._poll()  # more rows than one read
+            assert [sub.queue.get_nowait()["revision"] for _ in range(2500)] == list(range(2500))
+
+            # the reader stalls while the writer prunes an event it has not read
+            await writer.publish(1, {"type": "delete", "revision": 2500})
+            writer.retention = -1
+            writer._prune()
+            await reader._poll()
+            assert sub.queue.get_nowait() == RESYNC_EVENT and sub.queue.empty()
+        finally:
+            for broker in (writer, reader):
+                await broker.stop()
+
+    asyncio.run(scenario())
+
+def test_export_streams_ndjson_csv_and_gzip(client):
+    import csv, gzip, io, json
+    user, pw = rnd_user("exp"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+    ops = [{"op": "create", "description": f"task, \"{i}\""} for i in range(25)]
+    assert client.post(f"{BASE_URL}/tasks/batch", headers=headers, json={"operations": ops}).status_code == 200
+
+    r = client.get(f"{BASE_URL}/tasks/export", headers=headers)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [t["description"] for t in rows] == [o["description"] for o in ops]
+
+    r = client.get(f"{BASE_URL}/tasks/export?format=csv", headers=headers)
+    table = list(csv.reader(io.StringIO(r.text)))
+    assert table[0] == ["id", "user_id", "description", "completed"]
+    assert len(table) == 26 and table[1][2] == 'task, "0"' and table[1][3] == "false"
+
+    r = client.get(f"{BASE_URL}/tasks/export?gzip=true", headers=headers)
+    assert r.headers["content-type"] == "application/gzip"
+    assert gzip.decompress(r.content).decode().splitlines() == [json.dumps(t, separators=(",", ":")) for t in rows]
+
+def test_import_ndjson_and_csv_reports_row_errors(client):
+    import gzip
+    user, pw = rnd_user("imp"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+
+    ndjson = b'{"description": "one"}\n{"nope": 1}\n\n{"description": "two"}\nnot json\n'
+    r = client.post(f"{BASE_URL}/tasks/import", headers=headers, content=ndjson)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["imported"] == 2 and body["failed"] == 2
+    assert [e["row"] for e in body["errors"]] == [2, 4]
+
+    data = b'id,description,completed\r\n1,"multi\nline, with comma",false\n2,plain,true\n'
+    r = client.post(f"{BASE_URL}/tasks/import?format=csv",
+                    headers={**headers, "Content-Encoding": "gzip"}, content=gzip.compress(data))
+    assert r.json() == {"imported": 2, "failed": 0, "errors": []}
+
+    r = client.post(f"{BASE_URL}/tasks/import?format=csv", headers=headers, content=b"title\nx\n")
+    assert r.status_code == 400 and r.json()["error"]["code"] == "INVALID_IMPORT"
+
+    descriptions = [t["description"] for t in client.get(f"{BASE_URL}/tasks", headers=headers).json()]
+    assert descriptions == ["one", "two", "multi\nline, with comma", "plain"]
+
+def test_import_rejects_oversized_record(client):
+    from app.core.settings import get_settings
+    limit = get_settings().tasks_import_max_record_bytes
+    user, pw = rnd_user("imp"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+
+    # a line that never ends, and a CSV quote that is never closed
+    for fmt, body in [("ndjson", b'{"description": "' + b"x" * limit),
+                      ("csv", b'description\n"' + b"line\n" * (limit // 5 + 1))]:
+        r = client.post(f"{BASE_URL}/tasks/import?format={fmt}", headers=headers, content=body)
+        assert r.status_code == 400 and r.json()["error"]["code"] == "INVALID_IMPORT"
+
+def test_import_rejects_gzip_bomb(client):
+    import zlib
+    from app.core.settings import get_settings
+    limit = get_settings().tasks_import_max_bytes
+    user, pw = rnd_user("imp"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+
+    # blank lines: no record is too long, only the decompressed total is
+    packer = zlib.compressobj(wbits=31)
+    block = (b" " * 1023 + b"\n") * 1024
+    body = b"".join(packer.compress(block) for _ in range(limit // len(block) + 1)) + packer.flush()
+    assert len(body) < limit // 100
+    r = client.post(f"{BASE_URL}/tasks/import", headers={**headers, "Content-Encoding": "gzip"}, content=body)
+    assert r.status_code == 400 and r.json()["error"]["code"] == "INVALID_IMPORT"
+
+def test_import_error_reports_committed_rows(client):
+    import gzip
+    from app.core.settings import get_settings
+    chunk = get_settings().tasks_import_chunk_size
+    user, pw = rnd_user("imp"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+
+    # cut inside the gzip trailer: every row inflates, but the body is not complete
+    rows = b"".join(b'{"description": "t%d"}\n' % i for i in range(chunk + 10))
+    body = gzip.compress(rows)[:-4]
+    r = client.post(f"{BASE_URL}/tasks/import", headers={**headers, "Content-Encoding": "gzip"}, content=body)
+    assert r.status_code == 400
+    error = r.json()["error"]
+    assert error["code"] == "INVALID_IMPORT" and error["details"] == {"imported": chunk, "failed": 0}
+    assert client.get(f"{BASE_URL}/tasks/stats", headers=headers).json()["total"] == chunk
+
+def test_search_ranked_prefix_and_scoped_to_user(client):
+    user, pw = rnd_user("srch"), "Secret123"
+    other = rnd_user("srch")
+    assert register(client, user, pw).status_code == 200
+    assert register(client, other, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+    other_headers = auth_headers(login(client, other, pw).json()["access_token"])
+
+    ids = {}
+    for d in ["pick up milk and bread and eggs", "milk", "Call mom", "Café visit"]:
+        ids[d] = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": d}).json()["id"]
+    client.post(f"{BASE_URL}/tasks", headers=other_headers, json={"description": "milk for someone else"})
+
+    def search(**params):
+        r = client.get(f"{BASE_URL}/tasks/search", headers=headers, params=params)
+        assert r.status_code == 200
+        return [t["description"] for t in r.json()]
+
+    assert search(q="milk") == ["milk", "pick up milk and bread and eggs"]
+    assert search(q="bread MIL") == ["pick up milk and bread and eggs"]
+    assert search(q="bre milk") == []  # only the last word is a prefix
+    assert search(q="cafe") == ["Café visit"]
+
+    # renames are reindexed, deletes drop out
+    client.put(f"{BASE_URL}/tasks/{ids['Call mom']}", headers=headers, json={"description": "Call dad"})
+    assert search(q="mom") == []
+    client.delete(f"{BASE_URL}/tasks/{ids['milk']}", headers=headers)
+
+    page = client.get(f"{BASE_URL}/tasks/search", headers=headers, params={"q": "milk", "limit": 1})
+    assert [t["id"] for t in page.json()] == [ids["pick up milk and bread and eggs"]]
+    assert "X-Next-Cursor" not in page.headers
+
+def test_stats_counters_follow_every_write(client):
+    user, pw = rnd_user("stats"), "Secret123"
+    assert register(client, user, pw).status_code == 200
+    headers = auth_headers(login(client, user, pw).json()["access_token"])
+
+    def stats():
+        return client.get(f"{BASE_URL}/tasks/stats", headers=headers).json()
+
+    assert stats() == {"total": 0, "completed": 0, "open": 0}
+    a = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "a"}).json()["id"]
+    b = client.post(f"{BASE_URL}/tasks", headers=headers, json={"description": "b"}).json()["id"]
+    client.put(f"{BASE_URL}/tasks/{a}", headers=headers, json={"completed": True})
+    client.put(f"{BASE_URL}/tasks/{a}", headers=headers, json={"completed": True})  # no flip
+    assert stats() == {"total": 2, "completed": 1, "open": 1}
+
+    ops = [{"op": "create", "description": "c"}, {"op": "update", "id": b, "completed": True},
+           {"op": "delete", "id": a}, {"op": "delete", "id": 10**9}]
+    client.post(f"{BASE_URL}/tasks/batch", headers=headers, json={"operations": ops})
+    assert stats() == {"total": 2, "completed": 1, "open": 1}
+
+    # updates of one task merge column by column; every result shows the task as the batch left it
+    ops = [{"op": "update", "id": b, "completed": False}, {"op": "update", "id": b, "description": "b2"},
+           {"op": "update", "id": b, "completed": True}]
+    res = client.post(f"{BASE_URL}/tasks/batch", headers=headers, json={"operations": ops}).json()["results"]
+    assert [(x["task"]["description"], x["task"]["completed"]) for x in res] == [("b2", True)] * 3
+    assert stats() == {"total": 2, "completed": 1, "open": 1}
+
+    client.post(f"{BASE_URL}/tasks/import", headers=headers, content=b'{"description": "d"}\n{"description": "e"}\n')
+    client.delete(f"{BASE_URL}/tasks/{b}", headers=headers)
+    assert stats() == {"total": 3, "completed": 0, "open": 3}
+    assert len(client.get(f"{BASE_URL}/tasks", headers=headers).json()) == 3
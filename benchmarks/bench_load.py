@@ -0,0 +1,323 @@
+"""Load benchmark: mixed register/login/CRUD/list traffic against the real app.app:app.
+
+Seeds --users users with --tasks-per-user tasks each, then runs --concurrency clients for --duration seconds,
+each picking operations by the weights of --mix, and reports requests/s and p50/p95/p99 latency per endpoint.
+A user has at most one request in flight, so at most min(--concurrency, users) requests run at once.
+
+Two modes:
+  - asgi:   the app runs in this process, driven through httpx.ASGITransport (no sockets; lifespan included)
+  - server: the app runs under `uvicorn --workers N` in a child process, driven over HTTP on 127.0.0.1
+
+Unless DATABASE_URL is set, each run uses a fresh SQLite file in a temporary directory.
+--save writes the results as JSON; --baseline compares against such a file and exits 1 when an endpoint's
+p95 got slower, or its requests/s lower, by more than --tolerance (a fraction).
+
+    python -m benchmarks.bench_load [--mode asgi|server] [--workers 4] [--concurrency 32] [--duration 10]
+                                    [--users 50] [--tasks-per-user 200] [--mix create=20,list=30,...]
+                                    [--save bench.json] [--baseline bench.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+PASSWORD = "BenchPass123"
+DEFAULT_MIX = {"register": 1, "login": 4, "create": 20, "get": 20, "update": 15, "delete": 10, "list": 30}
+# operation -> endpoint label in the report
+ENDPOINTS = {
+    "register": "POST /register", "login": "POST /login", "create": "POST /tasks", "get": "GET /tasks/{id}",
+    "update": "PUT /tasks/{id}", "delete": "DELETE /tasks/{id}", "list": "GET /tasks",
+}
+
+
+class _User:
+    """A seeded (or registered) user, its token and the ids of its tasks that still exist."""
+    __slots__ = ("username", "token", "task_ids")
+
+    def __init__(self, username: str, token: str):
+        self.username, self.token, self.task_ids = username, token, []
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class Recorder:
+    """Latency samples (seconds) and error counts per endpoint; nothing is kept while disabled (warm-up)."""
+
+    def __init__(self):
+        self.enabled = False
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        """input: client, endpoint label, method, url, httpx request arguments
+           output: the response, or None if the request failed or got an error status"""
+        t0 = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        elapsed = time.perf_counter() - t0
+        failed = response is None or response.status_code >= 400
+        if self.enabled:
+            self.samples[endpoint].append(elapsed)
+            if failed:
+                self.errors[endpoint] += 1
+        return None if failed else response
+
+
+def _percentile(sorted_samples: List[float], q: float) -> float:
+    """nearest-rank percentile of an ascending list"""
+    return sorted_samples[max(0, math.ceil(q / 100 * len(sorted_samples)) - 1)]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> Dict:
+    """input: recorder of the measured phase, its length in seconds
+       output: {"total": stats, "endpoints": {label: stats}} with count, errors, rps, p50_ms, p95_ms, p99_ms"""
+    def stats(samples: List[float], errors: int) -> Dict:
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered), "errors": errors, "rps": round(len(ordered) / elapsed, 1),
+            **{f"p{q}_ms": round(_percentile(ordered, q) * 1e3, 2) if ordered else None for q in (50, 95, 99)},
+        }
+    endpoints = {name: stats(s, recorder.errors[name]) for name, s in sorted(recorder.samples.items())}
+    everything = [x for s in recorder.samples.values() for x in s]
+    return {"total": stats(everything, sum(recorder.errors.values())), "endpoints": endpoints}
+
+
+async def _register(client: httpx.AsyncClient, recorder: Recorder, username: str) -> Optional[_User]:
+    body = {"username": username, "password": PASSWORD}
+    if await recorder.call(client, ENDPOINTS["register"], "POST", "/register", json=body) is None:
+        return None
+    response = await recorder.call(client, ENDPOINTS["login"], "POST", "/login", json=body)
+    return _User(username, response.json()["access_token"]) if response is not None else None
+
+
+async def seed(client: httpx.AsyncClient, *, users: int, tasks_per_user: int, concurrency: int, prefix: str) -> List[_User]:
+    """input: client, number of users, tasks per user, parallel requests, username prefix
+       output: the seeded users (tasks created through POST /tasks/batch)"""
+    recorder = Recorder()
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> _User:
+        async with gate:
+            user = await _register(client, recorder, f"{prefix}-seed-{i}")
+            if user is None:
+                raise SystemExit(f"seeding failed: could not register {prefix}-seed-{i}")
+            for start in range(0, tasks_per_user, 1000):
+                ops = [{"op": "create", "description": f"seeded task {n}"}
+                       for n in range(start, min(start + 1000, tasks_per_user))]
+                response = await client.post("/tasks/batch", json={"operations": ops}, headers=user.headers)
+                response.raise_for_status()
+                user.task_ids.extend(r["id"] for r in response.json()["results"])
+            return user
+
+    return list(await asyncio.gather(*(one(i) for i in range(users))))
+
+
+async def _worker(client: httpx.AsyncClient, recorder: Recorder, idle: "asyncio.Queue[_User]", mix: Dict[str, int],
+                  deadline: float, prefix: str, rng: random.Random) -> None:
+    """Run operations until the deadline; a user is taken off the idle queue for the length of one operation,
+    so each user (like a real client) has one request in flight and its task ids never race."""
+    ops, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, weights)[0]
+        user = await idle.get()
+        try:
+            await _operation(client, recorder, idle, user, op, prefix, rng)
+        finally:
+            idle.put_nowait(user)
+
+
+async def _operation(client: httpx.AsyncClient, recorder: Recorder, idle: "asyncio.Queue[_User]", user: _User,
+                     op: str, prefix: str, rng: random.Random) -> None:
+    if op in ("get", "update", "delete") and not user.task_ids:
+        op = "create"
+    label = ENDPOINTS[op]
+    if op == "register":
+        new = await _register(client, recorder, f"{prefix}-{uuid.uuid4().hex[:12]}")
+        if new is not None:
+            idle.put_nowait(new)
+    elif op == "login":
+        await recorder.call(client, label, "POST", "/login", json={"username": user.username, "password": PASSWORD})
+    elif op == "create":
+        response = await recorder.call(client, label, "POST", "/tasks", json={"description": "load task"},
+                                       headers=user.headers)
+        if response is not None:
+            user.task_ids.append(response.json()["id"])
+    elif op == "get":
+        await recorder.call(client, label, "GET", f"/tasks/{rng.choice(user.task_ids)}", headers=user.headers)
+    elif op == "update":
+        body = {"description": "updated load task", "completed": rng.random() < 0.5}
+        await recorder.call(client, label, "PUT", f"/tasks/{rng.choice(user.task_ids)}", json=body,
+                            headers=user.headers)
+    elif op == "delete":
+        task_id = user.task_ids.pop(rng.randrange(len(user.task_ids)))
+        await recorder.call(client, label, "DELETE", f"/tasks/{task_id}", headers=user.headers)
+    else:
+        await recorder.call(client, label, "GET", "/tasks", headers=user.headers)
+
+
+async def drive(client: httpx.AsyncClient, args: argparse.Namespace) -> Dict:
+    """input: client bound to the app, parsed arguments
+       output: summary of the measured phase (see summarize)"""
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    t0 = time.perf_counter()
+    users = await seed(client, users=args.users, tasks_per_user=args.tasks_per_user,
+                       concurrency=args.concurrency, prefix=prefix)
+    print(f"seeded {len(users)} users x {args.tasks_per_user} tasks in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    warm_end = time.perf_counter() + args.warmup
+    deadline = warm_end + args.duration
+    idle: "asyncio.Queue[_User]" = asyncio.Queue()
+    for user in users:
+        idle.put_nowait(user)
+    workers = [asyncio.create_task(_worker(client, recorder, idle, args.mix, deadline, prefix,
+                                           random.Random(rng.random())))
+               for _ in range(args.concurrency)]
+    await asyncio.sleep(max(0.0, warm_end - time.perf_counter()))
+    recorder.enabled = True
+    started = time.perf_counter()
+    await asyncio.gather(*workers)
+    return summarize(recorder, time.perf_counter() - started)
+
+
+async def run_asgi(args: argparse.Namespace) -> Dict:
+    """Serve app.app:app in this process (lifespan included) and drive it through httpx.ASGITransport."""
+    from app.app import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await drive(client, args)
+
+
+async def run_server(args: argparse.Namespace) -> Dict:
+    """Serve app.app:app with `uvicorn --workers N` in a child process and drive it over HTTP."""
+    import app.app  # noqa: F401  creates the schema once, before the workers race to do it
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.app:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            for _ in range(150):
+                if server.poll() is not None:
+                    raise SystemExit("uvicorn exited during startup")
+                try:
+                    await client.get("/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+            else:
+                raise SystemExit("uvicorn did not start listening within 30s")
+            return await drive(client, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """input: this run's results, a saved run, allowed relative slowdown
+       output: one line per endpoint that regressed beyond the tolerance (empty if none)"""
+    regressions = []
+    rows = [("total", result["total"], baseline.get("total"))]
+    rows += [(name, stats, baseline.get("endpoints", {}).get(name)) for name, stats in result["endpoints"].items()]
+    print(f"\n{'vs baseline':<22}{'req/s':>10}{'p95 ms':>10}")
+    for name, now, then in rows:
+        if not then or not then.get("count") or not now["count"]:
+            continue
+        rps_change = now["rps"] / then["rps"] - 1 if then["rps"] else 0.0
+        p95_change = now["p95_ms"] / then["p95_ms"] - 1 if then["p95_ms"] else 0.0
+        print(f"{name:<22}{rps_change:>+9.1%}{p95_change:>+10.1%}")
+        if rps_change < -tolerance or p95_change > tolerance:
+            regressions.append(f"{name}: req/s {rps_change:+.1%}, p95 {p95_change:+.1%}")
+    return regressions
+
+
+def report(result: Dict) -> None:
+    print(f"{'endpoint':<22}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in [*result["endpoints"].items(), ("total", result["total"])]:
+        pct = [f"{s[k]:>10.2f}" if s[k] is not None else f"{'-':>10}" for k in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:<22}{s['count']:>8}{s['errors']:>8}{s['rps']:>10.1f}{''.join(pct)}")
+
+
+def _parse_mix(raw: str) -> Dict[str, int]:
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        op, _, weight = part.partition("=")
+        if op not in ENDPOINTS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"bad mix entry {part!r} (expected op=weight, op one of {', '.join(ENDPOINTS)})")
+        mix[op] = int(weight)
+    mix = {op: w for op, w in mix.items() if w > 0}
+    if not mix:
+        raise argparse.ArgumentTypeError("the mix has no operation with a positive weight")
+    return mix
+
+
+def main(args: argparse.Namespace) -> int:
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    if "DATABASE_URL" not in os.environ:
+        workdir = tempfile.mkdtemp(prefix="bench-load-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/app.db"
+        os.environ.setdefault("EVENTS_SQLITE_PATH", f"{workdir}/events.db")
+    runner = run_asgi if args.mode == "asgi" else run_server
+    summary = asyncio.run(runner(args))
+    result = {
+        "meta": {
+            "mode": args.mode, "workers": args.workers if args.mode == "server" else 1,
+            "concurrency": args.concurrency, "duration": args.duration, "users": args.users,
+            "tasks_per_user": args.tasks_per_user, "mix": args.mix,
+        },
+        **summary,
+    }
+    report(result)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("meta") != result["meta"]:
+            print("note: baseline was recorded with different settings", file=sys.stderr)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("\nregressions beyond tolerance:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["asgi", "server"], default="asgi")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers (server mode)")
+    parser.add_argument("--port", type=int, default=8765, help="uvicorn port (server mode)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks-per-user", type=int, default=200)
+    parser.add_argument("--mix", type=_parse_mix, default=dict(DEFAULT_MIX),
+                        help="op=weight overrides, e.g. list=50,register=0")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""Microbenchmark: per-request overhead of the error-handling + slash-collapsing middleware.
+
+Compares the previous BaseHTTPMiddleware-based stack with the pure ASGI middleware now used
+by app/app.py, both wrapped around a trivial endpoint and driven directly through ASGI calls
+(no sockets, no HTTP client), so only the middleware cost differs.
+
+    python -m benchmarks.bench_middleware [--requests 5000] [--repeat 3]
+"""
+import argparse
+import asyncio
+import re
+import time
+
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware.error_handler import ErrorHandlingMiddleware, _error_response, _json
+from app.middleware.paths import CollapseSlashesMiddleware
+
+
+class LegacyErrorHandlingMiddleware(BaseHTTPMiddleware):
+    """The former BaseHTTPMiddleware implementation, kept here as the 'before' baseline."""
+
+    async def dispatch(self, request: Request, call_next):
+        try:
+            response = await call_next(request)
+        except Exception as e:
+            return _error_response(e, request.method, request.url.path)
+        path = request.url.path
+        if path not in ("/docs", "/redoc", "/openapi.json") and response.status_code in (404, 405):
+            if response.status_code == 404:
+                return _json(404, "HTTP_ERROR", "Not found")
+            if response.status_code == 405:
+                return _json(405, "HTTP_ERROR", "Method not allowed")
+        return response
+
+
+def _base_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+def build_bare() -> FastAPI:
+    return _base_app()
+
+
+def build_legacy() -> FastAPI:
+    app = _base_app()
+    app.add_middleware(LegacyErrorHandlingMiddleware)
+
+    @app.middleware("http")
+    async def collapse_slashes(request: Request, call_next):
+        path = request.scope.get("path", "")
+        if "//" in path:
+            request.scope["path"] = re.sub(r"/{2,}", "/", path)
+        return await call_next(request)
+
+    return app
+
+
+def build_asgi() -> FastAPI:
+    app = _base_app()
+    app.add_middleware(ErrorHandlingMiddleware)
+    app.add_middleware(CollapseSlashesMiddleware)
+    return app
+
+
+async def _drive(app, n: int) -> float:
+    """Send n GET /ping requests straight through the ASGI interface; return seconds per request."""
+    def make_receive():
+        sent = False
+
+        async def receive():
+            # like a server: the request body once, then block until "disconnect" (never)
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()
+
+        return receive
+
+    async def send(message):
+        pass
+
+    def scope():
+        return {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/ping", "raw_path": b"/ping", "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+            "state": {},
+        }
+
+    for _ in range(200):  # warm-up: builds the middleware stack and fills caches
+        await app(scope(), make_receive(), send)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await app(scope(), make_receive(), send)
+    return (time.perf_counter() - t0) / n
+
+
+async def main(requests: int, repeat: int) -> None:
+    variants = {"bare": build_bare(), "legacy (BaseHTTPMiddleware)": build_legacy(), "asgi": build_asgi()}
+    best = {}
+    for name, app in variants.items():
+        best[name] = min([await _drive(app, requests) for _ in range(repeat)])
+    base = best["bare"]
+    print(f"{'stack':<30}{'us/request':>12}{'overhead us':>14}")
+    for name, secs in best.items():
+        print(f"{name:<30}{secs * 1e6:>12.1f}{(secs - base) * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.repeat))
@@ -0,0 +1,76 @@
+"""Benchmark: cost of serializing a large task list.
+
+Compares the three ways GET /tasks can turn N tasks into a response body:
+  - default:  ORM objects -> response_model List[TaskOut] validation -> jsonable data -> json.dumps
+              (FastAPI with JSONResponse, the previous behaviour)
+  - orjson:   same pydantic validation, rendered by ORJSONResponse (now the app-wide default)
+  - rows:     (id, user_id, description, completed) rows -> orjson bytes, no pydantic models
+              (the path GET /tasks uses now)
+
+    python -m benchmarks.bench_serialization [--rows 10000] [--repeat 5]
+"""
+import argparse
+import json
+import time
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+from app.core.serialization import task_rows_to_json
+from app.schemas import TaskOut
+
+
+class _FakeTask:
+    """Attribute bag standing in for a loaded models.Task (from_attributes reads it the same way)."""
+    __slots__ = ("id", "user_id", "description", "completed")
+
+    def __init__(self, id, user_id, description, completed):
+        self.id, self.user_id, self.description, self.completed = id, user_id, description, completed
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(rows: int, repeat: int) -> None:
+    data = [(i, 1, f"task number {i} with a moderately long description", i % 3 == 0) for i in range(1, rows + 1)]
+    objs = [_FakeTask(*r) for r in data]
+    adapter = TypeAdapter(List[TaskOut])
+
+    def default():
+        validated = adapter.validate_python(objs, from_attributes=True)
+        content = adapter.dump_python(validated, mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+    def orjson_response():
+        validated = adapter.validate_python(objs, from_attributes=True)
+        return orjson.dumps(adapter.dump_python(validated, mode="json"))
+
+    def rows_path():
+        return task_rows_to_json(data)
+
+    assert orjson.loads(default()) == orjson.loads(rows_path())
+    results = {
+        "default (pydantic + json)": _best(default, repeat),
+        "orjson (pydantic + orjson)": _best(orjson_response, repeat),
+        "rows (orjson, no models)": _best(rows_path, repeat),
+    }
+    base = results["default (pydantic + json)"]
+    print(f"{rows} tasks, {len(rows_path()) / 1024:.0f} KiB body")
+    print(f"{'path':<30}{'ms':>10}{'speedup':>10}")
+    for name, secs in results.items():
+        print(f"{name:<30}{secs * 1e3:>10.2f}{base / secs:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
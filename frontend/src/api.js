@@ -10,7 +10,16 @@ const API_URL = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000";
  * @returns {Promise<Object>} The parsed JSON response from the API.
  * @throws {Error} If the request fails or the response is not OK.
  */
-async function request(path, { method = "GET", body, token } = {}) {
+async function request(path, options = {}) {
+  const { data } = await requestWithHeaders(path, options);
+  return data;
+}
+
+/**
+ * Same as `request`, but also returns the response headers.
+ * @returns {Promise<{data: Object, headers: Headers}>}
+ */
+async function requestWithHeaders(path, { method = "GET", body, token } = {}) {
   const headers = { "Content-Type": "application/json" };
   if (token) headers.Authorization = `Bearer ${token}`;
 
@@ -33,7 +42,50 @@ async function request(path, { method = "GET", body, token } = {}) {
     err.code = data?.error?.code;
     throw err;
   }
-  return data;
+  return { data, headers: res.headers };
+}
+
+/**
+ * Fetches every page of the user's tasks by following the X-Next-Cursor header.
+ * @param {string} token - The authentication token.
+ * @returns {Promise<Object[]>} All tasks of the user.
+ */
+async function listAllTasks(token) {
+  const tasks = [];
+  let after = null;
+  do {
+    const query = after ? `?after=${encodeURIComponent(after)}` : "";
+    const { data, headers } = await requestWithHeaders(`/tasks${query}`, { token });
+    tasks.push(...data);
+    after = headers.get("X-Next-Cursor");
+  } while (after);
+  return tasks;
+}
+
+// Most operations the backend accepts per POST /tasks/batch (TASKS_BATCH_MAX, 413 beyond)
+const BATCH_MAX = 1000;
+
+/**
+ * Applies any number of batch operations, BATCH_MAX per request (one transaction each).
+ * @param {string} token - The authentication token.
+ * @param {Object[]} operations - The create/update/delete operations.
+ * @returns {Promise<{results: Object[]}>} One result per operation, in order.
+ * @throws {Error} If a request fails; `err.results` holds the results of the requests applied before it.
+ */
+async function batchAllTasks(token, operations) {
+  const results = [];
+  for (let i = 0; i < operations.length; i += BATCH_MAX) {
+    try {
+      const data = await request("/tasks/batch", {
+        method: "POST", token, body: { operations: operations.slice(i, i + BATCH_MAX) },
+      });
+      results.push(...data.results);
+    } catch (err) {
+      err.results = results;
+      throw err;
+    }
+  }
+  return { results };
 }
 
 export const api = {
@@ -43,11 +95,15 @@ export const api = {
   login: (username, password) =>
     request("/login", { method: "POST", body: { username, password } }),
 
-  listTasks: (token) => request("/tasks", { token }),
+  listTasks: (token) => listAllTasks(token),
   addTask: (token, description) =>
     request("/tasks", { method: "POST", token, body: { description } }),
   updateTask: (token, id, patch) =>
     request(`/tasks/${id}`, { method: "PUT", token, body: patch }),
   deleteTask: (token, id) =>
     request(`/tasks/${id}`, { method: "DELETE", token }),
+  taskStats: (token) => request("/tasks/stats", { token }),
+  searchTasks: (token, q, limit = 50) =>
+    request(`/tasks/search?q=${encodeURIComponent(q)}&limit=${limit}`, { token }),
+  batchTasks: (token, operations) => batchAllTasks(token, operations),
 };
@@ -69,6 +69,30 @@ export default function TasksPage() {
     }
   };
 
+  const markAllDone = async () => {
+    setErr("");
+    const open = tasks.filter((x) => !x.completed);
+    if (open.length === 0) return;
+    const apply = (results) => {
+      const updated = new Map(results.filter((r) => r.ok).map((r) => [r.id, r.task]));
+      setTasks((prev) => prev.map((x) => updated.get(x.id) || x));
+      return results.find((r) => !r.ok);
+    };
+    try {
+      // one request / one transaction per 1000 tasks instead of one PUT per task
+      const { results } = await api.batchTasks(
+        token,
+        open.map((x) => ({ op: "update", id: x.id, completed: true }))
+      );
+      const failed = apply(results);
+      if (failed) setErr(mapTaskError(failed.error));
+    } catch (e) {
+      // batches sent before the failing one were applied
+      apply(e.results || []);
+      setErr(mapTaskError(e));
+    }
+  };
+
   const deleteTask = async (id) => {
     setErr("");
     try {
@@ -86,6 +110,7 @@ export default function TasksPage() {
         <div className="kpis">
           <span className="kpi">Total: {tasks.length}</span>
           <span className="kpi">Done: {tasks.filter(t=>t.completed).length}</span>
+          <button className="btn secondary" onClick={markAllDone}>Mark all done</button>
         </div>
       </div>
 